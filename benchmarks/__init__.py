@@ -0,0 +1 @@
+"""Headless benchmarks of the importer, see benchmarks/run.py"""
@@ -0,0 +1,559 @@
+"""Headless benchmarks of the importer, run with a plain Python and no Blender
+
+    python -m benchmarks.run                       # small preset, all scenarios
+    python -m benchmarks.run --preset medium --check
+    python -m benchmarks.run --scenario 'handler_*' --repeat 5
+
+Every scenario runs in its own process, so its peak RSS is its own. The results are appended
+to a JSON lines history and compared with the median of the last runs of the same scenario,
+preset and machine; --check exits with status 1 when throughput dropped or peak RSS grew by
+more than the threshold.
+"""
+import argparse
+import bz2
+import contextlib
+import datetime
+import fnmatch
+import functools
+import gzip
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import standin, synthetic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "osm-import-benchmarks")
+# history of the results in the workdir, out of the source tree
+HISTORY = "results.jsonl"
+# generator options of the file sizes, about 13 MB, 130 MB and 1.3 GB
+PRESETS = {
+    "small": {"ways": 20000},
+    "medium": {"ways": 200000},
+    "large": {"ways": 2000000},
+}
+# every import option on, so each handler gets its ways
+ALL_IMPORTS = {
+    "importBuildings": True, "importNaturals": True, "importHighways": True,
+    "importBarriers": True, "importLanduse": True,
+}
+NO_IMPORTS = {name: False for name in ALL_IMPORTS}
+# runs of the same scenario the new result is compared with
+BASELINE_RUNS = 5
+# the short scenarios repeat their work for at least this long to get stable rates
+MIN_SECONDS = 1.0
+# pool sizes of the scaling runs of the parallel node parsing
+SCALING_WORKERS = (1, 2, 4, 8, 16)
+
+
+def new_importer(keep_scene=False, **options):
+    """ImportRun of an operator with the options, as the operator makes it in execute()"""
+    standin.install()
+    if not keep_scene:
+        standin.reset()
+    from import_osm.operator import ImportRun, OsmParser
+    op = OsmParser()
+    for name, value in options.items():
+        setattr(op, name, value)
+    return ImportRun(op, ())
+
+
+def handler_names():
+    from import_osm.pipeline import Pipeline
+    return sorted(name for name in dir(Pipeline) if name.startswith("handler_"))
+
+
+# Scenarios: run in the child process, return the items done and the seconds taken
+def run_import(filename, spec, **options):
+    importer = new_importer(**options)
+    start = time.perf_counter()
+    importer.parse(filename)
+    importer.finish_index()
+    seconds = time.perf_counter() - start
+    report = importer.stats.report()
+    return {
+        "items": report["counts"]["ways"], "unit": "ways", "seconds": seconds,
+        "mb_per_s": os.path.getsize(filename) / seconds / 1e6,
+        "objects": report["counts"]["objects"], "stages": report["stages"],
+    }
+
+
+def scenario_read(filename, spec):
+    # all handlers off: reading and storing the nodes only
+    result = run_import(filename, spec, **NO_IMPORTS)
+    result.update(items=os.path.getsize(filename), unit="bytes")
+    return result
+
+
+def scrambled_nodes(spec):
+    """Ids and locations of 10 nodes per way of the spec, the ids in no order like in a merged extract"""
+    rng = random.Random(spec.seed)
+    for n in range(1, spec.ways * 10 + 1):
+        # a Lehmer generator step visits every id once
+        yield n * 48271 % 2147483647, spec.lat + rng.random() * spec.span, spec.lon + rng.random() * spec.span
+
+
+def run_node_lookups(store, spec):
+    start = time.perf_counter()
+    for node_id, lat, lon in scrambled_nodes(spec):
+        store.add(node_id, lat, lon)
+    for node_id, lat, lon in scrambled_nodes(spec):
+        store.get(node_id)
+    return {"items": len(store), "unit": "nodes", "seconds": time.perf_counter() - start}
+
+
+class DictNodes(dict):
+    """The dict of (lat, lon, tags) tuples the node store replaced"""
+
+    def add(self, node_id, lat, lon, tags=None):
+        self[node_id] = (lat, lon, tags)
+
+
+def scenario_node_store(filename, spec):
+    # adding and looking up unsorted nodes, the peak RSS is that of the store
+    from import_osm.nodes import NodeStore
+    return run_node_lookups(NodeStore(), spec)
+
+
+def scenario_node_dict(filename, spec):
+    # the same nodes in a dict, what the node store is compared with
+    return run_node_lookups(DictNodes(), spec)
+
+
+def scenario_read_workers(workers, filename, spec):
+    # the node section parsed by a pool of workers, 1 is the serial parser
+    result = run_import(filename, spec, parallelWorkers=workers, **NO_IMPORTS)
+    result.update(items=os.path.getsize(filename), unit="bytes")
+    return result
+
+
+def scenario_import(filename, spec):
+    return run_import(filename, spec, **ALL_IMPORTS)
+
+
+def scenario_import_merged(filename, spec):
+    return run_import(filename, spec, mergeMeshes=True, **ALL_IMPORTS)
+
+
+def scenario_import_tag_table(filename, spec):
+    # the tags as key and value ids into the scene string table instead of a property per key
+    return run_import(filename, spec, tagStorage="TABLE", **ALL_IMPORTS)
+
+
+def scenario_import_merged_tag_table(filename, spec):
+    return run_import(filename, spec, mergeMeshes=True, tagStorage="TABLE", **ALL_IMPORTS)
+
+
+def scenario_import_relations(filename, spec):
+    # the multipolygon relations read first, their member ways kept and joined after the ways
+    return run_import(filename, spec, importRelations=True, **ALL_IMPORTS)
+
+
+def scenario_import_points(filename, spec):
+    # a file with scattered tagged nodes next to the ways, collected into point clouds
+    points_file = os.path.join(os.path.dirname(filename), "synthetic_points.osm")
+    if not os.path.exists(points_file):
+        synthetic.generate(points_file, synthetic.Spec(**dict(spec.describe(), nodes=spec.ways * 20)))
+    importer = new_importer(importPoints=True, **ALL_IMPORTS)
+    start = time.perf_counter()
+    importer.parse(points_file)
+    seconds = time.perf_counter() - start
+    return {"items": importer.stats.counts["points"], "unit": "points", "seconds": seconds,
+            "mb_per_s": os.path.getsize(points_file) / seconds / 1e6,
+            "objects": importer.stats.counts["objects"], "stages": importer.stats.stages}
+
+
+def detailed_file(filename, spec):
+    # landuse and natural outlines of 500 points, like coastlines and forests
+    areas_file = os.path.join(os.path.dirname(filename), "synthetic_areas.osm")
+    if not os.path.exists(areas_file):
+        synthetic.generate(areas_file, synthetic.Spec(**dict(spec.describe(), area_points=500)))
+    return areas_file
+
+
+def scenario_import_detailed(filename, spec):
+    return run_import(detailed_file(filename, spec), spec, **ALL_IMPORTS)
+
+
+def scenario_import_simplified(filename, spec):
+    # the same file with the outlines simplified to 1 m
+    return run_import(detailed_file(filename, spec), spec, simplifyTolerance=1.0, **ALL_IMPORTS)
+
+
+def compressed_file(filename, opener, extension):
+    # the file as downloaded, compressed once per spec
+    path = filename + extension
+    if not os.path.exists(path):
+        with open(filename, "rb") as f, opener(path + ".tmp", "wb") as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def scenario_import_bz2(filename, spec):
+    # decompressed by a thread while parsing
+    return run_import(compressed_file(filename, bz2.open, ".bz2"), spec, **ALL_IMPORTS)
+
+
+def scenario_import_bz2_parallel(filename, spec):
+    # the blocks decompressed by a process pool of a worker per cpu
+    return run_import(compressed_file(filename, bz2.open, ".bz2"), spec,
+                      parallelWorkers=max(os.cpu_count() or 1, 2), **ALL_IMPORTS)
+
+
+def scenario_import_gz(filename, spec):
+    return run_import(compressed_file(filename, gzip.open, ".gz"), spec, **ALL_IMPORTS)
+
+
+def scenario_decompress_import(filename, spec):
+    # what the compressed scenarios replace: decompressing to a temporary file first
+    compressed = compressed_file(filename, bz2.open, ".bz2")
+    decompressed = os.path.join(os.path.dirname(filename), "decompressed.osm")
+    start = time.perf_counter()
+    with bz2.open(compressed, "rb") as f, open(decompressed, "wb") as out:
+        shutil.copyfileobj(f, out, 1024 * 1024)
+    seconds = time.perf_counter() - start
+    try:
+        result = run_import(decompressed, spec, **ALL_IMPORTS)
+    finally:
+        os.remove(decompressed)
+    result["stages"]["decompress"] = seconds
+    result["seconds"] += seconds
+    result["mb_per_s"] = os.path.getsize(compressed) / result["seconds"] / 1e6
+    return result
+
+
+def cache_options(filename):
+    return dict(ALL_IMPORTS, useCache=True, cacheDir=os.path.join(os.path.dirname(filename), "cache"))
+
+
+def scenario_cache_build(filename, spec):
+    options = cache_options(filename)
+    shutil.rmtree(options["cacheDir"], ignore_errors=True)
+    return run_import(filename, spec, **options)
+
+
+def scenario_import_cached(filename, spec):
+    # needs the entry written by cache_build
+    return run_import(filename, spec, **cache_options(filename))
+
+
+def geometry_file(filename):
+    return os.path.join(os.path.dirname(filename), "synthetic.osmgeom")
+
+
+def scenario_preprocess(filename, spec):
+    # the bpy-free pipeline writing merged meshes to a geometry file
+    from import_osm.preprocess import preprocess
+    start = time.perf_counter()
+    stats = preprocess(filename, geometry_file(filename), dict(ALL_IMPORTS, mergeMeshes=True))
+    seconds = time.perf_counter() - start
+    return {"items": stats.counts["ways"], "unit": "ways", "seconds": seconds,
+            "mb_per_s": os.path.getsize(filename) / seconds / 1e6, "stages": stats.stages}
+
+
+def scenario_load_geometry(filename, spec):
+    # needs the file written by preprocess
+    return run_import(geometry_file(filename), spec, **ALL_IMPORTS)
+
+
+def index_dir(filename):
+    return os.path.join(os.path.dirname(filename), "index")
+
+
+def scenario_import_indexed(filename, spec):
+    # the import writing an update index
+    shutil.rmtree(index_dir(filename), ignore_errors=True)
+    return run_import(filename, spec, updateIndex=index_dir(filename), **ALL_IMPORTS)
+
+
+def scenario_update(filename, spec):
+    # an osmChange of 1% of the ways applied to an import of the file, the objects and index are made first
+    changes = os.path.join(os.path.dirname(filename), "synthetic.osc")
+    if not os.path.exists(changes):
+        synthetic.generate_changes(changes, spec, max(spec.ways // 100, 1))
+    scenario_import_indexed(filename, spec)
+    importer = new_importer(keep_scene=True, updateIndex=index_dir(filename))
+    start = time.perf_counter()
+    importer.parse(changes)
+    importer.finish_index()
+    seconds = time.perf_counter() - start
+    return {"items": importer.stats.counts["ways"], "unit": "ways", "seconds": seconds,
+            "objects": importer.stats.counts["objects"], "stages": importer.stats.stages}
+
+
+def scenario_dispatch(filename, spec):
+    # way_handler with the rule table but handlers doing nothing
+    from import_osm.rules import DEFAULT_RULES, WayClassifier
+    importer = new_importer(**ALL_IMPORTS)
+    handlers = {}
+    for name in handler_names():
+        handlers[name[len("handler_"):]] = noop = (lambda: None)
+        noop.__name__ = name
+    importer.classifier = WayClassifier(DEFAULT_RULES, handlers, lambda option: True)
+    ways = [{"id": str(n), "nodes": [], "points": [], "tags": dict(tags)}
+            for n, (key, tags, points, center) in enumerate(synthetic.shapes(spec), 1)]
+    items = 0
+    start = time.perf_counter()
+    while items == 0 or time.perf_counter() - start < MIN_SECONDS:
+        for way in ways:
+            importer.curr_way = way
+            importer.way_handler()
+        items += len(ways)
+    return {"items": items, "unit": "ways", "seconds": time.perf_counter() - start}
+
+
+def scenario_handler(name, spec):
+    # one handler called directly on the ways routed to it, with their nodes projected
+    from import_osm.nodes import NodeStore
+    importer = new_importer(**ALL_IMPORTS)
+    importer.classifier = importer.create_classifier()
+    importer.start_bounds({"minlat": spec.lat, "minlon": spec.lon,
+                           "maxlat": spec.lat + spec.span, "maxlon": spec.lon + spec.span})
+    importer.nodes = NodeStore()
+    handler = getattr(importer, name)
+    ways = []
+    for n, (key, tags, points, center) in enumerate(synthetic.shapes(spec), 1):
+        tags = dict(tags)
+        if handler not in importer.classifier.classify(tags):
+            continue
+        first = len(importer.nodes)
+        for lat, lon in points:
+            importer.nodes.add(len(importer.nodes) + 1, lat, lon)
+        indices = list(range(first, len(importer.nodes)))
+        if key not in synthetic.LINES:
+            indices.append(first)
+        ways.append({"id": str(n), "nodes": [i + 1 for i in indices], "points": indices, "tags": tags})
+    importer.nodes.project(importer.lon, importer.lat_rad, importer.radius)
+    items = 0
+    seconds = 0.0
+    while ways and seconds < MIN_SECONDS:
+        # the objects of the last pass are dropped, so the peak RSS is that of one pass
+        standin.reset()
+        start = time.perf_counter()
+        for way in ways:
+            importer.curr_way = way
+            handler()
+        importer.flush_geometry()
+        seconds += time.perf_counter() - start
+        items += len(ways)
+    return {"items": items, "unit": "ways", "seconds": seconds, "objects": importer.stats.counts["objects"]}
+
+
+SCENARIOS = {
+    "read": scenario_read,
+    "node_store": scenario_node_store,
+    "node_dict": scenario_node_dict,
+    "import": scenario_import,
+    "import_merged": scenario_import_merged,
+    "import_tag_table": scenario_import_tag_table,
+    "import_merged_tag_table": scenario_import_merged_tag_table,
+    "import_relations": scenario_import_relations,
+    "import_points": scenario_import_points,
+    "import_detailed": scenario_import_detailed,
+    "import_simplified": scenario_import_simplified,
+    "import_bz2": scenario_import_bz2,
+    "import_bz2_parallel": scenario_import_bz2_parallel,
+    "import_gz": scenario_import_gz,
+    "decompress_import": scenario_decompress_import,
+    "cache_build": scenario_cache_build,
+    "import_cached": scenario_import_cached,
+    "preprocess": scenario_preprocess,
+    "load_geometry": scenario_load_geometry,
+    "import_indexed": scenario_import_indexed,
+    "update": scenario_update,
+    "dispatch": scenario_dispatch,
+}
+SCENARIOS.update(("read_workers_%d" % workers, functools.partial(scenario_read_workers, workers))
+                 for workers in SCALING_WORKERS)
+# scenarios using the output of another one
+REQUIRES = {
+    "import_cached": "cache_build",
+    "load_geometry": "preprocess",
+}
+
+
+def scenario_names():
+    return list(SCENARIOS) + handler_names()
+
+
+def run_child(name, filename, spec):
+    from import_osm.stats import peak_memory
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if name in SCENARIOS:
+            result = SCENARIOS[name](filename, spec)
+        else:
+            result = scenario_handler(name, spec)
+    result["peak_rss"] = peak_memory()
+    print(json.dumps(result))
+
+
+def run_scenario(name, filename, spec):
+    """Result of one scenario in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--child", name, "--file", filename,
+         "--spec", json.dumps(spec.describe())],
+        cwd=ROOT, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# History of the results
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine():
+    """Results are only compared with those of the same kind of machine and Python"""
+    return "%s %s %d cpus, Python %s" % (platform.system(), platform.machine(), os.cpu_count() or 1,
+                                         platform.python_version())
+
+
+def spec_key(spec):
+    # files of an older generator are not reused
+    spec = dict(spec.describe(), version=synthetic.VERSION)
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def read_history(filename):
+    records = []
+    if os.path.exists(filename):
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def baseline(history, record):
+    """Median throughput and peak RSS of the last runs comparable with the record"""
+    runs = [r for r in history if r["scenario"] == record["scenario"] and r["spec"] == record["spec"]
+            and r["machine"] == record["machine"]][-BASELINE_RUNS:]
+    if not runs:
+        return None
+    rss = [r["peak_rss"] for r in runs if r.get("peak_rss")]
+    return statistics.median(r["rate"] for r in runs), statistics.median(rss) if rss else None
+
+
+def compare(record, base, threshold):
+    """Change against the baseline and whether it is a regression"""
+    if base is None:
+        return "", False
+    rate, rss = base
+    change = record["rate"] / rate - 1.0
+    text = "%+.1f%%" % (change * 100)
+    regressed = change < -threshold
+    if rss and record.get("peak_rss"):
+        rss_change = record["peak_rss"] / rss - 1.0
+        text += " rss %+.1f%%" % (rss_change * 100)
+        regressed = regressed or rss_change > threshold
+    return text, regressed
+
+
+def prepare_file(spec, workdir):
+    """The synthetic file of the spec, generated once per spec"""
+    path = os.path.join(workdir, spec_key(spec))
+    filename = os.path.join(path, "synthetic.osm")
+    if not os.path.exists(filename):
+        os.makedirs(path, exist_ok=True)
+        print("Generating", filename)
+        synthetic.generate(filename + ".tmp", spec)
+        os.replace(filename + ".tmp", filename)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the headless benchmarks of the importer")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--ways", type=int, default=None, help="ways of the synthetic file instead of the preset")
+    parser.add_argument("--buildings", type=float, default=None, help="share of the ways which are buildings")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenario", action="append", default=None,
+                        help="run only scenarios matching this pattern, may be repeated")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the fastest is kept")
+    parser.add_argument("--history", help="JSON lines file of the results, results.jsonl in the workdir by default")
+    parser.add_argument("--no-record", action="store_true", help="compare without appending to the history")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative drop of throughput or growth of peak RSS counted as a regression")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="directory of the generated files")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--spec", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.file, synthetic.Spec(**json.loads(args.spec)))
+        return
+    names = scenario_names()
+    if args.list:
+        print("\n".join(names))
+        return
+    if args.scenario:
+        names = [name for name in names if any(fnmatch.fnmatch(name, pattern) for pattern in args.scenario)]
+    for name, required in REQUIRES.items():
+        if name in names and required not in names:
+            names.insert(names.index(name), required)
+
+    options = dict(PRESETS[args.preset], buildings=args.buildings, seed=args.seed)
+    if args.ways:
+        options["ways"] = args.ways
+    spec = synthetic.Spec(**options)
+    filename = prepare_file(spec, args.workdir)
+    if not args.history:
+        args.history = os.path.join(args.workdir, HISTORY)
+    history = read_history(args.history)
+    common = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": revision(),
+        "machine": machine(),
+        "preset": args.preset if not args.ways else None,
+        "spec": spec_key(spec),
+    }
+
+    regressions = []
+    records = []
+    print("%-24s %12s %-10s %8s %8s  %s" % ("scenario", "rate", "unit", "seconds", "rss MB", "vs baseline"))
+    for name in names:
+        results = [run_scenario(name, filename, spec) for n in range(max(args.repeat, 1))]
+        best = min(results, key=lambda result: result["seconds"])
+        if not best["items"]:
+            print("%-24s %12s" % (name, "no items"))
+            continue
+        record = dict(common, scenario=name, **best)
+        record["rate"] = best["items"] / best["seconds"]
+        rss = [result["peak_rss"] for result in results if result["peak_rss"]]
+        record["peak_rss"] = min(rss) if rss else None
+        change, regressed = compare(record, baseline(history, record), args.threshold)
+        print("%-24s %12.0f %-10s %8.2f %8s  %s%s" % (
+            name, record["rate"], record["unit"] + "/s", record["seconds"],
+            "%d" % (record["peak_rss"] // (1024 * 1024)) if record["peak_rss"] else "-",
+            change, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+        records.append(record)
+
+    if not args.no_record:
+        with open(args.history, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+    if regressions:
+        print("Regressions:", ", ".join(regressions))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Minimal stand-ins for the bpy, bmesh and bpy_extras modules used by the addon
+
+Only what the operator touches is there and it does as little as possible, so the timings are
+those of the addon code. Meshes keep their vertex, edge and face counts, objects their custom
+properties.
+"""
+import sys
+import types
+
+
+class _Property:
+    """2.79 style class attribute: the operator sees the default value until it is set"""
+
+    def __init__(self, default=None, **kwargs):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        return self.default
+
+
+class Operator:
+    def report(self, level, message):
+        print(next(iter(level)) if isinstance(level, set) else level, message)
+
+    def as_keywords(self, ignore=()):
+        names = {name for cls in type(self).__mro__ for name, value in vars(cls).items()
+                 if isinstance(value, _Property)}
+        return {name: getattr(self, name) for name in names if name not in ignore}
+
+
+class ImportHelper:
+    filepath = ""
+
+
+class _Items:
+    """Vertices, edges, loops or polygons of a mesh, only counted"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, count):
+        self.count += count
+
+    def foreach_set(self, attribute, values):
+        pass
+
+
+class _Layers:
+    def __init__(self):
+        self.layers = {}
+
+    def new(self, name, type=None, domain=None):
+        layer = self.layers[name] = types.SimpleNamespace(data=_Items())
+        return layer
+
+
+class Mesh:
+    # objects are not counted
+    users = 0
+
+    def __init__(self, name):
+        self.name = name
+        self.vertices = _Items()
+        self.edges = _Items()
+        self.loops = _Items()
+        self.polygons = _Items()
+        self.materials = []
+        self.attributes = _Layers()
+
+    def update(self, calc_edges=False):
+        pass
+
+
+class Object(dict):
+    def __init__(self, name, data):
+        super().__init__()
+        self.name = name
+        self.data = data
+        self.parent = None
+
+    def __bool__(self):
+        return True
+
+    def __hash__(self):
+        return id(self)
+
+    def __eq__(self, other):
+        return self is other
+
+    def select_set(self, state):
+        pass
+
+
+class Material:
+    def __init__(self, name):
+        self.name = name
+        self.diffuse_color = None
+
+
+class _ObjectLinks(list):
+    def link(self, obj):
+        self.append(obj)
+
+
+class Collection:
+    def __init__(self, name):
+        self.name = name
+        self.objects = _ObjectLinks()
+        self.children = _ObjectLinks()
+
+
+class _Datablocks(dict):
+    """bpy.data collection, names are made unique like Blender does"""
+
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+        self.suffixes = {}
+
+    def new(self, name, *args):
+        unique = name
+        while unique in self:
+            n = self.suffixes[name] = self.suffixes.get(name, 0) + 1
+            unique = "%s.%03d" % (name, n)
+        item = self[unique] = self.kind(unique, *args)
+        return item
+
+    def clear(self):
+        super().clear()
+        self.suffixes.clear()
+
+    def remove(self, item):
+        self.pop(item.name, None)
+
+
+class _Objects(_Datablocks):
+    def remove(self, obj):
+        super().remove(obj)
+        for collection in _data.collections.values():
+            if obj in collection.objects:
+                collection.objects.remove(obj)
+
+
+class _Scene:
+    def __init__(self):
+        self.collection = Collection("Scene Collection")
+        self.objects = types.SimpleNamespace(active=None)
+
+    def update(self):
+        pass
+
+
+class _Context:
+    def __init__(self):
+        self.scene = _Scene()
+        self.view_layer = types.SimpleNamespace(objects=types.SimpleNamespace(active=None))
+        self.active_object = None
+
+
+def _empty_add(type=None, location=(0, 0, 0)):
+    obj = _data.objects.new("Empty", None)
+    _context.scene.collection.objects.link(obj)
+    _context.active_object = obj
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+_data = types.SimpleNamespace(
+    # an unsaved blend file
+    filepath="",
+    meshes=_Datablocks(Mesh),
+    objects=_Objects(Object),
+    materials=_Datablocks(Material),
+    collections=_Datablocks(Collection),
+)
+_context = _Context()
+
+
+def reset():
+    """Forget all datablocks and the scene"""
+    global _context
+    for datablocks in vars(_data).values():
+        if isinstance(datablocks, _Datablocks):
+            datablocks.clear()
+    _context = _Context()
+    sys.modules["bpy"].context = _context
+
+
+def object_count():
+    return len(_data.objects)
+
+
+class BMVert:
+    __slots__ = ("co", "index", "link_faces")
+
+    def __init__(self, co):
+        self.co = co
+        self.index = -1
+        self.link_faces = ()
+
+
+class BMEdge:
+    __slots__ = ("verts", "link_faces")
+
+    def __init__(self, verts):
+        self.verts = verts
+        self.link_faces = ()
+
+
+class BMFace:
+    __slots__ = ("verts", "material_index")
+
+    def __init__(self, verts):
+        self.verts = verts
+        self.material_index = 0
+
+
+class _Sequence(list):
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+
+    def new(self, arg):
+        item = self.kind(arg)
+        self.append(item)
+        return item
+
+    def index_update(self):
+        for i, item in enumerate(self):
+            item.index = i
+
+
+class BMesh:
+    def __init__(self):
+        self.verts = _Sequence(BMVert)
+        self.edges = _Sequence(BMEdge)
+        self.faces = _Sequence(BMFace)
+
+    def normal_update(self):
+        pass
+
+    def to_mesh(self, mesh):
+        mesh.vertices.add(len(self.verts))
+        mesh.edges.add(len(self.edges))
+        mesh.polygons.add(len(self.faces))
+        mesh.loops.add(sum(len(face.verts) for face in self.faces))
+
+    def free(self):
+        pass
+
+
+def install():
+    """Register the stand-ins in sys.modules, import_osm.operator can be imported afterwards"""
+    if "bpy" in sys.modules:
+        return
+    bpy = types.ModuleType("bpy")
+    bpy.app = types.SimpleNamespace(version=(2, 83, 0))
+    bpy.props = types.SimpleNamespace(**{name: _Property for name in (
+        "BoolProperty", "EnumProperty", "FloatProperty", "IntProperty", "StringProperty")})
+    bpy.types = types.SimpleNamespace(Operator=Operator)
+    bpy.data = _data
+    bpy.context = _context
+    bpy.path = types.SimpleNamespace(abspath=lambda path, start=None: path)
+    bpy.utils = types.SimpleNamespace(register_class=_noop, unregister_class=_noop)
+    bpy.ops = types.SimpleNamespace(object=types.SimpleNamespace(
+        select_all=_noop, empty_add=_empty_add, parent_set=_noop))
+
+    bmesh = types.ModuleType("bmesh")
+    bmesh.new = BMesh
+    bmesh.types = types.SimpleNamespace(BMVert=BMVert, BMEdge=BMEdge, BMFace=BMFace)
+
+    bpy_extras = types.ModuleType("bpy_extras")
+    io_utils = types.ModuleType("bpy_extras.io_utils")
+    io_utils.ImportHelper = ImportHelper
+    bpy_extras.io_utils = io_utils
+
+    sys.modules.update({"bpy": bpy, "bmesh": bmesh, "bpy_extras": bpy_extras, "bpy_extras.io_utils": io_utils})
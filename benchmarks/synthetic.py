@@ -0,0 +1,372 @@
+"""Deterministic synthetic .osm files for the benchmarks
+
+The same options and seed always give the same file. Nodes, ways and relations are written
+while they are generated, so files of several GB need no more memory than small ones:
+
+    python -m benchmarks.synthetic city.osm --ways 200000 --buildings 0.6
+    python -m benchmarks.synthetic planet-ish.osm --size 4G
+    python -m benchmarks.synthetic city.osc --ways 200000 --changes 1000
+"""
+import argparse
+import bisect
+import io
+import math
+import random
+
+# metres per degree of latitude
+DEGREE = 2 * math.pi * 6378137 / 360
+# share of the ways per main key, "" are ways no rule imports
+DEFAULT_MIX = {
+    "building": 45, "highway": 25, "landuse": 7, "natural": 5, "barrier": 5, "amenity": 4,
+    "building:part": 4, "leisure": 3, "man_made": 1, "": 1,
+}
+VALUES = {
+    "building": ["yes", "house", "apartments", "residential", "garage", "commercial"],
+    "building:part": ["yes", "roof"],
+    "highway": ["residential", "service", "footway", "primary", "track", "path"],
+    "landuse": ["grass", "residential", "forest", "meadow", "industrial", "farmland"],
+    "natural": ["water", "wood", "scrub", "grassland"],
+    "barrier": ["fence", "wall", "hedge", "retaining_wall"],
+    "amenity": ["parking", "school", "place_of_worship", "fuel"],
+    "leisure": ["park", "pitch", "playground", "garden"],
+    "man_made": ["pier", "bridge"],
+    "": ["survey"],
+}
+# keys drawn as open lines, the others as closed rings
+LINES = {"highway", "barrier", "man_made"}
+# keys of the areas which are the outer rings of the multipolygons
+AREAS = ("landuse", "natural", "leisure")
+# size of the inner ring of a multipolygon relative to its outer ring
+INNER_SCALE = 0.5
+# bump when the files written for the same spec change
+VERSION = 2
+# tags of the nodes which are not part of a way
+NODE_TAGS = [("natural", "tree"), ("amenity", "bench"), ("highway", "street_lamp"), ("power", "pole")]
+# ways generated to estimate the bytes per way for a target file size
+SAMPLE_WAYS = 2000
+
+
+def parse_size(text):
+    """Bytes of a size like 500M or 4G"""
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_mix(text):
+    """Mix like building=60,highway=30,landuse=10"""
+    mix = {}
+    for item in text.split(","):
+        key, weight = item.split("=")
+        if key.strip() not in VALUES:
+            raise Exception("Unknown key in the tag mix: " + key)
+        mix[key.strip()] = float(weight)
+    return mix
+
+
+class Spec:
+    """What to generate, nodes=0 gives just the nodes the ways need"""
+
+    def __init__(self, ways=10000, nodes=0, relations=None, mix=None, buildings=None, seed=1,
+                 lat=55.0, lon=37.0, span=0.1, node_tag_share=0.2, area_points=0):
+        self.ways = ways
+        self.nodes = nodes
+        self.relations = ways // 100 if relations is None else relations
+        mix = dict(mix or DEFAULT_MIX)
+        if buildings is not None and buildings >= 1:
+            mix = {"building": 1.0}
+        elif buildings is not None:
+            # building density: the share of the ways which are buildings
+            others = sum(weight for key, weight in mix.items() if key != "building")
+            mix["building"] = others * buildings / (1.0 - buildings)
+        self.mix = mix
+        self.seed = seed
+        self.lat = lat
+        self.lon = lon
+        self.span = span
+        self.node_tag_share = node_tag_share
+        self.area_points = area_points
+
+    def describe(self):
+        spec = {
+            "ways": self.ways, "nodes": self.nodes, "relations": self.relations, "mix": self.mix,
+            "seed": self.seed, "lat": self.lat, "lon": self.lon, "span": self.span,
+            "node_tag_share": self.node_tag_share,
+        }
+        if self.area_points:
+            # only when set, the specs of earlier files keep their keys
+            spec["area_points"] = self.area_points
+        return spec
+
+
+def shapes(spec):
+    """Yield key, tags, the lat/lon points and the lat/lon center of every way, the same for the same spec
+
+    The rings of the closed ways go round their center, any ray from it crosses them once.
+    """
+    rng = random.Random(spec.seed)
+    keys = list(spec.mix)
+    cumulative = []
+    total = 0.0
+    for key in keys:
+        total += spec.mix[key]
+        cumulative.append(total)
+    cos_lat = math.cos(math.radians(spec.lat + spec.span * 0.5))
+    for n in range(spec.ways):
+        r = rng.random() * total
+        key = keys[bisect.bisect_right(cumulative, r)]
+        lat = spec.lat + rng.random() * spec.span
+        lon = spec.lon + rng.random() * spec.span
+        tags = [(key, rng.choice(VALUES[key]))] if key else [("source", "survey")]
+        if key in LINES:
+            # a random walk with steps of 10-50 m
+            count = rng.randint(2, 12)
+            points = []
+            heading = rng.random() * 2 * math.pi
+            for i in range(count):
+                points.append((lat, lon))
+                heading += rng.uniform(-0.5, 0.5)
+                step = rng.uniform(10, 50) / DEGREE
+                lat += step * math.sin(heading)
+                lon += step * math.cos(heading) / cos_lat
+            if key == "highway" and rng.random() < 0.5:
+                tags.append(("name", "Street %d" % rng.randrange(1000)))
+            elif key == "barrier" and rng.random() < 0.3:
+                tags.append(("height", "%.1f" % rng.uniform(0.5, 3)))
+        else:
+            # a ring of 4-8 corners, buildings 5-30 m across, areas 50-300 m
+            count = rng.randint(4, 8)
+            radius = rng.uniform(5, 30) if key.startswith("building") else rng.uniform(50, 300)
+            radius /= DEGREE
+            start = rng.random() * 2 * math.pi
+            scale = [1.0] * count
+            if spec.area_points and not key.startswith("building"):
+                # a detailed outline: the radius a random walk which closes on itself
+                count = spec.area_points
+                walk = [0.0]
+                for i in range(count - 1):
+                    walk.append(walk[-1] + rng.gauss(0, 1))
+                walk = [w - walk[-1] * i / count for i, w in enumerate(walk)]
+                top = max(abs(w) for w in walk) or 1.0
+                scale = [1.0 + 0.5 * w / top for w in walk]
+            points = [(lat + radius * scale[i] * math.sin(start + i * 2 * math.pi / count),
+                       lon + radius * scale[i] * math.cos(start + i * 2 * math.pi / count) / cos_lat)
+                      for i in range(count)]
+            if key.startswith("building"):
+                r = rng.random()
+                if r < 0.4:
+                    tags.append(("building:levels", str(rng.randint(1, 12))))
+                elif r < 0.6:
+                    tags.append(("height", rng.choice(("%d", "%.1f", "%.1f m")) % rng.uniform(3, 60)))
+                if key == "building:part" and rng.random() < 0.3:
+                    tags.append(("min_height", "%d" % rng.randint(1, 3)))
+                if rng.random() < 0.3:
+                    tags.append(("addr:street", "Street %d" % rng.randrange(1000)))
+                    tags.append(("addr:housenumber", str(rng.randint(1, 200))))
+            elif rng.random() < 0.2:
+                tags.append(("name", "Area %d" % n))
+        yield key, tags, points, (lat, lon)
+
+
+def inner_ring(points, center):
+    """The points of a closed way scaled towards its center, inside the way"""
+    lat, lon = center
+    return [(lat + (p_lat - lat) * INNER_SCALE, lon + (p_lon - lon) * INNER_SCALE) for p_lat, p_lon in points]
+
+
+def escape(text):
+    return text.replace("&", "&amp;").replace('"', "&quot;").replace("<", "&lt;")
+
+
+def write(f, spec):
+    """Write the file for the spec to the text stream f, returns the counts of the elements"""
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="osm-import benchmarks">\n')
+    f.write(' <bounds minlat="%.7f" minlon="%.7f" maxlat="%.7f" maxlon="%.7f"/>\n' % (
+        spec.lat, spec.lon, spec.lat + spec.span, spec.lon + spec.span))
+    # first pass: the nodes of the ways, then the free ones, ids ascending like in real files
+    node_id = 0
+    inners = []
+    for key, tags, points, center in shapes(spec):
+        for lat, lon in points:
+            node_id += 1
+            f.write(' <node id="%d" version="1" lat="%.7f" lon="%.7f"/>\n' % (node_id, lat, lon))
+        if key in AREAS and len(inners) < spec.relations:
+            inners.append(inner_ring(points, center))
+    rng = random.Random(spec.seed + 1)
+    for n in range(node_id, max(spec.nodes, node_id)):
+        node_id += 1
+        lat = spec.lat + rng.random() * spec.span
+        lon = spec.lon + rng.random() * spec.span
+        if rng.random() < spec.node_tag_share:
+            k, v = rng.choice(NODE_TAGS)
+            f.write(' <node id="%d" version="1" lat="%.7f" lon="%.7f">\n  <tag k="%s" v="%s"/>\n </node>\n' % (
+                node_id, lat, lon, k, v))
+        else:
+            f.write(' <node id="%d" version="1" lat="%.7f" lon="%.7f"/>\n' % (node_id, lat, lon))
+    # the nodes of the inner rings of the multipolygons
+    inner_refs = []
+    for ring in inners:
+        inner_refs.append(list(range(node_id + 1, node_id + len(ring) + 1)))
+        for lat, lon in ring:
+            node_id += 1
+            f.write(' <node id="%d" version="1" lat="%.7f" lon="%.7f"/>\n' % (node_id, lat, lon))
+    # second pass: the ways, generated again from the same seed
+    ref = 0
+    outers = []
+    for way_id, (key, tags, points, center) in enumerate(shapes(spec), 1):
+        f.write(' <way id="%d" version="1">\n' % way_id)
+        first = ref + 1
+        for i in range(len(points)):
+            ref += 1
+            f.write('  <nd ref="%d"/>\n' % ref)
+        if key not in LINES:
+            f.write('  <nd ref="%d"/>\n' % first)
+            if key in AREAS and len(outers) < spec.relations:
+                outers.append(way_id)
+        for k, v in tags:
+            f.write('  <tag k="%s" v="%s"/>\n' % (k, escape(v)))
+        f.write(' </way>\n')
+    # the untagged inner rings, numbered after the other ways
+    for n, refs in enumerate(inner_refs):
+        f.write(way_xml(spec.ways + n + 1, refs + refs[:1], [], 1))
+    # multipolygons of the closed areas, an outer and an inner ring each
+    relations = len(outers)
+    for n in range(relations):
+        f.write(' <relation id="%d" version="1">\n' % (n + 1))
+        f.write('  <member type="way" ref="%d" role="outer"/>\n' % outers[n])
+        f.write('  <member type="way" ref="%d" role="inner"/>\n' % (spec.ways + n + 1))
+        f.write('  <tag k="type" v="multipolygon"/>\n  <tag k="landuse" v="forest"/>\n')
+        f.write(' </relation>\n')
+    f.write('</osm>\n')
+    return {"nodes": node_id, "ways": spec.ways + relations, "relations": relations}
+
+
+def write_changes(f, spec, count, seed=1):
+    """Write an osmChange file for count ways of the file of the spec to the text stream f
+
+    A way has its nodes moved, its tags changed, or is deleted with its nodes, and for every
+    tenth change a new way is created. Returns the counts of the elements per action.
+    """
+    ways = []
+    node_id = 0
+    inners = []
+    for key, tags, points, center in shapes(spec):
+        ways.append((key, tags, points, node_id + 1))
+        node_id += len(points)
+        if key in AREAS and len(inners) < spec.relations:
+            inners.append(len(points))
+    # created elements are numbered after the inner rings of the multipolygons
+    next_node = max(spec.nodes, node_id) + sum(inners)
+    next_way = len(ways) + len(inners)
+    rng = random.Random(seed)
+    changed = sorted(rng.sample(range(len(ways)), min(count, len(ways))))
+    counts = {"create": 0, "modify": 0, "delete": 0}
+    # the elements per action
+    actions = {"create": [], "modify": [], "delete": []}
+    for n, i in enumerate(changed):
+        key, tags, points, first = ways[i]
+        way_id = i + 1
+        refs = list(range(first, first + len(points)))
+        if key not in LINES:
+            refs.append(first)
+        r = rng.random()
+        if r < 0.5:
+            # moved by up to 5 m
+            for ref, (lat, lon) in zip(refs, points):
+                lat += rng.uniform(-5, 5) / DEGREE
+                lon += rng.uniform(-5, 5) / DEGREE
+                actions["modify"].append(' <node id="%d" version="2" lat="%.7f" lon="%.7f"/>\n' % (ref, lat, lon))
+        elif r < 0.8:
+            if key.startswith("building"):
+                tags = tags + [("height", "%d" % rng.randint(3, 40))]
+            else:
+                tags = [(tags[0][0], rng.choice(VALUES[key]))] + tags[1:]
+            actions["modify"].append(way_xml(way_id, refs, tags, 2))
+        else:
+            actions["delete"].append(' <way id="%d" version="2"/>\n' % way_id)
+            for ref in refs[:len(points)]:
+                actions["delete"].append(' <node id="%d" version="2"/>\n' % ref)
+        if n % 10 == 0:
+            # a copy of the way 100 m to the north
+            new_refs = []
+            for lat, lon in points:
+                next_node += 1
+                new_refs.append(next_node)
+                actions["create"].append(' <node id="%d" version="1" lat="%.7f" lon="%.7f"/>\n' % (
+                    next_node, lat + 100 / DEGREE, lon))
+            if key not in LINES:
+                new_refs.append(new_refs[0])
+            actions["create"].append(way_xml(next_way + n + 1, new_refs, tags, 1))
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osmChange version="0.6" generator="osm-import benchmarks">\n')
+    for action in ("create", "modify", "delete"):
+        if actions[action]:
+            f.write('<%s>\n%s</%s>\n' % (action, "".join(actions[action]), action))
+            counts[action] = len(actions[action])
+    f.write('</osmChange>\n')
+    return counts
+
+
+def way_xml(way_id, refs, tags, version):
+    return ' <way id="%d" version="%d">\n%s%s </way>\n' % (
+        way_id, version, "".join('  <nd ref="%d"/>\n' % ref for ref in refs),
+        "".join('  <tag k="%s" v="%s"/>\n' % (k, escape(v)) for k, v in tags))
+
+
+def ways_for_size(spec, size):
+    """Number of ways giving a file of about size bytes with the spec's mix"""
+    sample = Spec(**dict(spec.describe(), ways=SAMPLE_WAYS, nodes=0, relations=SAMPLE_WAYS // 100))
+    f = io.StringIO()
+    write(f, sample)
+    per_way = len(f.getvalue().encode("utf-8")) / SAMPLE_WAYS
+    return max(1, int(size / per_way))
+
+
+def generate(filename, spec):
+    with open(filename, "w", encoding="utf-8", buffering=1 << 20) as f:
+        return write(f, spec)
+
+
+def generate_changes(filename, spec, count, seed=1):
+    with open(filename, "w", encoding="utf-8", buffering=1 << 20) as f:
+        return write_changes(f, spec, count, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic .osm file")
+    parser.add_argument("filename")
+    parser.add_argument("--ways", type=int, default=10000)
+    parser.add_argument("--nodes", type=int, default=0,
+                        help="total nodes, those not used by ways are scattered points (default: only way nodes)")
+    parser.add_argument("--relations", type=int, default=None, help="multipolygons (default: ways / 100)")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="weights of the main keys, e.g. building=60,highway=30,landuse=10")
+    parser.add_argument("--buildings", type=float, default=None, help="share of the ways which are buildings")
+    parser.add_argument("--size", type=parse_size, default=None,
+                        help="target file size like 500M or 4G, overrides --ways")
+    parser.add_argument("--span", type=float, default=0.1, help="degrees of latitude and longitude covered")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--area-points", type=int, default=0,
+                        help="points of every landuse and natural outline (default: 4-8 corners)")
+    parser.add_argument("--changes", type=int, default=None,
+                        help="write an osmChange file changing this many ways of the file instead")
+    args = parser.parse_args()
+    spec = Spec(ways=args.ways, nodes=args.nodes, relations=args.relations, mix=args.mix,
+                buildings=args.buildings, seed=args.seed, span=args.span, area_points=args.area_points)
+    if args.size:
+        spec.ways = ways_for_size(spec, args.size)
+        if args.relations is None:
+            spec.relations = spec.ways // 100
+    if args.changes is not None:
+        counts = generate_changes(args.filename, spec, args.changes, args.seed)
+        print("Wrote %s: %d created, %d modified, %d deleted elements" % (
+            args.filename, counts["create"], counts["modify"], counts["delete"]))
+        return
+    counts = generate(args.filename, spec)
+    print("Wrote %s: %d nodes, %d ways, %d relations" % (
+        args.filename, counts["nodes"], counts["ways"], counts["relations"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+bl_info = {
+    "name": "Import OpenStreetMap (.osm/.pbf)",
+    "author": "@lapka_td",
+    "version": (1, 1, 5),
+    "blender": (2, 76, 0),
+    "location": "File > Import > OpenStreetMap (.osm/.pbf)",
+    "description": "Import a file in the OpenStreetMap format (.osm, .osm.pbf)",
+    "url": 'https://github.com/olesya-wo/osm-import',
+    "wiki_url": "https://github.com/olesya-wo/osm-import/wiki",
+    "tracker_url": "https://github.com/olesya-wo/osm-import/issues",
+    "support": "COMMUNITY",
+    "category": "Import-Export"
+}
+
+try:
+    import bpy
+except ImportError:
+    # imported outside of Blender: only the bpy-free modules are usable
+    bpy = None
+
+if bpy is not None:
+    from .operator import OsmParser, menu_func_import, register, unregister
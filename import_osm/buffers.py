@@ -0,0 +1,128 @@
+from array import array
+import numpy as np
+from .tags import tag_list
+
+# faces per merged object, larger categories are split into several objects
+MAX_FACES = 1000000
+
+
+class MeshBuffer:
+    """Flat vertex/face arrays of many features, written to one mesh at once
+
+    Every face remembers the feature (way) it comes from, the features keep
+    their OSM id and tags, so merging objects loses no information. The tags are
+    ids into the StringTable of the import, or their dicts without one.
+    """
+
+    def __init__(self, strings):
+        self.co = array("d")
+        self.loops = array("i")
+        self.loop_starts = array("i")
+        self.loop_totals = array("i")
+        self.edges = array("i")
+        self.face_materials = array("i")
+        self.face_features = array("i")
+        self.feature_starts = array("i")  # first vertex of every feature
+        self.materials = []  # (name, color)
+        self.material_index = {}
+        self.feature_ids = []  # OSM id
+        self.tags = tag_list(strings)
+
+    def __len__(self):
+        return len(self.loop_starts)
+
+    def vertex_count(self):
+        return len(self.co) // 3
+
+    def material(self, name, color):
+        i = self.material_index.get(name)
+        if i is None:
+            i = self.material_index[name] = len(self.materials)
+            self.materials.append((name, color))
+        return i
+
+    def add(self, feature_id, tags, verts, faces, edges, materials):
+        """Add the geometry of one feature
+
+        verts are (x, y, z), faces lists of vertex indices, edges pairs of them
+        (only loose edges are needed). materials are (name, color, start, end)
+        ranges of faces like for a separate object, faces out of all ranges get
+        the first material.
+        """
+        base = self.vertex_count()
+        feature = len(self.feature_ids)
+        self.feature_ids.append(feature_id)
+        self.tags.append(tags)
+        self.feature_starts.append(base)
+        self.co.extend([c for v in verts for c in v])
+        if edges:
+            self.edges.extend([base + i for edge in edges for i in edge])
+        face_mats = [self.material(name, color) for name, color, start, end in materials]
+        mats = [face_mats[0] if face_mats else 0] * len(faces)
+        for m, (name, color, start, end) in zip(face_mats, materials):
+            for i in range(len(faces))[start:end]:
+                mats[i] = m
+        loops = self.loops
+        for face in faces:
+            self.loop_starts.append(len(loops))
+            self.loop_totals.append(len(face))
+            loops.extend([base + i for i in face])
+        self.face_materials.extend(mats)
+        self.face_features.extend([feature] * len(faces))
+
+    def add_geometry(self, geom, feature_ids, tags, materials):
+        """Add the features of a Geometry at once
+
+        feature_ids are their OSM ids, tags their tag dicts, materials the face
+        ranges of every feature like in add().
+        """
+        base = self.vertex_count()
+        loop_base = len(self.loops)
+        feature_base = len(self.feature_ids)
+        self.feature_ids.extend(feature_ids)
+        self.tags.extend(tags)
+        self.feature_starts.frombytes((geom.vertex_offsets[:-1] + base).astype(np.int32).tobytes())
+        face_mats = np.zeros(len(geom.loop_starts), dtype=np.int32)
+        for k, feature_materials in enumerate(materials):
+            if not feature_materials:
+                continue
+            faces = face_mats[geom.face_offsets[k]:geom.face_offsets[k + 1]]
+            mats = [self.material(name, color) for name, color, start, end in feature_materials]
+            faces[:] = mats[0]
+            for m, (name, color, start, end) in zip(mats, feature_materials):
+                faces[start:end] = m
+        face_features = np.repeat(np.arange(len(geom), dtype=np.int32), np.diff(geom.face_offsets))
+        self.co.frombytes(geom.co.astype(np.float64).tobytes())
+        self.loops.frombytes((geom.loops + base).astype(np.int32).tobytes())
+        self.loop_starts.frombytes((geom.loop_starts + loop_base).astype(np.int32).tobytes())
+        self.loop_totals.frombytes(geom.loop_totals.astype(np.int32).tobytes())
+        self.face_materials.frombytes(face_mats.tobytes())
+        self.face_features.frombytes((face_features + feature_base).tobytes())
+
+    def is_full(self):
+        return len(self.loop_starts) >= MAX_FACES
+
+
+class Mesh:
+    """Finished arrays with the attributes of a MeshBuffer
+
+    For a single extruded way, which needs no copy into a buffer, and for the meshes read
+    from a geometry file.
+    """
+
+    def __init__(self, co, edges, loops, loop_starts, loop_totals, face_materials, face_features,
+                 feature_starts, materials, feature_ids, tags):
+        self.co = co
+        self.edges = edges
+        self.loops = loops
+        self.loop_starts = loop_starts
+        self.loop_totals = loop_totals
+        self.face_materials = face_materials
+        self.face_features = face_features
+        self.feature_starts = feature_starts
+        self.materials = materials
+        self.feature_ids = feature_ids
+        self.tags = tags
+
+    def __len__(self):
+        return len(self.loop_starts)
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from array import array
+import numpy as np
+from .reader import StopReading
+
+# bump when the layout of a cache entry changes, older entries are then ignored and evicted
+CACHE_VERSION = 1
+# cache directory created next to the imported file when none is given
+CACHE_DIRNAME = ".osm-import-cache"
+# name, typecode of the packed arrays of an entry
+ARRAYS = (
+    ("node_ids", "q"),
+    ("node_lats", "d"),
+    ("node_lons", "d"),
+    ("way_ids", "q"),
+    ("ref_starts", "q"),
+    ("refs", "q"),
+    ("tag_starts", "q"),
+    ("tag_keys", "i"),
+    ("tag_values", "i"),
+)
+# items buffered per array before writing them out
+WRITE_BUFFER = 1024 * 1024
+# ways decoded per numpy slice when reading an entry
+READ_CHUNK = 65536
+# bytes hashed from the start and the end of the file, and from a few blocks in between
+HASH_EDGE = 1024 * 1024
+HASH_BLOCK = 64 * 1024
+HASH_BLOCKS = 14
+
+
+def file_hash(filename, size):
+    """Hash of samples of the file, reading all of a multi-GB file would cost too much"""
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        if size <= 2 * HASH_EDGE + HASH_BLOCKS * HASH_BLOCK:
+            h.update(f.read())
+        else:
+            h.update(f.read(HASH_EDGE))
+            step = (size - 2 * HASH_EDGE) // (HASH_BLOCKS + 1)
+            for n in range(1, HASH_BLOCKS + 1):
+                f.seek(HASH_EDGE + n * step)
+                h.update(f.read(HASH_BLOCK))
+            f.seek(size - HASH_EDGE)
+            h.update(f.read(HASH_EDGE))
+    return h.hexdigest()
+
+
+def cache_key(filename, options):
+    """Key of the cached data of a file: its size, mtime and content plus the options changing the data"""
+    stat = os.stat(filename)
+    fingerprint = {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "hash": file_hash(filename, stat.st_size),
+        "options": options,
+    }
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def entry_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(path) for name in files)
+
+
+def evict(directory, max_size, keep=None):
+    """Remove stale entries, then the least recently used ones until the cache fits into max_size"""
+    if not os.path.isdir(directory):
+        return
+    keep_meta = read_meta(os.path.join(directory, keep)) if keep else None
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not os.path.isdir(path):
+            continue
+        meta = read_meta(path)
+        stale = (meta is None or meta.get("version") != CACHE_VERSION
+                 or (keep_meta and name != keep and meta.get("source") == keep_meta.get("source")
+                     and meta.get("options") == keep_meta.get("options")))
+        if stale and name != keep:
+            # unfinished, older layout or an older version of the same file
+            if meta is not None or time.time() - os.path.getmtime(path) > 24 * 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        entries.append((os.path.getmtime(os.path.join(path, "meta.json")), name, entry_size(path)))
+    total = sum(size for used, name, size in entries)
+    for used, name, size in sorted(entries):
+        if total <= max_size:
+            break
+        if name != keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+            total -= size
+
+
+class CacheWriter:
+    """Element handlers storing all nodes and ways of a file as an entry of the cache
+
+    Ways get their refs and their tags as ids into one table of interned strings.
+    """
+
+    def __init__(self, directory, key, filename, options, node_tags=()):
+        self.path = os.path.join(directory, key)
+        self.tmp_path = "%s.tmp%d" % (self.path, os.getpid())
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.meta = {
+            "version": CACHE_VERSION,
+            "source": os.path.abspath(filename),
+            "options": options,
+            "bounds": None,
+        }
+        self.node_tags = node_tags
+        self.tags = {}
+        self.strings = {}
+        self.files = {}
+        self.buffers = {}
+        self.counts = {}
+        for name, typecode in ARRAYS:
+            self.files[name] = open(os.path.join(self.tmp_path, name + ".bin"), "wb")
+            self.buffers[name] = array(typecode)
+            self.counts[name] = 0
+        self.last_node = None
+        self.in_way = False
+
+    def handlers(self):
+        return {
+            "osm": self.skip,
+            "bounds": self.start_bounds,
+            "node": self.start_node,
+            "tag": self.start_tag,
+            "way": self.start_way,
+            "nd": self.start_nd,
+            "relation": self.start_relation,
+            "member": self.skip,
+        }
+
+    def append(self, name, value):
+        buf = self.buffers[name]
+        buf.append(value)
+        if len(buf) >= WRITE_BUFFER:
+            self.flush(name)
+
+    def flush(self, name):
+        buf = self.buffers[name]
+        buf.tofile(self.files[name])
+        self.counts[name] += len(buf)
+        del buf[:]
+
+    def intern(self, s):
+        i = self.strings.get(s)
+        if i is None:
+            i = self.strings[s] = len(self.strings)
+        return i
+
+    def add_nodes(self, ids, lats, lons, tagged):
+        for name, data in (("node_ids", ids), ("node_lats", lats), ("node_lons", lons)):
+            self.flush(name)
+            self.files[name].write(data)
+            self.counts[name] += len(data) // 8
+        self.tags.update((node_id, tags) for node_id, (lat, lon, tags) in tagged.items())
+
+    def skip(self, attrib):
+        pass
+
+    def start_bounds(self, attrib):
+        self.meta["bounds"] = {k: attrib.get(k) for k in ("minlat", "minlon", "maxlat", "maxlon")}
+
+    def start_node(self, attrib):
+        node_id = int(attrib.get("id"))
+        self.append("node_ids", node_id)
+        self.append("node_lats", float(attrib.get("lat")))
+        self.append("node_lons", float(attrib.get("lon")))
+        self.last_node = node_id
+
+    def start_tag(self, attrib):
+        k = attrib.get("k")
+        if self.in_way:
+            self.append("tag_keys", self.intern(k))
+            self.append("tag_values", self.intern(attrib.get("v")))
+        elif self.last_node is not None and k in self.node_tags:
+            self.tags.setdefault(self.last_node, {})[k] = attrib.get("v")
+
+    def start_way(self, attrib):
+        self.last_node = None
+        self.in_way = True
+        self.append("way_ids", int(attrib.get("id")))
+        self.append("ref_starts", self.counts["refs"] + len(self.buffers["refs"]))
+        self.append("tag_starts", self.counts["tag_keys"] + len(self.buffers["tag_keys"]))
+
+    def start_nd(self, attrib):
+        self.append("refs", int(attrib.get("ref")))
+
+    def start_relation(self, attrib):
+        # ways are always before relations
+        raise StopReading()
+
+    def finish(self):
+        """Write the entry and make it visible to readers in one rename"""
+        self.append("ref_starts", self.counts["refs"] + len(self.buffers["refs"]))
+        self.append("tag_starts", self.counts["tag_keys"] + len(self.buffers["tag_keys"]))
+        for name, typecode in ARRAYS:
+            self.flush(name)
+            self.files[name].close()
+        self.meta["counts"] = self.counts
+        self.meta["strings"] = sorted(self.strings, key=self.strings.__getitem__)
+        self.meta["node_tags"] = [[node_id, tags] for node_id, tags in self.tags.items()]
+        with open(os.path.join(self.tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class CachedData:
+    """Memory-mapped arrays of a cache entry"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.bounds = meta["bounds"]
+        self.strings = meta["strings"]
+        self.node_tags = {node_id: tags for node_id, tags in meta["node_tags"]}
+        for name, typecode in ARRAYS:
+            count = meta["counts"][name]
+            if count:
+                data = np.memmap(os.path.join(path, name + ".bin"), dtype=np.dtype(typecode), mode="r",
+                                 shape=(count,))
+            else:
+                data = np.empty(0, dtype=np.dtype(typecode))
+            setattr(self, name, data)
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    def ways(self):
+        """Yield id, refs and tags of every way"""
+        strings = self.strings
+        for start in range(0, len(self.way_ids), READ_CHUNK):
+            end = min(start + READ_CHUNK, len(self.way_ids))
+            way_ids = self.way_ids[start:end].tolist()
+            ref_starts = self.ref_starts[start:end + 1].tolist()
+            tag_starts = self.tag_starts[start:end + 1].tolist()
+            refs = self.refs[ref_starts[0]:ref_starts[-1]].tolist()
+            keys = self.tag_keys[tag_starts[0]:tag_starts[-1]].tolist()
+            values = self.tag_values[tag_starts[0]:tag_starts[-1]].tolist()
+            r0 = ref_starts[0]
+            t0 = tag_starts[0]
+            for i, way_id in enumerate(way_ids):
+                ts, te = tag_starts[i] - t0, tag_starts[i + 1] - t0
+                yield (way_id, refs[ref_starts[i] - r0:ref_starts[i + 1] - r0],
+                       {strings[k]: strings[v] for k, v in zip(keys[ts:te], values[ts:te])})
+
+    def select(self, positions):
+        """Yield id, refs and tags of the ways at the given positions"""
+        strings = self.strings
+        for start in range(0, len(positions), READ_CHUNK):
+            chunk = positions[start:start + READ_CHUNK]
+            way_ids = self.way_ids[chunk].tolist()
+            refs, ref_offsets = gather(self.refs, self.ref_starts[chunk], self.ref_starts[chunk + 1])
+            keys, tag_offsets = gather(self.tag_keys, self.tag_starts[chunk], self.tag_starts[chunk + 1])
+            values, tag_offsets = gather(self.tag_values, self.tag_starts[chunk], self.tag_starts[chunk + 1])
+            for i, way_id in enumerate(way_ids):
+                ts, te = tag_offsets[i], tag_offsets[i + 1]
+                yield (way_id, refs[ref_offsets[i]:ref_offsets[i + 1]],
+                       {strings[k]: strings[v] for k, v in zip(keys[ts:te], values[ts:te])})
+
+    def way_refs(self, selected):
+        """All refs of the ways selected by a boolean array"""
+        counts = np.diff(self.ref_starts)
+        return self.refs[np.repeat(selected, counts)]
+
+
+def gather(array, starts, ends):
+    """Items of the ranges of the array as one list and the offsets of the ranges in it"""
+    counts = ends - starts
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    positions = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1] - starts, counts)
+    return array[positions].tolist(), offsets.tolist()
+
+
+def open_entry(directory, key):
+    """Cached data for the key or None, marks the entry as used"""
+    path = os.path.join(directory, key)
+    meta = read_meta(path)
+    if meta is None or meta.get("version") != CACHE_VERSION:
+        return None
+    # the modification time of the metadata is the last use for the eviction
+    os.utime(os.path.join(path, "meta.json"))
+    return CachedData(path, meta)
@@ -0,0 +1,310 @@
+import bz2
+import gzip
+import multiprocessing
+import queue
+import threading
+from collections import deque
+
+COMPRESSED_EXTENSIONS = (".osm.bz2", ".osm.gz")
+# compressed bytes per decompression task, some bz2 blocks of at most 900 kB decompressed each
+TASK_SIZE = 1024 * 1024
+# decompressed pieces per worker done ahead of the parser, the rest of the file waits for it
+AHEAD = 2
+# compressed bytes scanned at once, decompressed bytes read by a thread at once
+READ_BLOCK = 1024 * 1024
+# such reads a thread does ahead of the parser
+QUEUED = 8
+# the 48 bit magic numbers starting a bz2 block and ending a stream, both at any bit offset
+BLOCK_MAGIC = 0x314159265359
+END_MAGIC = 0x177245385090
+MAGIC_MASK = (1 << 48) - 1
+# bytes around a magic at any bit offset
+MAGIC_BYTES = 7
+
+
+def is_compressed(filename):
+    return filename.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_file(filename, workers, executable=None, progress=None):
+    """Read-only file object of the decompressed bytes of a .bz2 or .gz file
+
+    bz2 is decompressed by a process pool if there are workers, gz and bz2 without them
+    by a thread. Either runs ahead of the reader by a bounded amount only, so memory
+    stays flat however large the file. progress gets the compressed bytes read so far.
+    """
+    if workers > 1 and filename.lower().endswith(".bz2"):
+        return ParallelBz2File(filename, workers, executable, progress)
+    f = open(filename, "rb")
+    if filename.lower().endswith(".bz2"):
+        return ThreadedFile(f, bz2.BZ2File(f, "rb"), progress)
+    return ThreadedFile(f, gzip.GzipFile(fileobj=f, mode="rb"), progress)
+
+
+def magic_patterns(magic):
+    # the 5 bytes fully inside the magic number shifted by 0 to 7 bits, they follow the first byte
+    return [(shift, (magic << (8 - shift)).to_bytes(MAGIC_BYTES, "big")[1:6]) for shift in range(8)]
+
+
+PATTERNS = [(BLOCK_MAGIC, magic_patterns(BLOCK_MAGIC)), (END_MAGIC, magic_patterns(END_MAGIC))]
+
+
+def find_magics(data):
+    """Sorted (bit offset, magic) of the block and end of stream magic numbers in the bytes
+
+    Only magic numbers starting before the last MAGIC_BYTES - 1 bytes are found.
+    """
+    found = []
+    for magic, patterns in PATTERNS:
+        for shift, pattern in patterns:
+            i = data.find(pattern, 1)
+            while i >= 0:
+                start = i - 1
+                if start + MAGIC_BYTES > len(data):
+                    break
+                if (int.from_bytes(data[start:start + MAGIC_BYTES], "big") >> (8 - shift)) & MAGIC_MASK == magic:
+                    found.append((start * 8 + shift, magic))
+                i = data.find(pattern, i + 1)
+    found.sort()
+    return found
+
+
+def bz2_tasks(filename):
+    """Yield the decompression tasks of a bz2 file in order, while scanning it
+
+    A task is (filename, stream start, level, first bit, end bit, block bits): some consecutive
+    blocks of a stream, cut at their magic numbers. A false one turns up about once per 30,000 GB
+    of random data, a task cut at one fails and its stream is decompressed as a whole then.
+    """
+    with open(filename, "rb") as f:
+        stream = None
+        level = None
+        blocks = []
+        end = 0
+        position = 0
+        tail = b""
+        while True:
+            block = f.read(READ_BLOCK)
+            data = tail + block
+            base = position - len(tail)
+            for bit, magic in find_magics(data):
+                byte = bit // 8
+                if byte < len(tail) - (MAGIC_BYTES - 1):
+                    # found in the block before
+                    continue
+                bit += base * 8
+                if magic == BLOCK_MAGIC and not bit % 8 and data[byte - 4:byte - 1] == b"BZh":
+                    # a new stream: its header and the first block, byte aligned
+                    if blocks:
+                        yield (filename, stream, level, blocks[0], end, blocks)
+                    stream = base + byte - 4
+                    level = data[byte - 1:byte]
+                    blocks = [bit]
+                elif stream is None:
+                    continue
+                elif magic == BLOCK_MAGIC:
+                    if bit - blocks[0] >= TASK_SIZE * 8:
+                        yield (filename, stream, level, blocks[0], bit, blocks)
+                        blocks = []
+                    blocks.append(bit)
+                end = bit
+            if not block:
+                break
+            position += len(block)
+            tail = data[-(MAGIC_BYTES - 1 + 4):]
+        if blocks:
+            yield (filename, stream, level, blocks[0], end, blocks)
+
+
+def decompress_blocks(task):
+    """Decompressed bytes of the blocks of a task, made a stream of their own"""
+    filename, stream, level, start, end, blocks = task
+    with open(filename, "rb") as f:
+        f.seek(start // 8)
+        data = f.read((end + 7) // 8 - start // 8)
+    length = end - start
+    bits = (int.from_bytes(data, "big") >> (len(data) * 8 - (end - start // 8 * 8))) & ((1 << length) - 1)
+    # the stream CRC combines the CRCs following the block magic numbers
+    crc = 0
+    for block in blocks:
+        block_crc = (bits >> (length - (block - start) - 80)) & 0xffffffff
+        crc = (((crc << 1) | (crc >> 31)) & 0xffffffff) ^ block_crc
+    bits = (((bits << 48) | END_MAGIC) << 32) | crc
+    length += 80
+    padding = -length % 8
+    return bz2.decompress(b"BZh" + level + (bits << padding).to_bytes((length + padding) // 8, "big"))
+
+
+def decompress_stream(filename, stream, skip=0):
+    """Yield the decompressed bytes of the bz2 stream starting at the byte offset, but the first skip
+
+    The pieces are READ_BLOCK bytes at most, so memory stays flat however large the stream.
+    """
+    decompressor = bz2.BZ2Decompressor()
+    with open(filename, "rb") as f:
+        f.seek(stream)
+        while not decompressor.eof:
+            data = b""
+            if decompressor.needs_input:
+                data = f.read(READ_BLOCK)
+                if not data:
+                    raise Exception("Truncated bz2 stream at byte %d of %s" % (stream, filename))
+            piece = decompressor.decompress(data, READ_BLOCK)
+            if skip:
+                passed = min(skip, len(piece))
+                piece = piece[passed:]
+                skip -= passed
+            if piece:
+                yield piece
+
+
+class PieceFile:
+    """Read-only file object over pieces of bytes given by next_piece(), b"" at the end"""
+
+    data = b""
+    offset = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            pieces = [self.data[self.offset:]]
+            self.data = b""
+            self.offset = 0
+            piece = self.next_piece()
+            while piece:
+                pieces.append(piece)
+                piece = self.next_piece()
+            return b"".join(pieces)
+        while self.offset >= len(self.data):
+            self.data = self.next_piece()
+            self.offset = 0
+            if not self.data:
+                return b""
+        data = self.data[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def next_piece(self):
+        raise NotImplementedError
+
+
+class ParallelBz2File(PieceFile):
+    """Decompressed bytes of a bz2 file, its blocks decompressed by a process pool
+
+    Tasks go to the pool while their results are read, at most AHEAD per worker are
+    outstanding. The results come back in file order.
+    """
+
+    def __init__(self, filename, workers, executable=None, progress=None):
+        self.filename = filename
+        self.progress = progress
+        self.tasks = bz2_tasks(filename)
+        self.pending = deque()
+        self.ahead = workers * AHEAD
+        # the stream of the last piece, the bytes of it passed on and a stream decompressed as a whole
+        self.stream = None
+        self.passed = 0
+        self.skipped_stream = None
+        # the pieces of the rest of that stream
+        self.rest = None
+        context = multiprocessing.get_context("spawn")
+        if executable:
+            context.set_executable(executable)
+        self.pool = context.Pool(workers)
+
+    def submit(self):
+        while len(self.pending) < self.ahead:
+            task = next(self.tasks, None)
+            if task is None:
+                return
+            self.pending.append((task, self.pool.apply_async(decompress_blocks, (task,))))
+
+    def next_piece(self):
+        while True:
+            if self.rest is not None:
+                data = next(self.rest, b"")
+                if data:
+                    self.passed += len(data)
+                    return data
+                self.rest = None
+            self.submit()
+            if not self.pending:
+                return b""
+            task, result = self.pending.popleft()
+            stream = task[1]
+            if stream == self.skipped_stream:
+                continue
+            if stream != self.stream:
+                self.stream = stream
+                self.passed = 0
+            try:
+                data = result.get()
+            except (OSError, ValueError, EOFError):
+                # cut at a false magic number, the rest of the stream comes from decompressing all of it
+                self.rest = decompress_stream(self.filename, stream, self.passed)
+                self.skipped_stream = stream
+                data = b""
+            self.passed += len(data)
+            if self.progress is not None:
+                self.progress(task[4] // 8)
+            if data:
+                return data
+
+    def close(self):
+        if self.rest is not None:
+            self.rest.close()
+        self.tasks.close()
+        self.pool.terminate()
+        self.pool.join()
+
+
+class ThreadedFile(PieceFile):
+    """Decompressed bytes of a file object read by a thread into a bounded queue
+
+    bz2 and zlib release the GIL while decompressing, so this overlaps with parsing.
+    """
+
+    def __init__(self, raw, f, progress=None):
+        self.raw = raw
+        self.f = f
+        self.progress = progress
+        self.pieces = queue.Queue(QUEUED)
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target=self.decompress, daemon=True)
+        self.thread.start()
+
+    def decompress(self):
+        try:
+            while not self.closed:
+                data = self.f.read(READ_BLOCK)
+                self.put((data, self.raw.tell()))
+                if not data:
+                    return
+        except BaseException as e:
+            self.error = e
+            self.put((b"", None))
+
+    def put(self, item):
+        while not self.closed:
+            try:
+                self.pieces.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def next_piece(self):
+        data, position = self.pieces.get()
+        if self.error is not None:
+            raise self.error
+        if self.progress is not None and position is not None:
+            self.progress(position)
+        if not data:
+            # every further read ends here again
+            self.pieces.put((b"", position))
+        return data
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.f.close()
+        self.raw.close()
@@ -0,0 +1,11 @@
+import numpy as np
+
+
+def project(lats, lons, lon, lat_rad, radius):
+    """Local x/y in metres of arrays of coordinates in degrees, transverse Mercator around lon and lat_rad"""
+    lats = np.radians(lats)
+    lons = np.radians(lons - lon)
+    b = np.sin(lons) * np.cos(lats)
+    x = 0.5 * radius * np.log((1 + b) / (1 - b))
+    y = radius * (np.arctan(np.tan(lats) / np.cos(lons)) - lat_rad)
+    return x, y
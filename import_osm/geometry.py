@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class Geometry:
+    """Vertices and faces of many features in flat arrays
+
+    Feature k owns vertices vertex_offsets[k]:vertex_offsets[k + 1], likewise for
+    faces and loops. Loops index the whole vertex array.
+    """
+
+    def __init__(self, co, loops, loop_starts, loop_totals, vertex_offsets, face_offsets, loop_offsets):
+        self.co = co
+        self.loops = loops
+        self.loop_starts = loop_starts
+        self.loop_totals = loop_totals
+        self.vertex_offsets = vertex_offsets
+        self.face_offsets = face_offsets
+        self.loop_offsets = loop_offsets
+
+    def __len__(self):
+        return len(self.vertex_offsets) - 1
+
+    def part(self, k):
+        """co, loops, loop_starts, loop_totals of feature k alone"""
+        v0, v1 = self.vertex_offsets[k], self.vertex_offsets[k + 1]
+        f0, f1 = self.face_offsets[k], self.face_offsets[k + 1]
+        l0, l1 = self.loop_offsets[k], self.loop_offsets[k + 1]
+        return (self.co[v0:v1], self.loops[l0:l1] - v0,
+                self.loop_starts[f0:f1] - l0, self.loop_totals[f0:f1])
+
+
+def offsets(counts):
+    result = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=result[1:])
+    return result
+
+
+def prisms(rings, bottoms, tops):
+    """Prisms over closed footprint rings, like extrude_mesh on a polygon
+
+    rings are (n, 2) point sequences without the closing point. Every prism has
+    the n floor vertices at its bottom height, then the n roof vertices at its top.
+    Its faces are the roof, then a wall for every edge of the ring, there is no
+    floor face like after bmesh extrude_face_region.
+    """
+    counts = np.array([len(r) for r in rings], dtype=np.int64)
+    points = np.concatenate([np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings])
+    k = np.repeat(np.arange(len(rings)), counts)
+    ring_starts = offsets(counts)
+    j = np.arange(len(points)) - ring_starts[k]
+    n = counts[k]
+    vertex_offsets = 2 * ring_starts
+    face_offsets = ring_starts + np.arange(len(rings) + 1)
+    loop_offsets = 5 * ring_starts
+
+    bottom = vertex_offsets[k] + j
+    top = bottom + n
+    co = np.empty((2 * len(points), 3))
+    co[bottom, :2] = points
+    co[bottom, 2] = np.asarray(bottoms, dtype=np.float64)[k]
+    co[top, :2] = points
+    co[top, 2] = np.asarray(tops, dtype=np.float64)[k]
+
+    loops = np.empty(5 * len(points), dtype=np.int64)
+    # roof
+    loops[loop_offsets[k] + j] = top
+    # walls: floor edge, then back along the roof edge
+    next_j = (j + 1) % n
+    wall = loop_offsets[k] + n + 4 * j
+    loops[wall] = bottom
+    loops[wall + 1] = vertex_offsets[k] + next_j
+    loops[wall + 2] = vertex_offsets[k] + next_j + n
+    loops[wall + 3] = top
+
+    loop_starts = np.empty(face_offsets[-1], dtype=np.int64)
+    loop_totals = np.empty(face_offsets[-1], dtype=np.int64)
+    roofs = face_offsets[:-1]
+    loop_starts[roofs] = loop_offsets[:-1]
+    loop_totals[roofs] = counts
+    walls = face_offsets[k] + 1 + j
+    loop_starts[walls] = wall
+    loop_totals[walls] = 4
+    return Geometry(co, loops, loop_starts, loop_totals, vertex_offsets, face_offsets, loop_offsets)
+
+
+def walls(lines, bottoms, tops):
+    """Walls along open polylines, like extrude_edges on a chain of edges
+
+    Every wall has the n vertices of the line at its bottom height, then the n
+    at its top, and a quad for every segment.
+    """
+    counts = np.array([len(line) for line in lines], dtype=np.int64)
+    points = np.concatenate([np.asarray(line, dtype=np.float64).reshape(-1, 2) for line in lines])
+    k = np.repeat(np.arange(len(lines)), counts)
+    line_starts = offsets(counts)
+    j = np.arange(len(points)) - line_starts[k]
+    n = counts[k]
+    vertex_offsets = 2 * line_starts
+    face_offsets = line_starts - np.arange(len(lines) + 1)
+    loop_offsets = 4 * face_offsets
+
+    bottom = vertex_offsets[k] + j
+    top = bottom + n
+    co = np.empty((2 * len(points), 3))
+    co[bottom, :2] = points
+    co[bottom, 2] = np.asarray(bottoms, dtype=np.float64)[k]
+    co[top, :2] = points
+    co[top, 2] = np.asarray(tops, dtype=np.float64)[k]
+
+    # a quad starts at every point except the last one of its line
+    first = j < n - 1
+    face = (face_offsets[k] + j)[first]
+    quad_bottom = bottom[first]
+    quad_top = top[first]
+    loops = np.empty(4 * len(face), dtype=np.int64)
+    start = 4 * face
+    loops[start] = quad_bottom
+    loops[start + 1] = quad_bottom + 1
+    loops[start + 2] = quad_top + 1
+    loops[start + 3] = quad_top
+    return Geometry(co, loops, start, np.full(len(face), 4, dtype=np.int64),
+                    vertex_offsets, face_offsets, loop_offsets)
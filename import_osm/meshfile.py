@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import zipfile
+import numpy as np
+from .buffers import Mesh
+from .tags import StringTable, TagArrays
+
+# bump when the layout of the file changes, older files are then refused
+MESHFILE_VERSION = 3
+EXTENSION = ".osmgeom"
+# name, typecode of the arrays of a file, the meshes one after the other
+ARRAYS = (
+    ("co", "f"),
+    ("edges", "i"),
+    ("loops", "i"),
+    ("loop_starts", "i"),
+    ("loop_totals", "i"),
+    ("face_materials", "i"),
+    ("face_features", "i"),
+    ("feature_starts", "i"),
+    ("tag_starts", "i"),
+    ("tag_ids", "i"),
+)
+
+
+def is_mesh_file(filename):
+    return filename.lower().endswith(EXTENSION)
+
+
+class MeshWriter:
+    """Intermediate geometry file of a preprocessed import
+
+    A zip archive of one flat array per mesh attribute plus meta.json with the name, tile,
+    counts, materials and feature OSM ids of every mesh, and the strings the tag ids of all
+    meshes refer to. The arrays are written to a temporary directory while the import runs
+    and stored uncompressed at the end.
+    """
+
+    def __init__(self, filename, meta=None):
+        self.filename = filename
+        self.strings = StringTable()
+        self.tmp_path = "%s.tmp%d" % (filename, os.getpid())
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.meta = dict(meta or {}, version=MESHFILE_VERSION, tiles=[], meshes=[])
+        self.files = {name: open(os.path.join(self.tmp_path, name + ".bin"), "wb") for name, typecode in ARRAYS}
+
+    def add_tile(self, name):
+        self.meta["tiles"].append(name)
+
+    def add(self, tile, name, buf, merged):
+        """Add a MeshBuffer"""
+        tag_ids = buf.tags.ids
+        if buf.tags.strings is not self.strings:
+            # a mesh with a string table of its own
+            strings = buf.tags.strings.strings
+            tag_ids = [self.strings.intern(strings[i]) for i in tag_ids]
+        tag_arrays = {"tag_starts": buf.tags.starts, "tag_ids": tag_ids}
+        counts = {}
+        for array_name, typecode in ARRAYS:
+            data = tag_arrays[array_name] if array_name in tag_arrays else getattr(buf, array_name)
+            data = np.asarray(data, dtype=np.dtype(typecode))
+            data.tofile(self.files[array_name])
+            counts[array_name] = data.size
+        self.meta["meshes"].append({
+            "tile": tile,
+            "name": name,
+            "merged": merged,
+            "counts": counts,
+            "materials": buf.materials,
+            "features": buf.feature_ids,
+        })
+
+    def add_points(self, tile, name, co, point_class):
+        """Add the locations of the point features of a class"""
+        empty = np.empty(0, dtype=np.int32)
+        tags = TagArrays(self.strings)
+        self.add(tile, name, Mesh(co, empty, empty, empty, empty, empty, empty, empty, [], [], tags), False)
+        self.meta["meshes"][-1]["points"] = point_class
+
+    def finish(self):
+        for f in self.files.values():
+            f.close()
+        self.meta["strings"] = self.strings.strings
+        tmp_filename = os.path.join(self.tmp_path, "file.zip")
+        with zipfile.ZipFile(tmp_filename, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, typecode in ARRAYS:
+                archive.write(os.path.join(self.tmp_path, name + ".bin"), name + ".bin")
+            archive.writestr("meta.json", json.dumps(self.meta))
+        os.replace(tmp_filename, self.filename)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class MeshFile:
+    def __init__(self, filename):
+        with zipfile.ZipFile(filename, "r") as archive:
+            self.meta = json.loads(archive.read("meta.json").decode("utf-8"))
+            if self.meta.get("version") != MESHFILE_VERSION:
+                raise Exception("Unsupported geometry file version %s: %s" % (self.meta.get("version"), filename))
+            self.arrays = {name: np.frombuffer(archive.read(name + ".bin"), dtype=np.dtype(typecode))
+                           for name, typecode in ARRAYS}
+        self.tiles = self.meta["tiles"]
+
+    def __len__(self):
+        return len(self.meta["meshes"])
+
+    def meshes(self, strings):
+        """Yield tile, name, mesh, merged flag and point class (None for other meshes) of every mesh
+
+        The tag ids of the meshes are made ids into the StringTable strings.
+        """
+        remap = np.array([strings.intern(s) for s in self.meta["strings"]], dtype=np.int32)
+        offsets = {name: 0 for name, typecode in ARRAYS}
+        for mesh in self.meta["meshes"]:
+            arrays = {}
+            for name, typecode in ARRAYS:
+                start = offsets[name]
+                offsets[name] += mesh["counts"][name]
+                arrays[name] = self.arrays[name][start:offsets[name]]
+            materials = [(name, tuple(color)) for name, color in mesh["materials"]]
+            tags = TagArrays(strings, arrays.pop("tag_starts"), remap[arrays.pop("tag_ids")])
+            mesh_data = Mesh(materials=materials, feature_ids=mesh["features"], tags=tags, **arrays)
+            yield mesh["tile"], mesh["name"], mesh_data, mesh["merged"], mesh.get("points")
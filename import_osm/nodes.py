@@ -0,0 +1,495 @@
+import heapq
+import mmap
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+import numpy as np
+from . import geo
+
+# file stores keep coordinates as 1e-7 degree fixed point, the precision of OSM itself,
+# shifted so that zero is never a valid value and marks an empty slot
+COORD_SCALE = 10000000
+LAT_SHIFT = 90 * COORD_SCALE + 1
+LON_SHIFT = 180 * COORD_SCALE + 1
+EMPTY = bytes(4)
+# nodes projected per numpy call by the file stores
+PROJECT_CHUNK = 1024 * 1024
+# a record of the sparse file store as numpy sees it
+RECORD = np.dtype([("id", "<i8"), ("lat", "<u4"), ("lon", "<u4")])
+
+
+class NodeStore:
+    """Compact storage of node locations
+
+    Ids and coordinates are kept in packed arrays (24 bytes per node), the few
+    tagged nodes have their tags in a side dict. Lookup is a binary search over
+    the ids, which OSM files already deliver in ascending order.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.tags = {}
+        self.is_sorted = True
+        self.xs = None
+        self.ys = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node_id):
+        return self.index(node_id) >= 0
+
+    def __getitem__(self, node_id):
+        i = self.index(node_id)
+        if i < 0:
+            raise KeyError(node_id)
+        return self.lats[i], self.lons[i], self.tags.get(node_id)
+
+    def get(self, node_id, default=None):
+        i = self.index(node_id)
+        if i < 0:
+            return default
+        return self.lats[i], self.lons[i], self.tags.get(node_id)
+
+    def add(self, node_id, lat, lon, tags=None):
+        ids = self.ids
+        if self.is_sorted and ids and node_id <= ids[-1]:
+            self.is_sorted = False
+        ids.append(node_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        if tags:
+            self.tags[node_id] = tags
+        elif self.tags:
+            self.tags.pop(node_id, None)
+
+    def extend(self, ids, lats, lons, tags):
+        """Add nodes from the bytes of packed id/lat/lon arrays"""
+        new_ids = np.frombuffer(ids, dtype=np.int64)
+        if self.is_sorted and len(new_ids):
+            if (self.ids and new_ids[0] <= self.ids[-1]) or np.any(np.diff(new_ids) <= 0):
+                self.is_sorted = False
+        self.ids.frombytes(ids)
+        self.lats.frombytes(lats)
+        self.lons.frombytes(lons)
+        self.tags.update(tags)
+
+    def index(self, node_id):
+        """Position of the node in the arrays or -1"""
+        if not self.is_sorted:
+            self.sort()
+        ids = self.ids
+        i = bisect_left(ids, node_id)
+        if i < len(ids) and ids[i] == node_id:
+            return i
+        return -1
+
+    def lookup(self, ids):
+        """lats, lons of the nodes with the ids as arrays, NaN where there is no node"""
+        if not self.is_sorted:
+            self.sort()
+        ids = np.asarray(ids, dtype=np.int64)
+        lats = np.full(len(ids), np.nan)
+        lons = np.full(len(ids), np.nan)
+        stored = np.frombuffer(self.ids, dtype=np.int64)
+        if len(stored):
+            found = np.minimum(np.searchsorted(stored, ids), len(stored) - 1)
+            hit = stored[found] == ids
+            lats[hit] = np.frombuffer(self.lats, dtype=np.float64)[found[hit]]
+            lons[hit] = np.frombuffer(self.lons, dtype=np.float64)[found[hit]]
+        return lats, lons
+
+    def project(self, lon, lat_rad, radius):
+        """Convert all locations to local x/y at once, xy() returns them afterwards"""
+        if not self.is_sorted:
+            self.sort()
+        lats = np.frombuffer(self.lats, dtype=np.float64)
+        lons = np.frombuffer(self.lons, dtype=np.float64)
+        self.xs, self.ys = geo.project(lats, lons, lon, lat_rad, radius)
+
+    def xy(self, i):
+        return self.xs[i], self.ys[i]
+
+    def coords(self, points):
+        """(n, 2) x/y of the nodes at the positions"""
+        points = np.asarray(points, dtype=np.int64)
+        return np.column_stack((self.xs[points], self.ys[points]))
+
+    def close(self):
+        pass
+
+    def sort(self):
+        # stable order, so of duplicated ids the last added one wins like in a dict
+        ids = np.frombuffer(self.ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        keep = order[np.append(sorted_ids[1:] != sorted_ids[:-1], True)]
+        del ids, order, sorted_ids
+        self.ids = array("q", np.frombuffer(self.ids, dtype=np.int64)[keep].tobytes())
+        self.lats = array("d", np.frombuffer(self.lats, dtype=np.float64)[keep].tobytes())
+        self.lons = array("d", np.frombuffer(self.lons, dtype=np.float64)[keep].tobytes())
+        self.is_sorted = True
+
+
+class IdSet:
+    """Sparse bitmap of ids
+
+    One bit per id in pages of 65536 ids, so a set of the nodes of a city costs
+    a few hundred kilobytes regardless of how large the ids are.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, node_id):
+        page = self.pages.get(node_id >> 16)
+        return page is not None and page[(node_id & 0xFFFF) >> 3] & (1 << (node_id & 7)) != 0
+
+    def add(self, node_id):
+        page = self.pages.get(node_id >> 16)
+        if page is None:
+            page = self.pages[node_id >> 16] = bytearray(8192)
+        i = (node_id & 0xFFFF) >> 3
+        bit = 1 << (node_id & 7)
+        if not page[i] & bit:
+            page[i] |= bit
+            self.count += 1
+
+
+def unpack_nodes(ids, lats, lons):
+    """(id, lat, lon) of the bytes of packed id/lat/lon arrays"""
+    ids_array = array("q")
+    ids_array.frombytes(ids)
+    lats_array = array("d")
+    lats_array.frombytes(lats)
+    lons_array = array("d")
+    lons_array.frombytes(lons)
+    return zip(ids_array, lats_array, lons_array)
+
+
+def first(record):
+    return record[0]
+
+
+def encode_coords(lat, lon):
+    return round(lat * COORD_SCALE) + LAT_SHIFT, round(lon * COORD_SCALE) + LON_SHIFT
+
+
+def decode_coords(lat, lon):
+    return (lat - LAT_SHIFT) / COORD_SCALE, (lon - LON_SHIFT) / COORD_SCALE
+
+
+class DenseFileNodeStore:
+    """Node locations in a memory-mapped file indexed by node id
+
+    Every id owns an 8 byte slot, the file is sparse where the OS supports it.
+    Best for extracts covering a large part of the id range (countries, planet).
+    """
+    record = struct.Struct("<II")
+    grow_step = 64 * 1024 * 1024
+
+    def __init__(self, directory=None):
+        self.directory = directory or None
+        self.file = tempfile.TemporaryFile(dir=self.directory)
+        self.size = self.grow_step
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.tags = {}
+        self.count = 0
+        self.xy_file = None
+        self.xy_map = None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, node_id):
+        return self.index(node_id) >= 0
+
+    def __getitem__(self, node_id):
+        node = self.get(node_id)
+        if node is None:
+            raise KeyError(node_id)
+        return node
+
+    def get(self, node_id, default=None):
+        i = self.index(node_id)
+        if i < 0:
+            return default
+        lat, lon = decode_coords(*self.record.unpack_from(self.map, i * self.record.size))
+        return lat, lon, self.tags.get(node_id)
+
+    def add(self, node_id, lat, lon, tags=None):
+        if node_id < 0:
+            # new nodes of an editor like JOSM, they have no slot
+            raise Exception("Negative node id %d, not supported by the dense file node storage" % node_id)
+        offset = node_id * self.record.size
+        if offset + self.record.size > self.size:
+            self.grow(offset + self.record.size)
+        if self.map[offset:offset + 4] == EMPTY:
+            self.count += 1
+        self.record.pack_into(self.map, offset, *encode_coords(lat, lon))
+        if tags:
+            self.tags[node_id] = tags
+        elif self.tags:
+            self.tags.pop(node_id, None)
+
+    def extend(self, ids, lats, lons, tags):
+        """Add nodes from the bytes of packed id/lat/lon arrays"""
+        for node_id, lat, lon in unpack_nodes(ids, lats, lons):
+            self.add(node_id, lat, lon, tags.get(node_id))
+
+    def index(self, node_id):
+        """Slot of the node in the file or -1"""
+        offset = node_id * self.record.size
+        if node_id < 0 or offset + self.record.size > self.size or self.map[offset:offset + 4] == EMPTY:
+            return -1
+        return node_id
+
+    def lookup(self, ids):
+        """lats, lons of the nodes with the ids as arrays, NaN where there is no node"""
+        ids = np.asarray(ids, dtype=np.int64)
+        lats = np.full(len(ids), np.nan)
+        lons = np.full(len(ids), np.nan)
+        coords = np.frombuffer(self.map, dtype="<u4").reshape(-1, 2)
+        inside = np.nonzero((ids >= 0) & (ids < len(coords)))[0]
+        slots = coords[ids[inside]]
+        used = slots[:, 0] != 0
+        lats[inside[used]] = (slots[used, 0].astype(np.int64) - LAT_SHIFT) / COORD_SCALE
+        lons[inside[used]] = (slots[used, 1].astype(np.int64) - LON_SHIFT) / COORD_SCALE
+        return lats, lons
+
+    def project(self, lon, lat_rad, radius):
+        """Write local x/y of all nodes to a second file indexed like the first"""
+        slots = self.size // self.record.size
+        self.xy_file = tempfile.TemporaryFile(dir=self.directory)
+        self.xy_map = np.memmap(self.xy_file, dtype=np.float64, mode="w+", shape=(slots, 2))
+        coords = np.frombuffer(self.map, dtype="<u4").reshape(-1, 2)
+        for start in range(0, slots, PROJECT_CHUNK):
+            chunk = coords[start:start + PROJECT_CHUNK]
+            used = np.nonzero(chunk[:, 0])[0]
+            if not len(used):
+                continue
+            lats = (chunk[used, 0].astype(np.int64) - LAT_SHIFT) / COORD_SCALE
+            lons = (chunk[used, 1].astype(np.int64) - LON_SHIFT) / COORD_SCALE
+            x, y = geo.project(lats, lons, lon, lat_rad, radius)
+            self.xy_map[start + used, 0] = x
+            self.xy_map[start + used, 1] = y
+
+    def xy(self, i):
+        return tuple(self.xy_map[i])
+
+    def coords(self, points):
+        return np.array(self.xy_map[np.asarray(points, dtype=np.int64)])
+
+    def grow(self, size):
+        self.map.close()
+        self.size = (size // self.grow_step + 1) * self.grow_step
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+    def close(self):
+        if self.xy_file is not None:
+            self.xy_map = None
+            self.xy_file.close()
+        self.map.close()
+        self.file.close()
+
+
+class SparseFileNodeStore:
+    """Node locations in a memory-mapped file of records sorted by id
+
+    16 bytes per stored node. Nodes are buffered and written in sorted runs,
+    which are merged on the first lookup if the input was not sorted by id.
+    Lookups bisect an in-memory fence of every 256th id, then one block.
+    """
+    record = struct.Struct("<qII")
+    block = 256
+    run_size = 4 * 1024 * 1024
+
+    def __init__(self, directory=None):
+        self.directory = directory or None
+        self.file = tempfile.TemporaryFile(dir=self.directory)
+        self.runs = []
+        self.buffer = []
+        self.last_id = None
+        self.is_sorted = True
+        self.count = 0
+        self.map = None
+        self.fences = array("q")
+        self.tags = {}
+        self.xy_file = None
+        self.xy_map = None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, node_id):
+        return self.index(node_id) >= 0
+
+    def __getitem__(self, node_id):
+        node = self.get(node_id)
+        if node is None:
+            raise KeyError(node_id)
+        return node
+
+    def get(self, node_id, default=None):
+        i = self.index(node_id)
+        if i < 0:
+            return default
+        _, lat, lon = self.record.unpack_from(self.map, i * self.record.size)
+        lat, lon = decode_coords(lat, lon)
+        return lat, lon, self.tags.get(node_id)
+
+    def add(self, node_id, lat, lon, tags=None):
+        if self.last_id is not None and node_id <= self.last_id:
+            self.is_sorted = False
+        self.last_id = node_id
+        self.buffer.append((node_id,) + encode_coords(lat, lon))
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self.flush()
+        if tags:
+            self.tags[node_id] = tags
+        elif self.tags:
+            self.tags.pop(node_id, None)
+
+    def extend(self, ids, lats, lons, tags):
+        """Add nodes from the bytes of packed id/lat/lon arrays"""
+        for node_id, lat, lon in unpack_nodes(ids, lats, lons):
+            self.add(node_id, lat, lon, tags.get(node_id))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.is_sorted:
+            out = self.file
+        else:
+            self.buffer.sort(key=first)
+            out = tempfile.TemporaryFile(dir=self.directory)
+            self.runs.append(out)
+        pack = self.record.pack
+        out.write(b"".join(pack(*r) for r in self.buffer))
+        self.buffer = []
+
+    def finish(self):
+        if not self.is_sorted and self.file.tell():
+            # the records written before the input turned out unsorted are a run too
+            self.file.seek(0)
+            self.runs.append(self.file)
+            self.file = tempfile.TemporaryFile(dir=self.directory)
+        self.flush()
+        if self.runs:
+            self.merge_runs()
+        size = self.file.tell()
+        if size == 0:
+            self.file.write(b"\0" * self.record.size)
+        self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = size // self.record.size
+        # the first id of every block
+        step = self.block * self.record.size
+        self.fences = array("q", (struct.unpack_from("<q", self.map, o)[0] for o in range(0, size, step)))
+
+    def merge_runs(self):
+        size = self.record.size
+        unpack = self.record.unpack
+        pack = self.record.pack
+
+        def read_run(run):
+            run.seek(0)
+            while True:
+                chunk = run.read(size * 65536)
+                if not chunk:
+                    break
+                for o in range(0, len(chunk), size):
+                    yield unpack(chunk[o:o + size])
+
+        out = []
+        last_id = None
+        for r in heapq.merge(*(read_run(run) for run in self.runs), key=first):
+            if r[0] == last_id:
+                out[-1] = pack(*r)
+                continue
+            last_id = r[0]
+            out.append(pack(*r))
+            if len(out) >= 65536:
+                self.file.write(b"".join(out[:-1]))
+                out = out[-1:]
+        self.file.write(b"".join(out))
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+    def index(self, node_id):
+        """Record number of the node or -1"""
+        if self.map is None:
+            self.finish()
+        b = bisect_right(self.fences, node_id) - 1
+        if b < 0:
+            return -1
+        lo = b * self.block
+        hi = min(lo + self.block, self.count)
+        size = self.record.size
+        m = self.map
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id = struct.unpack_from("<q", m, mid * size)[0]
+            if mid_id < node_id:
+                lo = mid + 1
+            elif mid_id > node_id:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def lookup(self, ids):
+        """lats, lons of the nodes with the ids as arrays, NaN where there is no node"""
+        if self.map is None:
+            self.finish()
+        ids = np.asarray(ids, dtype=np.int64)
+        lats = np.full(len(ids), np.nan)
+        lons = np.full(len(ids), np.nan)
+        records = np.frombuffer(self.map, dtype=RECORD)[:self.count]
+        if len(records):
+            found = np.minimum(np.searchsorted(records["id"], ids), len(records) - 1)
+            hit = records["id"][found] == ids
+            chunk = records[found[hit]]
+            lats[hit] = (chunk["lat"].astype(np.int64) - LAT_SHIFT) / COORD_SCALE
+            lons[hit] = (chunk["lon"].astype(np.int64) - LON_SHIFT) / COORD_SCALE
+        return lats, lons
+
+    def project(self, lon, lat_rad, radius):
+        """Write local x/y of all nodes to a second file in record order"""
+        if self.map is None:
+            self.finish()
+        self.xy_file = tempfile.TemporaryFile(dir=self.directory)
+        self.xy_map = np.memmap(self.xy_file, dtype=np.float64, mode="w+", shape=(max(self.count, 1), 2))
+        records = np.frombuffer(self.map, dtype=RECORD)
+        for start in range(0, self.count, PROJECT_CHUNK):
+            chunk = records[start:start + PROJECT_CHUNK]
+            lats = (chunk["lat"].astype(np.int64) - LAT_SHIFT) / COORD_SCALE
+            lons = (chunk["lon"].astype(np.int64) - LON_SHIFT) / COORD_SCALE
+            x, y = geo.project(lats, lons, lon, lat_rad, radius)
+            self.xy_map[start:start + len(chunk), 0] = x
+            self.xy_map[start:start + len(chunk), 1] = y
+
+    def xy(self, i):
+        return tuple(self.xy_map[i])
+
+    def coords(self, points):
+        return np.array(self.xy_map[np.asarray(points, dtype=np.int64)])
+
+    def close(self):
+        if self.xy_file is not None:
+            self.xy_map = None
+            self.xy_file.close()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
@@ -0,0 +1,641 @@
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from bpy_extras.io_utils import ImportHelper
+import bmesh
+import bpy
+import numpy as np
+from .pipeline import TIMER_STEP, Cancelled, Pipeline
+from .points import POINT_CLASSES, prototype
+from .stats import ImportStats
+from .tags import StringTable
+
+# objects waiting for the main thread in a background import
+JOB_QUEUE = 1024
+
+
+def get_material(materialname, color):
+    if bpy.data.materials.get(materialname) is not None:
+        mat = bpy.data.materials[materialname]
+    else:
+        # create material
+        mat = bpy.data.materials.new(name=materialname)
+        if hasattr(bpy.context.scene, 'collection'):
+            mat.diffuse_color = color
+        else:
+            mat.diffuse_color = (color[0], color[1], color[2])
+    return mat
+
+
+def fill_mesh(mesh, co, edges, loops, loop_starts, loop_totals, face_materials=None):
+    # bulk copy of flat geometry arrays into an empty mesh
+    co = np.asarray(co, dtype=np.float32).reshape(-1, 3)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set("co", co.ravel())
+    if len(edges):
+        mesh.edges.add(len(edges) // 2)
+        mesh.edges.foreach_set("vertices", np.asarray(edges, dtype=np.int32))
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", np.asarray(loops, dtype=np.int32))
+    mesh.polygons.add(len(loop_starts))
+    mesh.polygons.foreach_set("loop_start", np.asarray(loop_starts, dtype=np.int32))
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", np.asarray(loop_totals, dtype=np.int32))
+    if face_materials is not None:
+        mesh.polygons.foreach_set("material_index", np.asarray(face_materials, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+
+def add_face_layer(mesh, name, values):
+    if hasattr(mesh, "attributes"):
+        layer = mesh.attributes.new(name=name, type="INT", domain="FACE")
+    else:
+        layer = mesh.polygon_layers_int.new(name=name)
+    layer.data.foreach_set("value", values)
+
+
+def remove_tag_ids(starts, ids, removed):
+    """starts and ids of TagArrays without the tags of the removed features"""
+    new_starts = [0]
+    new_ids = []
+    for feature in range(len(starts) - 1):
+        if feature not in removed:
+            new_ids.extend(ids[starts[feature]:starts[feature + 1]])
+        new_starts.append(len(new_ids))
+    return new_starts, new_ids
+
+
+def add_obj(obj, tile=None, parent=None):
+    if tile:
+        # tiles are parented as a whole, their objects stay unselected
+        collection, parent = tile
+        collection.objects.link(obj)
+        obj.parent = parent
+    elif hasattr(bpy.context.scene, 'collection'):
+        bpy.context.scene.collection.objects.link(obj)
+        if parent is not None:
+            obj.parent = parent
+        else:
+            obj.select_set(state=True)
+    else:
+        bpy.context.scene.objects.link(obj)
+        if parent is not None:
+            obj.parent = parent
+        else:
+            obj.select = True
+
+
+def add_tile(name, parent=None):
+    """Collection and parent empty of a tile, emptied when the tile is imported again"""
+    if hasattr(bpy.data, 'collections'):
+        collection = bpy.data.collections.get(name)
+        if collection is None:
+            collection = bpy.data.collections.new(name)
+            bpy.context.scene.collection.children.link(collection)
+        for obj in list(collection.objects):
+            bpy.data.objects.remove(obj)
+    else:
+        collection = bpy.context.scene
+    empty = bpy.data.objects.new(name, None)
+    collection.objects.link(empty)
+    if parent is not None:
+        empty.parent = parent
+    elif hasattr(empty, 'select_set'):
+        empty.select_set(state=True)
+    else:
+        empty.select = True
+    return collection, empty
+
+
+class ObjectOutput:
+    """The output hooks of the pipeline making Blender objects, run on the main thread"""
+    # of a background import, its objects are parented when made
+    parent_object = None
+
+    def open_tile(self, name):
+        self.tiles[name] = add_tile(name, self.parent_object)
+
+    def link(self, obj, tile):
+        add_obj(obj, self.tiles.get(tile), self.parent_object)
+        self.stats.counts["objects"] += 1
+
+    def add_mesh(self, tile, name, buf, merged):
+        # merged meshes are named after their category, the others get the OSM id
+        mesh = bpy.data.meshes.new(name if merged else buf.feature_ids[0])
+        fill_mesh(mesh, buf.co, buf.edges, buf.loops, buf.loop_starts, buf.loop_totals, buf.face_materials)
+        obj = bpy.data.objects.new(name, mesh)
+        self.link(obj, tile)
+        self.index_objects(obj.name, buf, merged)
+        start = time.perf_counter()
+        for materialname, color in buf.materials:
+            mesh.materials.append(get_material(materialname, color))
+        self.stats.add_time("materials", time.perf_counter() - start)
+        self.add_tags(obj, mesh, buf, merged)
+
+    def add_tags(self, obj, mesh, buf, merged):
+        table = self.tagStorage == "TABLE"
+        if not merged:
+            if table:
+                # key and value ids into scene["osm_strings"]
+                obj["osm_tag_ids"] = buf.tags.ids.tolist()
+                return
+            tags = buf.tags[0]
+            for key in tags:
+                obj[key] = tags[key]
+            return
+        # the faces know their feature, the features their OSM id and tags
+        add_face_layer(mesh, "osm_feature", buf.face_features)
+        obj["osm_ids"] = list(buf.feature_ids)
+        if table:
+            # the tag ids of feature i are osm_tag_ids[osm_tag_starts[i]:osm_tag_starts[i + 1]]
+            obj["osm_tag_starts"] = buf.tags.starts.tolist()
+            obj["osm_tag_ids"] = buf.tags.ids.tolist()
+            return
+        obj["osm_tags"] = [json.dumps(buf.tags[feature], ensure_ascii=False) for feature in range(len(buf.tags))]
+
+    def add_point_cloud(self, tile, name, co, point_class):
+        mesh = bpy.data.meshes.new(name)
+        fill_mesh(mesh, co, (), (), (), ())
+        obj = bpy.data.objects.new(name, mesh)
+        self.link(obj, tile)
+        # the prototype is a child of the cloud, which draws it on every vertex
+        buf = prototype(point_class)
+        proto_mesh = bpy.data.meshes.new(point_class + " prototype")
+        fill_mesh(proto_mesh, buf.co, buf.edges, buf.loops, buf.loop_starts, buf.loop_totals, buf.face_materials)
+        for materialname, color in buf.materials:
+            proto_mesh.materials.append(get_material(materialname, color))
+        proto = bpy.data.objects.new(point_class + " prototype", proto_mesh)
+        tile = self.tiles.get(tile)
+        add_obj(proto, (tile[0], obj) if tile else None, obj)
+        if hasattr(obj, "instance_type"):
+            obj.instance_type = "VERTS"
+        else:
+            obj.dupli_type = "VERTS"
+
+    def remove_features(self, name, features):
+        obj = bpy.data.objects.get(name)
+        if obj is None:
+            # deleted by hand
+            return
+        mesh = obj.data
+        if features[0][0] < 0:
+            bpy.data.objects.remove(obj)
+            if mesh is not None and not mesh.users:
+                bpy.data.meshes.remove(mesh)
+            return
+        # edges and faces of the features go, their vertices stay loose so that the
+        # vertex ranges of the other features in the index stay valid
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        bm.verts.ensure_lookup_table()
+        edges = set()
+        for feature, start, count in features:
+            for i in range(start, start + count):
+                edges.update(bm.verts[i].link_edges)
+        for edge in edges:
+            bm.edges.remove(edge)
+        bm.to_mesh(mesh)
+        bm.free()
+        mesh.update()
+        ids = list(obj["osm_ids"])
+        for feature, start, count in features:
+            ids[feature] = ""
+        obj["osm_ids"] = ids
+        if "osm_tag_ids" in obj:
+            obj["osm_tag_starts"], obj["osm_tag_ids"] = remove_tag_ids(
+                list(obj["osm_tag_starts"]), list(obj["osm_tag_ids"]), {feature for feature, start, count in features})
+            return
+        tags = list(obj["osm_tags"])
+        for feature, start, count in features:
+            tags[feature] = "{}"
+        obj["osm_tags"] = tags
+
+    def finish_strings(self):
+        # the string table grows with every import, the objects of the earlier ones keep their ids
+        strings = self.strings
+        self.strings = None
+        if self.tagStorage == "TABLE" and strings is not None:
+            bpy.context.scene["osm_strings"] = strings.strings
+
+
+class OsmParser(bpy.types.Operator, ImportHelper):
+    """Import a file in the OpenStreetMap format (.osm, .osm.bz2, .osm.gz, .osm.pbf), a preprocessed .osmgeom or apply changes (.osc)"""
+    # the import running
+    importer = None
+    # background import
+    stopping = None
+    built = 0
+    bl_idname = "import_scene.osm"
+    bl_label = "Import OpenStreetMap"
+    bl_options = {"REGISTER"}
+    filename_ext = ".osm"
+
+    filter_glob = bpy.props.StringProperty(
+        default="*.osm;*.osm.bz2;*.osm.gz;*.pbf;*.osmgeom;*.osc;*.osc.gz",
+        options={"HIDDEN"},
+    )
+
+    importBuildings = bpy.props.BoolProperty(
+        name="Import buildings",
+        description="Import building outlines",
+        default=True,
+    )
+
+    importNaturals = bpy.props.BoolProperty(
+        name="Import naturals",
+        description="Import natural outlines",
+        default=True,
+    )
+
+    importHighways = bpy.props.BoolProperty(
+        name="Import roads and paths",
+        description="Import roads and paths",
+        default=False,
+    )
+
+    importBarriers = bpy.props.BoolProperty(
+        name="Import barriers",
+        description="Import barriers",
+        default=True,
+    )
+
+    importLanduse = bpy.props.BoolProperty(
+        name="Import landuse",
+        description="Import landuse",
+        default=True,
+    )
+    importRelations = bpy.props.BoolProperty(
+        name="Import multipolygons",
+        description="Read the multipolygon relations first and import their outer and inner rings "
+                    "as areas (lakes, forests, large buildings)",
+        default=False,
+    )
+    importPoints = bpy.props.BoolProperty(
+        name="Import point features",
+        description="Import tagged nodes (trees, benches, lamps...) as one point cloud per class "
+                    "with a prototype object instanced on its vertices",
+        default=False,
+    )
+    pointClasses = bpy.props.EnumProperty(
+        name="Point classes",
+        description="Classes of point features to import",
+        items=[(name, name.replace("_", " ").capitalize(), "") for name in sorted(POINT_CLASSES)],
+        options={"ENUM_FLAG"},
+        default=set(POINT_CLASSES),
+    )
+    rulesFile = bpy.props.StringProperty(
+        name="Rules file",
+        description="JSON list of rules sending tagged ways to the importers, added to the built-in ones",
+        default="",
+        subtype="FILE_PATH",
+    )
+    mergeMeshes = bpy.props.BoolProperty(
+        name="Merge objects",
+        description="One mesh per feature category instead of an object per way, "
+                    "OSM ids and tags are kept per face",
+        default=False,
+    )
+    tagStorage = bpy.props.EnumProperty(
+        name="Tag storage",
+        description="How the objects keep the OSM tags of their ways",
+        items=(
+            ("PROPERTIES", "Properties", "A custom property per tag, merged objects a JSON text per way"),
+            ("TABLE", "String table", "Key and value ids into one table of the scene, one property per object"),
+        ),
+        default="PROPERTIES",
+    )
+    simplifyTolerance = bpy.props.FloatProperty(
+        name="Simplify areas (m)",
+        description="Douglas-Peucker tolerance for the outlines of naturals and landuse, 0 keeps every node",
+        min=0.0,
+        default=0.0,
+    )
+    lodLevels = bpy.props.IntProperty(
+        name="Levels of detail",
+        description="Meshes per simplified area, each further one with 4 times the tolerance of the one before",
+        min=1, max=6,
+        default=1,
+    )
+    referencedNodesOnly = bpy.props.BoolProperty(
+        name="Referenced nodes only",
+        description="Read the file twice and keep only the nodes of the imported ways (less memory)",
+        default=False,
+    )
+    nodeStorage = bpy.props.EnumProperty(
+        name="Node storage",
+        description="Where to keep node locations while importing",
+        items=(
+            ("MEMORY", "Memory", "Packed arrays in memory, fastest"),
+            ("SPARSE_FILE", "Sparse file", "Memory-mapped file sorted by id, for extracts larger than RAM"),
+            ("DENSE_FILE", "Dense file", "Memory-mapped file indexed by id, for continents and the planet"),
+        ),
+        default="MEMORY",
+    )
+    nodeStorageDir = bpy.props.StringProperty(
+        name="Node storage directory",
+        description="Directory for the node storage file (system temp if empty)",
+        default="",
+        subtype="DIR_PATH",
+    )
+    parserEngine = bpy.props.EnumProperty(
+        name="Parser",
+        description="XML parsing engine",
+        items=(
+            ("EXPAT", "Expat", "Expat callbacks dispatched by tag, fastest"),
+            ("ETREE", "ElementTree", "ElementTree iterparse"),
+        ),
+        default="EXPAT",
+    )
+    useCache = bpy.props.BoolProperty(
+        name="Cache parsed data",
+        description="Keep the parsed nodes and ways on disk, later imports of the same file skip parsing",
+        default=False,
+    )
+    cacheDir = bpy.props.StringProperty(
+        name="Cache directory",
+        description="Directory of the cache (next to the imported file if empty)",
+        default="",
+        subtype="DIR_PATH",
+    )
+    cacheSize = bpy.props.IntProperty(
+        name="Cache size (MB)",
+        description="Least recently used files are removed from the cache above this size",
+        min=1,
+        default=4096,
+    )
+    tiledImport = bpy.props.BoolProperty(
+        name="Split into tiles",
+        description="Import the tiles touching the lat/lon window, each into its own collection with "
+                    "a parent empty, from an index in the cache (implies Cache parsed data)",
+        default=False,
+    )
+    tileSize = bpy.props.FloatProperty(
+        name="Tile size (m)",
+        description="Edge length of the tiles",
+        min=10.0,
+        default=1000.0,
+    )
+    updateIndex = bpy.props.StringProperty(
+        name="Update index",
+        description="Directory recording the imported ways and their objects. Change files (.osc) opened "
+                    "with the same index rebuild only the ways they touch, with the options of the import",
+        default="",
+        subtype="DIR_PATH",
+    )
+    background = bpy.props.BoolProperty(
+        name="Import in background",
+        description="Parse in a worker thread and create the objects a few at a time, "
+                    "with a progress bar, ETA and Esc to cancel",
+        default=False,
+    )
+    frameBudget = bpy.props.IntProperty(
+        name="Time per update (ms)",
+        description="Time spent creating objects between two redraws of a background import",
+        min=5, max=1000,
+        default=30,
+    )
+    statsFile = bpy.props.StringProperty(
+        name="Statistics file",
+        description="Write the times per stage and handler, element counts, skipped ways and "
+                    "peak memory of the import to this JSON file",
+        default="",
+        subtype="FILE_PATH",
+    )
+    profileParse = bpy.props.BoolProperty(
+        name="Profile",
+        description="Run the parsing under cProfile, the statistics go next to the statistics file "
+                    "(.prof) or to the console",
+        default=False,
+    )
+    parallelWorkers = bpy.props.IntProperty(
+        name="Workers",
+        description="Processes parsing the nodes (.osm), decompressing (.osm.bz2) or decoding the blocks (.pbf) in parallel",
+        min=1, max=64,
+        default=1,
+    )
+    minLat = bpy.props.FloatProperty(
+        name="Min lat",
+        description="Minimum latitude",
+        min=-90.0, soft_min=-90.0,
+        max=90.0, soft_max=90.0,
+        default=-90.0, precision=4,
+    )
+    maxLat = bpy.props.FloatProperty(
+        name="Max lat",
+        description="Maximum latitude",
+        min=-90.0, soft_min=-90.0,
+        max=90.0, soft_max=90.0,
+        default=90.0, precision=4,
+    )
+    minLon = bpy.props.FloatProperty(
+        name="Min lon",
+        description="Minimum longitude",
+        min=-180.0, soft_min=-180.0,
+        max=180.0, soft_max=180.0,
+        default=-180.0, precision=4,
+    )
+    maxLon = bpy.props.FloatProperty(
+        name="Max lon",
+        description="Maximum longitude",
+        min=-180.0, soft_min=-180.0,
+        max=180.0, soft_max=180.0,
+        default=180.0, precision=4,
+    )
+
+    def worker_executable(self):
+        # Blender before 2.91 is its own sys.executable
+        return getattr(bpy.app, "binary_path_python", None)
+
+    def finish_stats(self):
+        stats = self.importer.stats
+        self.importer = None
+        stats.print_table()
+        if self.statsFile:
+            stats.write(bpy.path.abspath(self.statsFile))
+        self.report({"INFO"}, "Imported " + stats.summary())
+
+    def execute(self, context):
+        bpy.ops.object.select_all(action="DESELECT")
+        name = os.path.basename(self.filepath)
+
+        bpy.ops.object.empty_add(type="PLAIN_AXES", location=(0, 0, 0))
+        parent_object = context.active_object
+        parent_object.name = name
+
+        # the import runs with a copy of the options, which an update sets to those of its index
+        importer = self.importer = ImportRun(self, context.scene.get("osm_strings", ()))
+        if self.background:
+            return self.start_background(context, parent_object)
+
+        try:
+            importer.profiled_parse(self.filepath)
+        finally:
+            # objects made before a failure refer to the strings too
+            importer.finish_strings()
+        importer.finish_index()
+        with importer.stats.stage("scene update"):
+            bpy.context.scene.update()
+
+        if hasattr(context, 'scene'):
+            context.scene.objects.active = parent_object
+        else:
+            context.view_layer.objects.active = parent_object
+        with importer.stats.stage("parent"):
+            bpy.ops.object.parent_set()
+
+        bpy.ops.object.select_all(action="DESELECT")
+        self.finish_stats()
+        return {"FINISHED"}
+
+    # Background import: the ImportRun parses in a worker thread, build() hands the objects to modal()
+    def start_background(self, context, parent_object):
+        # objects are parented when created, selecting them would race with the user
+        self.importer.parent_object = parent_object
+        self.importer.jobs = queue.Queue(JOB_QUEUE)
+        self.built = 0
+        self.stopping = None
+        self.started = time.perf_counter()
+        self.worker = threading.Thread(target=self.importer.run, args=(self.filepath,))
+        self.worker.daemon = True
+        self.worker.start()
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(TIMER_STEP, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        importer = self.importer
+        if event.type == "ESC":
+            if self.stopping is None:
+                self.cancel_background(context, "Import cancelled, %d objects kept" % self.built)
+            return {"RUNNING_MODAL"}
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+        if self.stopping is not None:
+            # the worker stops at its next look at the cancel flag, the UI doesn't wait for it
+            if importer.done:
+                return self.stop_background(context, *self.stopping)
+            return {"PASS_THROUGH"}
+        # objects created so far are complete, so stopping between two of them keeps the scene consistent
+        deadline = time.perf_counter() + self.frameBudget / 1000.0
+        try:
+            while importer.failed is None and time.perf_counter() < deadline:
+                try:
+                    func, args = importer.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                importer.run_job(func, args)
+                self.built += 1
+        except Exception as e:
+            traceback.print_exc()
+            self.cancel_background(context, "Import failed: %s" % e, "ERROR")
+            return {"PASS_THROUGH"}
+        if importer.failed is not None:
+            return self.stop_background(context, "Import failed: %s" % importer.failed, "ERROR")
+        if importer.done and importer.jobs.empty():
+            return self.stop_background(context)
+        self.show_progress(context)
+        return {"PASS_THROUGH"}
+
+    def show_progress(self, context):
+        # half for the parsing, half for the objects of the parsed part
+        importer = self.importer
+        built = self.built / importer.queued if importer.queued else 1.0
+        progress = 0.5 * importer.progress * (1.0 + built)
+        text = "Importing %s: %d%%" % (os.path.basename(self.filepath), progress * 100)
+        if progress > 0.01:
+            left = int((time.perf_counter() - self.started) * (1.0 - progress) / progress)
+            text += ", %d:%02d left" % divmod(left, 60)
+        context.window_manager.progress_update(int(progress * 100))
+        if getattr(context, "workspace", None):
+            context.workspace.status_text_set(text + ", Esc to cancel")
+
+    def cancel_background(self, context, message, level="WARNING"):
+        self.stopping = (message, level)
+        self.importer.cancelled = True
+        if getattr(context, "workspace", None):
+            context.workspace.status_text_set("Stopping the import of %s" % os.path.basename(self.filepath))
+
+    def stop_background(self, context, message=None, level="WARNING"):
+        # the worker is done, this doesn't block
+        self.worker.join()
+        importer = self.importer
+        importer.jobs = None
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        if getattr(context, "workspace", None):
+            context.workspace.status_text_set(None)
+        bpy.ops.object.select_all(action="DESELECT")
+        if message:
+            importer.abort_index()
+        else:
+            importer.finish_index()
+        # the objects kept by a cancelled import refer to the strings too
+        importer.finish_strings()
+        self.finish_stats()
+        if message:
+            self.report({level}, message)
+            return {"CANCELLED"}
+        return {"FINISHED"}
+
+
+class ImportRun(ObjectOutput, Pipeline):
+    """One import with the options of the operator, parsed in a worker thread in the background
+
+    The options are copied from the operator on the main thread, so the worker never reads the
+    operator properties and an update changes the options of the run to those of its index,
+    not the properties. The objects are made on the main thread in either case.
+    """
+    failed = None
+    done = False
+
+    def __init__(self, operator, strings):
+        for name, value in operator.as_keywords().items():
+            setattr(self, name, value)
+        self.stats = ImportStats()
+        # the tags of the objects are ids into it, it is kept for the next import
+        self.strings = StringTable(strings)
+        # bpy.path.abspath reads the path of the blend file unless given its directory
+        self.blend_dir = os.path.dirname(bpy.data.filepath)
+        self.executable = operator.worker_executable()
+
+    def abspath(self, path):
+        return bpy.path.abspath(path, start=self.blend_dir)
+
+    def worker_executable(self):
+        return self.executable
+
+    def run(self, filename):
+        try:
+            self.profiled_parse(filename)
+        except Cancelled:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            self.failed = e
+        self.done = True
+
+
+def menu_func_import(self, context):
+    self.layout.operator(OsmParser.bl_idname, text="OpenStreetMap (.osm/.pbf/.osc)")
+
+
+def register():
+    bpy.utils.register_class(OsmParser)
+    if hasattr(bpy.types, 'TOPBAR_MT_file_import'):
+        bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+    else:
+        bpy.types.INFO_MT_file_import.append(menu_func_import)
+
+
+def unregister():
+    bpy.utils.unregister_class(OsmParser)
+    if hasattr(bpy.types, 'TOPBAR_MT_file_import'):
+        bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    else:
+        bpy.types.INFO_MT_file_import.remove(menu_func_import)
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+from array import array
+from xml.parsers import expat
+
+SCAN_BLOCK = 4 * 1024 * 1024
+# bytes of the node section per task, several tasks per worker balance the load
+TASK_SIZE = 64 * 1024 * 1024
+
+# set by init_worker in every process parsing nodes, the node filter is sent once per process
+options = {"bbox": (-90.0, 90.0, -180.0, 180.0), "node_filter": None, "node_tags": ()}
+
+
+def find_element(xml_f, names, start=0):
+    """Byte offset of the first start tag of one of the names at or after start, or -1"""
+    patterns = [b"<" + name.encode() for name in names]
+    pos = start
+    tail = b""
+    while True:
+        xml_f.seek(pos)
+        block = xml_f.read(SCAN_BLOCK)
+        if not block:
+            return -1
+        data = tail + block
+        base = pos - len(tail)
+        found = -1
+        for pattern in patterns:
+            i = data.find(pattern)
+            while i >= 0:
+                end = i + len(pattern)
+                if end >= len(data) and block:
+                    # can't tell "<way " from "<ways" yet, look again with the next block
+                    break
+                if data[end:end + 1] in b" \t\r\n/>":
+                    if found < 0 or i < found:
+                        found = i
+                    break
+                i = data.find(pattern, end)
+        if found >= 0:
+            return base + found
+        tail = data[-16:]
+        pos += len(block)
+
+
+def split_node_section(filename, parts):
+    """Byte ranges of the node section aligned to <node> elements
+
+    Returns (node_start, section_end, ranges), section_end is the start of the first
+    way/relation or the end of the root element. Ranges are None if there are no nodes.
+    """
+    with open(filename, "rb") as xml_f:
+        node_start = find_element(xml_f, ("node",))
+        section_end = find_element(xml_f, ("way", "relation"), max(node_start, 0))
+        if section_end < 0:
+            section_end = find_element(xml_f, ("/osm",), max(node_start, 0))
+        if node_start < 0 or (0 <= section_end < node_start):
+            return node_start, section_end, None
+        step = max((section_end - node_start) // parts, 1)
+        bounds = [node_start]
+        for i in range(1, parts):
+            b = find_element(xml_f, ("node",), max(node_start + i * step, bounds[-1] + 1))
+            if b < 0 or b >= section_end:
+                break
+            if b > bounds[-1]:
+                bounds.append(b)
+        bounds.append(section_end)
+    return node_start, section_end, list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_node_range(task):
+    """Parse the nodes in a byte range into packed arrays
+
+    Applies the same filters as Pipeline.start_node with the options of init_worker. Returns
+    the bytes of the id, lat and lon arrays and a dict of (lat, lon, tags) of the nodes with
+    one of the node_tags, which are there whether they pass the node filter or not.
+    """
+    filename, start, end = task
+    node_filter = options["node_filter"]
+    node_tags = options["node_tags"]
+    min_lat, max_lat, min_lon, max_lon = options["bbox"]
+    with open(filename, "rb") as xml_f:
+        xml_f.seek(start)
+        data = xml_f.read(end - start)
+    ids = array("q")
+    lats = array("d")
+    lons = array("d")
+    tagged = {}
+    last = {"node": None}
+
+    def start_node(attrib):
+        node_id = int(attrib.get("id"))
+        clat = float(attrib.get("lat"))
+        clon = float(attrib.get("lon"))
+        last["node"] = None
+        if min_lat <= clat <= max_lat and min_lon <= clon <= max_lon:
+            if node_filter is None or node_id in node_filter:
+                ids.append(node_id)
+                lats.append(clat)
+                lons.append(clon)
+            if node_tags:
+                last["node"] = (node_id, clat, clon)
+
+    def start_tag(attrib):
+        k = attrib.get("k")
+        if k not in node_tags or last["node"] is None:
+            return
+        node_id, clat, clon = last["node"]
+        node = tagged.get(node_id)
+        if node is None:
+            node = tagged[node_id] = (clat, clon, {})
+        node[2][k] = attrib.get("v")
+
+    handlers = {"node": start_node, "tag": start_tag}
+
+    def start(tag, attrib):
+        handler = handlers.get(tag)
+        if handler is not None:
+            handler(attrib)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.Parse(b"<osm>", False)
+    parser.Parse(data, False)
+    parser.Parse(b"</osm>", True)
+    return ids.tobytes(), lats.tobytes(), lons.tobytes(), tagged
+
+
+def init_worker(bbox, node_filter, node_tags):
+    options["bbox"] = bbox
+    options["node_filter"] = node_filter
+    options["node_tags"] = node_tags
+
+
+def parse_nodes(filename, ranges, workers, bbox, node_filter, node_tags, executable=None):
+    """Parse the node ranges in a process pool, yield the results in file order"""
+    tasks = [(filename, start, end) for start, end in ranges]
+    context = multiprocessing.get_context("spawn")
+    if executable:
+        context.set_executable(executable)
+    with context.Pool(workers, initializer=init_worker, initargs=(bbox, node_filter, node_tags)) as pool:
+        for result in pool.imap(parse_node_range, tasks):
+            yield result
+
+
+def task_count(filename, workers):
+    return max(workers, min(workers * 8, os.path.getsize(filename) // TASK_SIZE + 1))
+
+
+class PrefixedFile:
+    """Read-only file object: some bytes followed by a file from an offset on"""
+
+    def __init__(self, prefix, filename, offset):
+        self.prefix = prefix
+        self.file = open(filename, "rb")
+        self.file.seek(offset)
+
+    def read(self, size=-1):
+        if self.prefix:
+            if size < 0:
+                data = self.prefix + self.file.read()
+                self.prefix = b""
+                return data
+            data = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return data
+        return self.file.read(size)
+
+    def close(self):
+        self.file.close()
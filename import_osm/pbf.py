@@ -0,0 +1,369 @@
+import lzma
+import multiprocessing
+import struct
+import zlib
+from array import array
+from collections import deque
+from .reader import CountingFile, StopReading
+
+# Minimal decoder of the OSM PBF format, see https://wiki.openstreetmap.org/wiki/PBF_Format
+# Only the protobuf wire format is needed, so it works without the protobuf package.
+
+SUPPORTED_FEATURES = {"OsmSchema-V0.6", "DenseNodes"}
+MEMBER_TYPES = ("node", "way", "relation")
+
+# set by init_worker in every process decoding blocks
+options = {"bbox": (-90.0, 90.0, -180.0, 180.0), "node_filter": None, "node_tags": (), "nodes": True}
+
+
+def is_pbf(filename):
+    return filename.lower().endswith(".pbf")
+
+
+def varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def signed(n):
+    # int64 fields are sent as two's complement varints
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def fields(buf):
+    """(field number, value) of a protobuf message, value is an int or a memoryview"""
+    buf = memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = varint(buf, pos)
+        elif wire == 2:
+            size, pos = varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise Exception("Unsupported protobuf wire type: " + str(wire))
+        yield key >> 3, value
+
+
+def packed(buf):
+    values = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def packed_delta(buf):
+    """Packed, zigzag and delta coded sint64 values"""
+    values = []
+    value = 0
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        n, pos = varint(buf, pos)
+        value += (n >> 1) ^ -(n & 1)
+        values.append(value)
+    return values
+
+
+def read_blobs(pbf_f):
+    """(type, blob) of every fileblock"""
+    while True:
+        head = pbf_f.read(4)
+        if not head:
+            return
+        header = pbf_f.read(struct.unpack(">I", head)[0])
+        blob_type = None
+        size = 0
+        for field, value in fields(header):
+            if field == 1:
+                blob_type = bytes(value).decode()
+            elif field == 3:
+                size = value
+        yield blob_type, pbf_f.read(size)
+
+
+def blob_data(blob):
+    for field, value in fields(blob):
+        if field == 1:
+            return bytes(value)
+        if field == 3:
+            return zlib.decompress(value)
+        if field == 4:
+            return lzma.decompress(value)
+        if field in (5, 6, 7):
+            raise Exception("Unsupported PBF compression (bzip2, lz4 or zstd)")
+    return b""
+
+
+def decode_header(data):
+    bounds = None
+    for field, value in fields(data):
+        if field == 1:
+            bbox = {}
+            for f, v in fields(value):
+                bbox[f] = zigzag(v) / 1000000000
+            bounds = {"minlon": bbox.get(1, 0.0), "maxlon": bbox.get(2, 0.0),
+                      "maxlat": bbox.get(3, 0.0), "minlat": bbox.get(4, 0.0)}
+        elif field == 4:
+            feature = bytes(value).decode()
+            if feature not in SUPPORTED_FEATURES:
+                raise Exception("Unsupported PBF feature: " + feature)
+    return [("bounds", bounds)] if bounds else []
+
+
+class NodeCollector:
+    """Nodes of a block which pass the filters, as packed arrays, and (lat, lon, tags) of the tagged ones"""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.tagged = {}
+        self.min_lat, self.max_lat, self.min_lon, self.max_lon = options["bbox"]
+        self.node_filter = options["node_filter"]
+        self.node_tags = options["node_tags"]
+
+    def add(self, node_id, lat, lon, tags=None):
+        # tags of the node tags make a point feature, whether the node filter passes the node or not
+        if self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon:
+            if self.node_filter is None or node_id in self.node_filter:
+                self.ids.append(node_id)
+                self.lats.append(lat)
+                self.lons.append(lon)
+            if tags:
+                self.tagged[node_id] = (lat, lon, tags)
+
+    def result(self):
+        return "nodes", self.ids.tobytes(), self.lats.tobytes(), self.lons.tobytes(), self.tagged
+
+
+def decode_block(data):
+    """Items of a PrimitiveBlock in file order"""
+    strings = []
+    groups = []
+    granularity = 100
+    lat_offset = 0
+    lon_offset = 0
+    for field, value in fields(data):
+        if field == 1:
+            strings = [bytes(s).decode() for f, s in fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = signed(value)
+        elif field == 20:
+            lon_offset = signed(value)
+
+    def coord(offset, value):
+        # exact integer division, gives the same float as the 7 decimals of the XML
+        return (offset + granularity * value) / 1000000000
+
+    items = []
+    for group in groups:
+        nodes = None
+        ways = []
+        relations = []
+        for field, value in fields(group):
+            if field == 1 and options["nodes"]:
+                nodes = nodes or NodeCollector()
+                decode_node(value, strings, nodes, coord, lat_offset, lon_offset)
+            elif field == 2 and options["nodes"]:
+                nodes = nodes or NodeCollector()
+                decode_dense(value, strings, nodes, coord, lat_offset, lon_offset)
+            elif field == 3:
+                ways.append(decode_way(value, strings))
+            elif field == 4:
+                relations.append(decode_relation(value, strings))
+        if nodes is not None:
+            items.append(nodes.result())
+        if ways:
+            items.append(("ways", ways))
+        if relations:
+            items.append(("relations", relations))
+    return items
+
+
+def decode_tags(keys, vals, strings):
+    return {strings[k]: strings[v] for k, v in zip(keys, vals)}
+
+
+def decode_node(data, strings, nodes, coord, lat_offset, lon_offset):
+    node_id = 0
+    keys = vals = ()
+    lat = lon = 0
+    for field, value in fields(data):
+        if field == 1:
+            node_id = zigzag(value)
+        elif field == 2:
+            keys = packed(value)
+        elif field == 3:
+            vals = packed(value)
+        elif field == 8:
+            lat = zigzag(value)
+        elif field == 9:
+            lon = zigzag(value)
+    tags = {k: v for k, v in decode_tags(keys, vals, strings).items() if k in nodes.node_tags}
+    nodes.add(node_id, coord(lat_offset, lat), coord(lon_offset, lon), tags)
+
+
+def decode_dense(data, strings, nodes, coord, lat_offset, lon_offset):
+    ids = lats = lons = ()
+    keys_vals = ()
+    for field, value in fields(data):
+        if field == 1:
+            ids = packed_delta(value)
+        elif field == 8:
+            lats = packed_delta(value)
+        elif field == 9:
+            lons = packed_delta(value)
+        elif field == 10:
+            keys_vals = packed(value)
+    node_tags = nodes.node_tags
+    kv = 0
+    for node_id, lat, lon in zip(ids, lats, lons):
+        tags = None
+        if keys_vals:
+            while keys_vals[kv]:
+                k = strings[keys_vals[kv]]
+                if k in node_tags:
+                    tags = tags or {}
+                    tags[k] = strings[keys_vals[kv + 1]]
+                kv += 2
+            kv += 1
+        nodes.add(node_id, coord(lat_offset, lat), coord(lon_offset, lon), tags)
+
+
+def decode_way(data, strings):
+    way_id = 0
+    keys = vals = refs = ()
+    for field, value in fields(data):
+        if field == 1:
+            way_id = value
+        elif field == 2:
+            keys = packed(value)
+        elif field == 3:
+            vals = packed(value)
+        elif field == 8:
+            refs = packed_delta(value)
+    return way_id, refs, decode_tags(keys, vals, strings)
+
+
+def decode_relation(data, strings):
+    relation_id = 0
+    keys = vals = roles = ids = types = ()
+    for field, value in fields(data):
+        if field == 1:
+            relation_id = value
+        elif field == 2:
+            keys = packed(value)
+        elif field == 3:
+            vals = packed(value)
+        elif field == 8:
+            roles = packed(value)
+        elif field == 9:
+            ids = packed_delta(value)
+        elif field == 10:
+            types = packed(value)
+    members = [(MEMBER_TYPES[t], ref, strings[r]) for t, ref, r in zip(types, ids, roles)]
+    return relation_id, members, decode_tags(keys, vals, strings)
+
+
+def init_worker(bbox, node_filter, node_tags, nodes):
+    options["bbox"] = bbox
+    options["node_filter"] = node_filter
+    options["node_tags"] = node_tags
+    options["nodes"] = nodes
+
+
+def decode_blob(task):
+    blob_type, blob = task
+    if blob_type == "OSMHeader":
+        return decode_header(blob_data(blob))
+    if blob_type == "OSMData":
+        return decode_block(blob_data(blob))
+    return []  # unknown blob types are to be skipped
+
+
+def decoded_blobs(pbf_f, workers, executable, initargs):
+    """Decoded items of every blob in file order, blobs are decoded by a process pool"""
+    if workers <= 1:
+        init_worker(*initargs)
+        for task in read_blobs(pbf_f):
+            yield decode_blob(task)
+        return
+    context = multiprocessing.get_context("spawn")
+    if executable:
+        context.set_executable(executable)
+    with context.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        # a few blobs per worker in flight, the file is not read ahead any further
+        pending = deque()
+        for task in read_blobs(pbf_f):
+            pending.append(pool.apply_async(decode_blob, (task,)))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def read_pbf(filename, handlers, add_nodes=None, workers=1, executable=None,
+             bbox=(-90.0, 90.0, -180.0, 180.0), node_filter=None, node_tags=(), progress=None):
+    """Call the element handlers like the XML readers do
+
+    Nodes are not passed to the node handler, add_nodes(ids, lats, lons, tagged) gets
+    the packed nodes of each block instead, and (lat, lon, tags) of the nodes with node_tags. Without add_nodes nodes are not decoded.
+    progress(position) is called with the file position after every read.
+    """
+    initargs = (bbox, node_filter, node_tags, add_nodes is not None)
+    with open(filename, "rb") as pbf_f:
+        try:
+            handlers["osm"]({})
+            source = CountingFile(pbf_f, progress) if progress else pbf_f
+            for items in decoded_blobs(source, workers, executable, initargs):
+                for item in items:
+                    kind = item[0]
+                    if kind == "nodes":
+                        add_nodes(*item[1:])
+                    elif kind == "ways":
+                        for way_id, refs, tags in item[1]:
+                            handlers["way"]({"id": str(way_id)})
+                            for ref_id in refs:
+                                handlers["nd"]({"ref": ref_id})
+                            for k, v in tags.items():
+                                handlers["tag"]({"k": k, "v": v})
+                    elif kind == "relations":
+                        for relation_id, members, tags in item[1]:
+                            handlers["relation"]({"id": str(relation_id)})
+                            for member_type, ref_id, role in members:
+                                handlers["member"]({"type": member_type, "ref": ref_id, "role": role})
+                            for k, v in tags.items():
+                                handlers["tag"]({"k": k, "v": v})
+                    elif kind == "bounds":
+                        handlers["bounds"](item[1])
+        except StopReading:
+            pass
@@ -0,0 +1,1091 @@
+import io
+import cProfile
+import math
+import os
+import pstats
+import queue
+import time
+import numpy as np
+from . import cache, compressed, geo, geometry, meshfile, parallel, pbf, relations, simplify, tiles, updates
+from .buffers import Mesh, MeshBuffer
+from .nodes import DenseFileNodeStore, IdSet, NodeStore, SparseFileNodeStore
+from .points import POINT_CLASSES, PointCollector
+from .reader import CountingFile, StopReading, readers
+from .rules import DEFAULT_RULES, WayClassifier, load_rules
+from .stats import ImportStats
+from .tags import StringTable, parse_length, parse_number, tag_list
+
+# ways extruded per call of a geometry kernel
+EXTRUSION_BATCH = 4096
+# outline points per call of the simplification kernel, its temporaries grow with them
+SIMPLIFY_BATCH = 1 << 18
+# tolerance of every further level of detail, as a multiple of the one before
+LOD_FACTOR = 4.0
+# seconds between the timer events of a background import
+TIMER_STEP = 0.05
+# options an update takes from the update index, so the changed ways look like the others
+INDEX_OPTIONS = (
+    "importBuildings", "importNaturals", "importHighways", "importBarriers", "importLanduse",
+    "rulesFile", "mergeMeshes", "tagStorage", "simplifyTolerance", "lodLevels",
+    "minLat", "maxLat", "minLon", "maxLon",
+)
+# handlers drawing closed rings, multipolygon relations go to these only
+AREA_HANDLERS = ("handler_buildings", "handler_building_parts", "handler_naturals", "handler_landuse",
+                 "handler_amenity")
+
+
+class Cancelled(Exception):
+    """Raised in the worker thread of a background import after Esc"""
+
+
+class Pipeline:
+    """Parsing, filtering, projection, classification and geometry of an import, without Blender
+
+    The meshes go to the output hooks open_tile() and add_mesh(): the operator creates objects
+    from them, the preprocessor writes them to an intermediate geometry file. The options have
+    the names and defaults of the operator properties.
+    """
+    importBuildings = True
+    importNaturals = True
+    importHighways = False
+    importBarriers = True
+    importLanduse = True
+    importRelations = False
+    importPoints = False
+    pointClasses = set(POINT_CLASSES)
+    rulesFile = ""
+    mergeMeshes = False
+    tagStorage = "PROPERTIES"
+    simplifyTolerance = 0.0
+    lodLevels = 1
+    referencedNodesOnly = False
+    nodeStorage = "MEMORY"
+    nodeStorageDir = ""
+    parserEngine = "EXPAT"
+    useCache = False
+    cacheDir = ""
+    cacheSize = 4096
+    tiledImport = False
+    tileSize = 1000.0
+    statsFile = ""
+    profileParse = False
+    parallelWorkers = 1
+    updateIndex = ""
+    minLat = -90.0
+    maxLat = 90.0
+    minLon = -180.0
+    maxLon = 180.0
+
+    nodes = None
+    curr_way = None
+    node_tags = set()  # which tags to keep of the nodes, the keys of the point classes
+    radius = 6378137
+    lat = 0
+    lon = 0
+    lat_rad = 0
+    bounds = None
+    buffers = {}
+    extrusions = {}
+    simplifications = {}
+    stage = 0
+    last_node = None
+    node_filter = None
+    classifier = None
+    stats = None
+    strings = None
+    tile = None
+    tiles = {}
+    index = None
+    relations = None
+    points = None
+    # set by a background import
+    jobs = None
+    cancelled = False
+    queued = 0
+    progress = 0.0
+    file_size = 0
+    total = 0  # debug
+
+    def abspath(self, path):
+        return path
+
+    def worker_executable(self):
+        return None
+
+    def window(self):
+        return self.minLat, self.maxLat, self.minLon, self.maxLon
+
+    def read(self, filename, handlers, add_nodes=None, bbox=None, node_filter=None):
+        # bbox and node_filter apply to the nodes given to add_nodes
+        bbox = bbox or self.window()
+        self.file_size = os.path.getsize(filename)
+        if pbf.is_pbf(filename):
+            pbf.read_pbf(filename, handlers, add_nodes, self.parallelWorkers, self.worker_executable(),
+                         bbox, node_filter, self.node_tags, self.read_progress)
+            return
+        if compressed.is_compressed(filename):
+            # decompressed while parsing, the workers share the decompression as the file can't be split
+            xml_f = compressed.open_file(filename, self.parallelWorkers, self.worker_executable(),
+                                         self.read_progress)
+        elif add_nodes and self.parallelWorkers > 1:
+            self.read_parallel(filename, handlers, add_nodes, bbox, node_filter)
+            return
+        else:
+            xml_f = CountingFile(open(filename, "rb"), self.read_progress)
+        try:
+            readers[self.parserEngine](xml_f, handlers)
+        finally:
+            xml_f.close()
+
+    def read_parallel(self, filename, handlers, add_nodes, bbox, node_filter):
+        # the nodes are parsed by a process pool, everything after them as usual
+        workers = self.parallelWorkers
+        node_start, section_end, ranges = parallel.split_node_section(
+            filename, parallel.task_count(filename, workers))
+        if ranges:
+            # the root element and the bounds before the first node
+            with open(filename, "rb") as xml_f:
+                header = xml_f.read(node_start)
+            xml_f = io.BytesIO(header + b"</osm>")
+        else:
+            xml_f = CountingFile(open(filename, "rb"), self.read_progress)
+        try:
+            readers[self.parserEngine](xml_f, handlers)
+        finally:
+            xml_f.close()
+        if not ranges:
+            return
+        results = parallel.parse_nodes(filename, ranges, workers, bbox, node_filter, self.node_tags,
+                                       self.worker_executable())
+        for (start, end), (ids, lats, lons, tagged) in zip(ranges, results):
+            add_nodes(ids, lats, lons, tagged)
+            self.read_progress(end)
+        xml_f = CountingFile(parallel.PrefixedFile(b"<osm>", filename, section_end), self.read_progress,
+                             section_end - len(b"<osm>"))
+        try:
+            readers[self.parserEngine](xml_f, handlers)
+        finally:
+            xml_f.close()
+
+    def collect_referenced_nodes(self, filename):
+        # first pass: ids of the nodes used by ways which some enabled handler will import
+        referenced = IdSet()
+        members = self.relations.members if self.relations is not None else IdSet()
+        way = {"id": -1, "tags": None, "refs": []}
+
+        def flush_way(attrib=None):
+            if way["tags"] and self.classifier.classify(way["tags"]) or way["id"] in members:
+                for ref_id in way["refs"]:
+                    referenced.add(ref_id)
+            way["id"] = int(attrib.get("id")) if attrib else -1
+            way["tags"] = {}
+            way["refs"] = []
+
+        def start_tag(attrib):
+            if way["tags"] is not None:
+                way["tags"][attrib.get("k")] = attrib.get("v")
+
+        def start_nd(attrib):
+            way["refs"].append(int(attrib.get("ref")))
+
+        def start_relation(attrib):
+            # ways are always before relations
+            flush_way()
+            raise StopReading()
+
+        def skip(attrib):
+            pass
+
+        self.read(filename, {
+            "osm": skip,
+            "bounds": skip,
+            "node": skip,
+            "tag": start_tag,
+            "way": flush_way,
+            "nd": start_nd,
+            "relation": start_relation,
+            "member": skip,
+        })
+        if way["tags"] is not None:
+            flush_way()
+        print("Referenced nodes:", len(referenced))
+        return referenced
+
+    def collect_relations(self, filename):
+        # first pass: the multipolygons some area handler imports, which tells the member ways to keep
+        multipolygons = relations.Multipolygons(self.is_imported_multipolygon)
+        if pbf.is_pbf(filename) or compressed.is_compressed(filename):
+            self.read(filename, multipolygons.handlers())
+        else:
+            # relations are at the end of the file, the rest is skipped without parsing it
+            with open(filename, "rb") as xml_f:
+                start = parallel.find_element(xml_f, ("relation",))
+            if start >= 0:
+                self.file_size = os.path.getsize(filename)
+                xml_f = CountingFile(parallel.PrefixedFile(b"<osm>", filename, start), self.read_progress,
+                                     start - len(b"<osm>"))
+                try:
+                    readers[self.parserEngine](xml_f, multipolygons.handlers())
+                finally:
+                    xml_f.close()
+        multipolygons.finish()
+        self.stats.counts["relations"] += multipolygons.count
+        print("Multipolygons:", len(multipolygons), "Member ways:", len(multipolygons.way_ids))
+        return multipolygons
+
+    def is_imported_multipolygon(self, tags):
+        if tags.get("type") != "multipolygon":
+            return False
+        return any(h.__name__ in AREA_HANDLERS for h in self.classifier.classify(tags))
+
+    def create_node_store(self):
+        if self.nodeStorage == "DENSE_FILE":
+            return DenseFileNodeStore(self.nodeStorageDir)
+        if self.nodeStorage == "SPARSE_FILE":
+            return SparseFileNodeStore(self.nodeStorageDir)
+        return NodeStore()
+
+    def parse(self, filename):
+        if self.stats is None:
+            self.stats = ImportStats()
+        if self.strings is None:
+            # the tags of the meshes are ids into it, it is kept for the next import
+            self.strings = StringTable()
+        self.classifier = self.create_classifier()
+        self.nodes = None
+        self.buffers = {}
+        self.extrusions = {}
+        self.simplifications = {}
+        self.tiles = {}
+        self.curr_way = None
+        self.stage = 0  # 0 - need osm, 1 - in osm, 2 - in node, 3 - in way, 4 - in relation
+        self.last_node = None
+        self.progress = 0.0
+        self.index = None
+        self.relations = None
+        self.points = None
+        self.node_tags = set()
+        if self.importPoints and not meshfile.is_mesh_file(filename) and not updates.is_change_file(filename):
+            self.points = PointCollector(self.pointClasses)
+            self.node_tags = self.points.keys
+        if self.updateIndex and not meshfile.is_mesh_file(filename) and not updates.is_change_file(filename):
+            # finished by finish_index() once the objects have their names
+            self.index = updates.IndexWriter(self.abspath(self.updateIndex), filename,
+                                             {name: getattr(self, name) for name in INDEX_OPTIONS})
+        try:
+            if self.importRelations and not meshfile.is_mesh_file(filename) and not updates.is_change_file(filename):
+                with self.stats.stage("relations"):
+                    self.relations = self.collect_relations(filename)
+            if meshfile.is_mesh_file(filename):
+                self.load_meshes(filename)
+            elif updates.is_change_file(filename):
+                self.apply_changes(filename)
+            elif self.tiledImport:
+                self.parse_tiled(filename)
+            elif self.useCache:
+                self.load_cached(self.open_cache(filename))
+            else:
+                self.parse_file(filename)
+            if self.relations is not None:
+                with self.stats.stage("multipolygons"):
+                    self.build_multipolygons()
+            if self.points is not None:
+                with self.stats.stage("points"):
+                    self.build_points()
+            if self.index is not None:
+                self.index.add_nodes_from(self.nodes)
+        except BaseException:
+            self.abort_index()
+            raise
+        finally:
+            if self.nodes is not None:
+                self.stats.counts["nodes"] = len(self.nodes)
+                self.nodes.close()
+        self.flush_geometry()
+
+    def finish_index(self):
+        # after the output of the last object, the index records the object names
+        index = self.index
+        self.index = None
+        if index is not None:
+            index.finish({"lat": self.lat, "lon": self.lon})
+
+    def abort_index(self):
+        index = self.index
+        self.index = None
+        if index is not None:
+            index.abort()
+
+    def index_objects(self, name, buf, merged):
+        """Record the object made from a MeshBuffer or Mesh in the update index"""
+        if self.index is None:
+            return
+        # multipolygons ("r" and the relation id) are not part of the index
+        if not merged:
+            if not buf.feature_ids[0].startswith("r"):
+                self.index.add_object(int(buf.feature_ids[0]), name, -1, 0, 0)
+            return
+        starts = list(buf.feature_starts) + [len(buf.co) // 3]
+        for feature, feature_id in enumerate(buf.feature_ids):
+            if feature_id.startswith("r"):
+                continue
+            self.index.add_object(int(feature_id), name, feature, starts[feature],
+                                  starts[feature + 1] - starts[feature])
+
+    def profiled_parse(self, filename):
+        if not self.profileParse:
+            self.parse(filename)
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(self.parse, filename)
+        finally:
+            if self.statsFile:
+                profile.dump_stats(os.path.splitext(self.abspath(self.statsFile))[0] + ".prof")
+            else:
+                pstats.Stats(profile).sort_stats("cumulative").print_stats(40)
+
+    def parse_file(self, filename):
+        self.node_filter = None
+        if self.referencedNodesOnly:
+            with self.stats.stage("referenced nodes"):
+                self.node_filter = self.collect_referenced_nodes(filename)
+        self.nodes = self.create_node_store()
+        handlers = {
+            "osm": self.start_osm,
+            "bounds": self.start_bounds,
+            "node": self.start_node,
+            "tag": self.start_tag,
+            "way": self.start_way,
+            "nd": self.start_nd if self.index is None and self.relations is None else self.start_nd_with_refs,
+            "relation": self.start_relation,
+            "member": self.start_member,
+        }
+        with self.stats.stage("read"):
+            self.read(filename, handlers, self.add_nodes, node_filter=self.node_filter)
+        if self.last_node:
+            # the last node of a file without ways
+            self.flush_node()
+        if self.curr_way:
+            # the last way of a file without relations
+            self.way_handler()
+            self.curr_way = None
+
+    def load_meshes(self, filename):
+        # a preprocessed import, only the output is left to do
+        data = meshfile.MeshFile(filename)
+        for name in data.tiles:
+            self.build(self.open_tile, name)
+        with self.stats.stage("read"):
+            for n, (tile, name, mesh, merged, point_class) in enumerate(data.meshes(self.strings)):
+                if not n & 1023:
+                    self.ways_progress(n, len(data))
+                if point_class:
+                    self.build(self.add_point_cloud, tile, name, mesh.co, point_class)
+                    continue
+                self.stats.counts["ways"] += len(mesh.feature_ids)
+                self.build(self.add_mesh, tile, name, mesh, merged)
+
+    def open_cache(self, filename):
+        # all nodes and ways of the file are parsed once into the cache, imports read them from there
+        directory = os.path.join(os.path.dirname(os.path.abspath(filename)), cache.CACHE_DIRNAME)
+        if self.cacheDir:
+            directory = self.abspath(self.cacheDir)
+        options = {"node_tags": sorted(self.node_tags)}
+        key = cache.cache_key(filename, options)
+        data = cache.open_entry(directory, key)
+        if data is None:
+            print("Caching", filename)
+            writer = cache.CacheWriter(directory, key, filename, options, self.node_tags)
+            try:
+                with self.stats.stage("cache"):
+                    self.read(filename, writer.handlers(), writer.add_nodes, bbox=(-90.0, 90.0, -180.0, 180.0))
+                    writer.finish()
+            except BaseException:
+                writer.abort()
+                raise
+            cache.evict(directory, self.cacheSize * 1024 * 1024, key)
+            data = cache.open_entry(directory, key)
+        return data
+
+    def load_cached(self, data):
+        if data.bounds:
+            self.start_bounds(data.bounds)
+        self.stage = 2
+        referenced = None
+        if self.referencedNodesOnly:
+            selected = np.array([bool(self.classifier.classify(tags)) for way_id, refs, tags in data.ways()],
+                                dtype=bool)
+            if self.relations is not None:
+                selected |= np.isin(data.way_ids, self.relations.way_ids)
+            referenced = np.unique(data.way_refs(selected))
+            print("Referenced nodes:", len(referenced))
+        self.nodes = self.create_node_store()
+        for start in range(0, len(data.node_ids), cache.READ_CHUNK * 16):
+            ids = data.node_ids[start:start + cache.READ_CHUNK * 16]
+            lats = data.node_lats[start:start + cache.READ_CHUNK * 16]
+            lons = data.node_lons[start:start + cache.READ_CHUNK * 16]
+            keep = (lats >= self.minLat) & (lats <= self.maxLat) & (lons >= self.minLon) & (lons <= self.maxLon)
+            if referenced is not None and len(referenced):
+                found = np.minimum(np.searchsorted(referenced, ids), len(referenced) - 1)
+                keep &= referenced[found] == ids
+            elif referenced is not None:
+                keep[:] = False
+            self.add_cached_nodes(data, ids[keep], lats[keep], lons[keep])
+        print("Nodes collected:", len(self.nodes))
+        if self.points is not None:
+            self.add_cached_points(data)
+        with self.stats.stage("project"):
+            self.nodes.project(self.lon, self.lat_rad, self.radius)
+        self.stage = 3
+        with self.stats.stage("read"):
+            for n, (way_id, refs, tags) in enumerate(data.ways()):
+                if not n & 1023:
+                    self.ways_progress(n, len(data))
+                self.load_way(way_id, refs, tags)
+
+    def parse_tiled(self, filename):
+        # only the tiles touching the window are read, each gets its own collection and parent empty
+        data = self.open_cache(filename)
+        index = tiles.open_index(data, self.tileSize)
+        if index is None:
+            print("Indexing tiles of", filename)
+            with self.stats.stage("index"):
+                index = tiles.build_index(data, self.tileSize)
+        if data.bounds:
+            self.start_bounds(data.bounds)
+        self.stage = 2
+        keys = index.tiles(self.window())
+        tile_ways = [index.ways(key) for key in keys]
+        self.nodes = self.create_node_store()
+        if keys:
+            self.add_cached_nodes(data, *index.nodes(data, np.concatenate(tile_ways)))
+        print("Tiles:", len(keys), "Nodes collected:", len(self.nodes))
+        if self.points is not None:
+            self.add_cached_points(data)
+        with self.stats.stage("project"):
+            self.nodes.project(self.lon, self.lat_rad, self.radius)
+        self.stage = 3
+        name = os.path.basename(filename)
+        total = sum(len(ways) for ways in tile_ways)
+        n = 0
+        for key, ways in zip(keys, tile_ways):
+            self.tile = "%s %d_%d" % ((name,) + index.row_column(key))
+            self.build(self.open_tile, self.tile)
+            with self.stats.stage("read"):
+                for way_id, refs, tags in data.select(ways):
+                    if not n & 1023:
+                        self.ways_progress(n, total)
+                    n += 1
+                    self.load_way(way_id, refs, tags)
+            self.flush_geometry()
+        self.tile = None
+
+    def add_cached_nodes(self, data, ids, lats, lons):
+        self.nodes.extend(ids.tobytes(), lats.tobytes(), lons.tobytes(), {})
+
+    def add_cached_points(self, data):
+        # the tagged nodes in the window, looked up in the node ids which files have in ascending order
+        if not data.node_tags or not len(data.node_ids):
+            return
+        ids = np.array(sorted(data.node_tags), dtype=np.int64)
+        found = np.minimum(np.searchsorted(data.node_ids, ids), len(data.node_ids) - 1)
+        keep = data.node_ids[found] == ids
+        ids = ids[keep]
+        lats = np.asarray(data.node_lats[found[keep]])
+        lons = np.asarray(data.node_lons[found[keep]])
+        keep = (lats >= self.minLat) & (lats <= self.maxLat) & (lons >= self.minLon) & (lons <= self.maxLon)
+        self.points.add_tagged({node_id: (lat, lon, data.node_tags[node_id]) for node_id, lat, lon in
+                                zip(ids[keep].tolist(), lats[keep].tolist(), lons[keep].tolist())})
+
+    def load_way(self, way_id, refs, tags):
+        self.curr_way = {"id": str(way_id), "refs": refs, "nodes": [], "points": [], "tags": tags}
+        if self.classifier.classify(tags):
+            index = self.nodes.index
+            for ref_id in refs:
+                i = index(ref_id)
+                if i >= 0:
+                    self.curr_way["nodes"].append(ref_id)
+                    self.curr_way["points"].append(i)
+        self.way_handler()
+        self.curr_way = None
+
+    def build_multipolygons(self):
+        # after the ways: every outer ring with the inner rings inside it goes to the area handlers
+        # as one polygon, the holes joined to the outline by bridges
+        stats = self.stats
+        stats.counts["multipolygons"] = len(self.relations)
+        for n, (relation_id, tags, outer, inner, missing) in enumerate(self.relations.relations()):
+            if not n & 1023:
+                self.ways_progress(n, len(self.relations))
+            if missing:
+                stats.skip("multipolygon member way not found")
+            outer, unclosed = relations.join_rings(outer)
+            inner, inner_unclosed = relations.join_rings(inner)
+            if unclosed or inner_unclosed:
+                stats.skip("multipolygon ring not closed")
+            outer = [ring for ring in map(self.ring_points, outer) if ring is not None]
+            inner = [ring for ring in map(self.ring_points, inner) if ring is not None]
+            holes = [[] for ring in outer]
+            areas = [abs(relations.ring_area(xy)) for points, xy in outer]
+            for points, xy in inner:
+                # the smallest outer ring around the first point of the hole
+                around = [k for k, (outer_points, outer_xy) in enumerate(outer)
+                          if relations.contains(outer_xy, xy[0, 0], xy[0, 1])]
+                if around:
+                    holes[min(around, key=areas.__getitem__)].append((points, xy))
+                else:
+                    stats.skip("multipolygon inner ring outside the outer rings")
+            handlers = [h for h in self.classifier.classify(tags) if h.__name__ in AREA_HANDLERS]
+            for (points, xy), ring_holes in zip(outer, holes):
+                points = relations.bridge_holes(points, xy, ring_holes)
+                self.curr_way = {"id": "r%d" % relation_id, "refs": [], "nodes": [],
+                                 "points": points + points[:1], "tags": tags}
+                for h in handlers:
+                    start = time.perf_counter()
+                    h()
+                    stats.add_handler(h.__name__, time.perf_counter() - start)
+        self.curr_way = None
+
+    def ring_points(self, ring):
+        # positions and coordinates of the nodes of a closed ring of refs, without the closing one
+        index = self.nodes.index
+        points = [i for i in map(index, ring[:-1]) if i >= 0]
+        if len(points) < 3:
+            self.stats.skip("polygon with fewer than 3 nodes")
+            return None
+        return points, np.array([self.nodes.xy(i) for i in points], dtype=np.float64)
+
+    def build_points(self):
+        # a mesh of loose vertices per class of point features, instancing the prototype of the class
+        self.stats.counts["points"] = len(self.points)
+        for name, lats, lons in self.points.classes():
+            xs, ys = geo.project(lats, lons, self.lon, self.lat_rad, self.radius)
+            co = np.zeros((len(xs), 3))
+            co[:, 0] = xs
+            co[:, 1] = ys
+            self.build(self.add_point_cloud, self.tile, name, co, name)
+
+    def apply_changes(self, filename):
+        # an osmChange file applied to an earlier import, only the ways it touches are built again
+        index = updates.open_index(self.abspath(self.updateIndex)) if self.updateIndex else None
+        if index is None:
+            raise Exception("Change files are applied through the update index of an earlier import, "
+                            "none found at: " + self.abspath(self.updateIndex))
+        # the options of the import the index was made for, the operator parses with a copy of its
+        # options (ImportRun), so they are not kept in its properties
+        for name, value in index.options.items():
+            setattr(self, name, value)
+        self.classifier = self.create_classifier()
+        self.lat = index.meta["origin"]["lat"]
+        self.lon = index.meta["origin"]["lon"]
+        self.lat_rad = math.radians(self.lat)
+        changes = updates.ChangeReader()
+        self.file_size = os.path.getsize(filename)
+        with self.stats.stage("read"):
+            xml_f = updates.open_change_file(filename, self.read_progress)
+            try:
+                readers[self.parserEngine](xml_f, changes.handlers())
+            finally:
+                xml_f.close()
+        self.stats.counts["relations"] += changes.relations
+        with self.stats.stage("index"):
+            ways = index.affected_ways(changes)
+            node_ids = set(changes.nodes)
+            for way in ways.values():
+                if way is not None:
+                    node_ids.update(way[0])
+            self.nodes = NodeStore()
+            for node_id in sorted(node_ids):
+                node = changes.nodes[node_id] if node_id in changes.nodes else index.node(node_id)
+                if node is None:
+                    continue
+                lat, lon = node
+                if self.minLat <= lat <= self.maxLat and self.minLon <= lon <= self.maxLon:
+                    self.nodes.add(node_id, lat, lon)
+        print("Changed nodes:", len(changes.nodes), "Ways to build:", len(ways))
+        with self.stats.stage("project"):
+            self.nodes.project(self.lon, self.lat_rad, self.radius)
+        self.stage = 3
+        self.index = index
+        removed = {}
+        for way_id in sorted(ways):
+            for name, feature, start, count in index.objects_of(way_id):
+                removed.setdefault(name, []).append((feature, start, count))
+            index.forget_objects(way_id)
+        for name, features in sorted(removed.items()):
+            self.build(self.remove_features, name, features)
+        with self.stats.stage("read"):
+            for n, way_id in enumerate(sorted(ways)):
+                if not n & 1023:
+                    self.ways_progress(n, len(ways))
+                if ways[way_id] is None:
+                    index.add_way(way_id, [], {}, False)
+                else:
+                    self.load_way(way_id, *ways[way_id])
+
+    def check_cancel(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def read_progress(self, position):
+        self.progress = position / max(self.file_size, 1)
+        self.check_cancel()
+
+    def ways_progress(self, n, total):
+        self.progress = n / max(total, 1)
+        self.check_cancel()
+
+    def add_nodes(self, ids, lats, lons, tagged):
+        # packed nodes parsed by worker processes instead of start_node, the tagged ones go to the points
+        self.check_cancel()
+        self.stage = 2
+        if tagged:
+            self.points.add_tagged(tagged)
+        self.nodes.extend(ids, lats, lons, {})
+
+    # Parser stages, called for the start of every element
+    def start_osm(self, attrib):
+        self.stage = 1
+
+    def start_bounds(self, attrib):
+        self.stage = 1
+        self.bounds = {
+            "minLat": float(attrib.get("minlat")),
+            "minLon": float(attrib.get("minlon")),
+            "maxLat": float(attrib.get("maxlat")),
+            "maxLon": float(attrib.get("maxlon"))
+        }
+        self.lat = (self.bounds["minLat"] + self.bounds["maxLat"]) * 0.5
+        self.lon = (self.bounds["minLon"] + self.bounds["maxLon"]) * 0.5
+        self.lat_rad = math.radians(self.lat)
+
+    def start_node(self, attrib):
+        self.stage = 2
+        if self.last_node:
+            self.flush_node()
+        node_id = int(attrib.get("id"))
+        clat = float(attrib.get("lat"))
+        clon = float(attrib.get("lon"))
+        self.last_node = None
+        if self.minLat <= clat <= self.maxLat and self.minLon <= clon <= self.maxLon:
+            referenced = self.node_filter is None or node_id in self.node_filter
+            if self.node_tags:
+                # wait for the tags of the node, point features pass the filter
+                self.last_node = {"id": node_id, "lat": clat, "lon": clon, "tags": {}, "referenced": referenced}
+            elif referenced:
+                self.nodes.add(node_id, clat, clon)
+
+    def flush_node(self):
+        node = self.last_node
+        self.last_node = None
+        if node["tags"]:
+            self.points.add(node["lat"], node["lon"], node["tags"])
+        if node["referenced"]:
+            self.nodes.add(node["id"], node["lat"], node["lon"])
+
+    def start_way(self, attrib):
+        if self.last_node:
+            self.flush_node()
+        if self.stage != 3:
+            print("Nodes collected:", len(self.nodes))
+            with self.stats.stage("project"):
+                self.nodes.project(self.lon, self.lat_rad, self.radius)
+        self.stage = 3
+        if self.curr_way:
+            self.way_handler()
+        self.curr_way = {"id": attrib.get("id"), "refs": [], "nodes": [], "points": [], "tags": {}}
+
+    def start_relation(self, attrib):
+        if self.relations is not None:
+            # read before the ways already
+            if self.curr_way:
+                self.way_handler()
+                self.curr_way = None
+            raise StopReading()
+        self.stage = 4
+        self.stats.counts["relations"] += 1
+        if self.curr_way:
+            self.way_handler()
+            self.curr_way = None
+
+    def start_tag(self, attrib):
+        if self.stage == 2:
+            k = attrib.get("k")
+            if self.last_node and k in self.node_tags:
+                self.last_node["tags"][k] = attrib.get("v")
+        elif self.stage == 3:
+            k = attrib.get("k")
+            self.curr_way["tags"][k] = attrib.get("v")
+        elif self.stage == 4:
+            pass  # skip
+        else:
+            raise Exception("Error in tag structure! Stage: " + str(self.stage) + " Tag: tag")
+
+    def start_nd(self, attrib):
+        ref_id = int(attrib.get("ref"))
+        i = self.nodes.index(ref_id)
+        if i >= 0:
+            self.curr_way["nodes"].append(ref_id)
+            self.curr_way["points"].append(i)
+
+    def start_nd_with_refs(self, attrib):
+        # the update index and the multipolygons need the refs out of the window too
+        self.curr_way["refs"].append(int(attrib.get("ref")))
+        self.start_nd(attrib)
+
+    def start_member(self, attrib):
+        pass  # skip
+
+    # Output of the handlers: a mesh per way or merged meshes per category
+    def open_tile(self, name):
+        """Output hook: the following meshes belong to the tile"""
+        raise NotImplementedError
+
+    def add_mesh(self, tile, name, buf, merged):
+        """Output hook: a MeshBuffer or Mesh with the features of a category when merged, else of one way"""
+        raise NotImplementedError
+
+    def add_point_cloud(self, tile, name, co, point_class):
+        """Output hook: the (n, 3) locations of the point features of a class"""
+        raise NotImplementedError
+
+    def remove_features(self, name, features):
+        """Output hook of updates: remove (feature, first vertex, vertex count) from the object, -1 is all of it"""
+        raise NotImplementedError
+
+    def build(self, func, *args):
+        # datablocks are created by the main thread, in a background import by its timer
+        if self.jobs is None:
+            self.run_job(func, args)
+            return
+        self.queued += 1
+        while True:
+            self.check_cancel()
+            try:
+                self.jobs.put((func, args), timeout=TIMER_STEP)
+                return
+            except queue.Full:
+                pass
+
+    def add_geometry(self, category, name, tags, verts, faces, edges, materials):
+        # geometry of the current way as for MeshBuffer.add()
+        self.add_feature(self.curr_way["id"], category, name, tags, verts, faces, edges, materials)
+
+    def way_strings(self):
+        """The string table of the tags of a mesh of one way, None keeps them as their dict"""
+        return self.strings if self.tagStorage == "TABLE" else None
+
+    def add_feature(self, feature_id, category, name, tags, verts, faces, edges, materials):
+        if not self.mergeMeshes:
+            buf = MeshBuffer(self.way_strings())
+            buf.add(feature_id, tags, verts, faces, edges, materials)
+            self.build(self.add_mesh, self.tile, name, buf, False)
+            return
+        buf = self.buffers.get(category)
+        if buf is None:
+            buf = self.buffers[category] = MeshBuffer(self.strings)
+        buf.add(feature_id, tags, verts, faces, edges, materials)
+        if buf.is_full():
+            self.build(self.add_mesh, self.tile, category, buf, True)
+            del self.buffers[category]
+
+    def run_job(self, func, args):
+        start = time.perf_counter()
+        func(*args)
+        self.stats.add_time("objects", time.perf_counter() - start)
+
+    def add_extrusion(self, category, kind, points, bottom, top, name, tags, materials):
+        # prisms and walls are generated in batches by the geometry kernels
+        key = (category, kind)
+        batch = self.extrusions.get(key)
+        if batch is None:
+            batch = self.extrusions[key] = []
+        batch.append((self.curr_way["id"], name, tags, materials, points, bottom, top))
+        if len(batch) >= EXTRUSION_BATCH:
+            self.flush_extrusions(key)
+
+    def flush_extrusions(self, key):
+        category, kind = key
+        batch = self.extrusions.pop(key)
+        kernel = geometry.prisms if kind == "prisms" else geometry.walls
+        with self.stats.stage("extrude"):
+            geom = kernel([b[4] for b in batch], [b[5] for b in batch], [b[6] for b in batch])
+        if self.mergeMeshes:
+            buf = self.buffers.get(category)
+            if buf is None:
+                buf = self.buffers[category] = MeshBuffer(self.strings)
+            buf.add_geometry(geom, [b[0] for b in batch], [b[2] for b in batch], [b[3] for b in batch])
+            if buf.is_full():
+                self.build(self.add_mesh, self.tile, category, buf, True)
+                del self.buffers[category]
+            return
+        strings = self.way_strings()
+        for k, (way_id, name, tags, materials, points, bottom, top) in enumerate(batch):
+            co, loops, loop_starts, loop_totals = geom.part(k)
+            face_materials = np.zeros(len(loop_starts), dtype=np.int32)
+            for i, (material, color, start, end) in enumerate(materials):
+                face_materials[start:end] = i
+            mesh_tags = tag_list(strings)
+            mesh_tags.append(tags)
+            mesh = Mesh(co, (), loops, loop_starts, loop_totals, face_materials,
+                        np.zeros(len(loop_starts), dtype=np.int32), [0],
+                        [(material, color) for material, color, start, end in materials], [way_id], mesh_tags)
+            self.build(self.add_mesh, self.tile, name, mesh, False)
+
+    def add_area(self, category, name, tags, materials):
+        # a flat polygon of the closed current way, its outline simplified in batches when a tolerance is set
+        points = self.curr_way["points"][:-1]
+        if self.simplifyTolerance <= 0:
+            verts = []
+            for i in points:
+                v = self.nodes.xy(i)
+                verts.append((v[0], v[1], 0))
+            self.add_geometry(category, name, tags, verts, [range(len(points))], [], materials)
+            return
+        batch = self.simplifications.get(category)
+        if batch is None:
+            # outline points so far and the areas
+            batch = self.simplifications[category] = [0, []]
+        batch[0] += len(points)
+        batch[1].append((self.curr_way["id"], name, tags, materials, points, self.nodes.coords(points)))
+        if batch[0] >= SIMPLIFY_BATCH:
+            self.flush_simplifications(category)
+
+    def flush_simplifications(self, category):
+        # level 0 keeps the names of the unsimplified import, every further level is a mesh of its own
+        total, batch = self.simplifications.pop(category)
+        with self.stats.stage("simplify"):
+            counts = np.array([len(b[4]) for b in batch], dtype=np.int64)
+            starts = geometry.offsets(counts)
+            xy = np.concatenate([b[5] for b in batch])
+            ids = np.concatenate([np.asarray(b[4], dtype=np.int64) for b in batch])
+            # every level simplifies the points of the one before, Douglas-Peucker keeps the same
+            # points as from the whole outline then, at a fraction of the cost
+            levels = [simplify.simplify_rings(xy, counts, ids, self.simplifyTolerance)]
+            for level in range(1, max(self.lodLevels, 1)):
+                keep = levels[-1].copy()
+                kept = np.add.reduceat(keep, starts[:-1])
+                keep[keep] = simplify.simplify_rings(xy[keep], kept, ids[keep],
+                                                     self.simplifyTolerance * LOD_FACTOR ** level)
+                levels.append(keep)
+        stats = self.stats
+        stats.counts["area vertices"] = stats.counts.get("area vertices", 0) + len(xy)
+        stats.counts["area vertices kept"] = stats.counts.get("area vertices kept", 0) + int(np.count_nonzero(levels[0]))
+        co = np.zeros((len(xy), 3))
+        co[:, :2] = xy
+        for level, keep in enumerate(levels):
+            suffix = " LOD%d" % level if level else ""
+            for k, (feature_id, name, tags, materials, points, ring) in enumerate(batch):
+                verts = co[starts[k]:starts[k + 1]][keep[starts[k]:starts[k + 1]]].tolist()
+                self.add_feature(feature_id, category + suffix, name + suffix, tags, verts,
+                                 [range(len(verts))], [], materials)
+
+    def flush_geometry(self):
+        for category in sorted(self.simplifications):
+            self.flush_simplifications(category)
+        for key in sorted(self.extrusions):
+            self.flush_extrusions(key)
+        for category in sorted(self.buffers):
+            self.build(self.add_mesh, self.tile, category, self.buffers[category], True)
+        self.buffers = {}
+
+    # Handlers for generate geometry
+    def handler_buildings(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points) - 1
+        # a polygon must have at least 3 vertices
+        if nodes_count < 3:
+            self.stats.skip("polygon with fewer than 3 nodes")
+            return
+        tags = self.curr_way["tags"]
+        # compose object name
+        name = self.curr_way["id"]
+        if "addr:housenumber" in tags and "addr:street" in tags:
+            name = tags["addr:street"] + ", " + tags["addr:housenumber"]
+        elif "name" in tags:
+            name = tags["name"]
+
+        # a value without a number counts as no tag
+        thickness = None
+        if "height" in tags:
+            thickness = parse_length(tags["height"])
+        if thickness is None and "building:levels" in tags:
+            levels = parse_number(tags["building:levels"])
+            if levels is not None:
+                thickness = levels[0] * 3
+        if thickness is None:
+            thickness = 3
+        materials = [
+            ("roof", (1.0, 0.0, 0.0, 1.0), 0, 1),
+            ("building", (1, 0.7, 0.0, 1.0), 1, None),
+        ]
+        points = [self.nodes.xy(way_points[i]) for i in range(nodes_count)]
+        if thickness > 0:
+            self.add_extrusion("buildings", "prisms", points, 0, thickness, name, tags, materials)
+            return
+
+        verts = [(v[0], v[1], 0) for v in points]
+        self.add_geometry("buildings", name, tags, verts, [range(nodes_count)], [], materials)
+
+    def handler_building_parts(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points) - 1
+        # a polygon must have at least 3 vertices
+        if nodes_count < 3:
+            self.stats.skip("polygon with fewer than 3 nodes")
+            return
+        tags = self.curr_way["tags"]
+        # compose object name
+        name = self.curr_way["id"]
+        if "addr:housenumber" in tags and "addr:street" in tags:
+            name = tags["addr:street"] + ", " + tags["addr:housenumber"]
+        elif "name" in tags:
+            name = tags["name"]
+
+        min_height = 0
+        height = 0
+        if "min_height" in tags:
+            min_height = parse_length(tags["min_height"]) or 0
+        if "height" in tags:
+            height = parse_length(tags["height"]) or 0
+        if min_height == 0 and height == 0 and "building:levels" in tags:
+            levels = parse_number(tags["building:levels"])
+            if levels is not None:
+                height = levels[0] * 3
+
+        points = [self.nodes.xy(way_points[i]) for i in range(nodes_count)]
+        if (height - min_height) > 0:
+            self.add_extrusion("building_parts", "prisms", points, min_height, height, name, tags, [])
+            return
+
+        verts = [(v[0], v[1], min_height) for v in points]
+        self.add_geometry("building_parts", name, tags, verts, [range(nodes_count)], [], [])
+
+    def handler_highways(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points)
+        # a way must have at least 2 vertices
+        if nodes_count < 2:
+            self.stats.skip("line with fewer than 2 nodes")
+            return
+        tags = self.curr_way["tags"]
+        name = tags["name"] if "name" in tags else self.curr_way["id"]
+        verts = []
+        for i in range(nodes_count):
+            v = self.nodes.xy(way_points[i])
+            verts.append((v[0], v[1], 0))
+        edges = [(i, i + 1) for i in range(nodes_count - 1)]
+        self.add_geometry("highways", name, tags, verts, [], edges, [])
+
+    def handler_barrier(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points)
+        # a wall must have at least 2 vertices
+        if nodes_count < 2:
+            self.stats.skip("line with fewer than 2 nodes")
+            return
+        tags = self.curr_way["tags"]
+        name = tags["name"] if "name" in tags else self.curr_way["id"]
+
+        height = 0
+        if "height" in tags:
+            height = parse_length(tags["height"]) or 0
+        if height <= 0:
+            height = 0.5
+        points = [self.nodes.xy(way_points[i]) for i in range(nodes_count)]
+        self.add_extrusion("barriers", "walls", points, 0, height, name, tags,
+                           [(tags["barrier"], (0.0, 0.0, 1.0, 1.0), 0, 0)])
+
+    def handler_naturals(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points)
+        if nodes_count == 1:
+            # This is some point "natural".
+            # which we ignore for now (trees, etc.)
+            pass
+        nodes_count = nodes_count - 1
+        # a polygon must have at least 3 vertices
+        if nodes_count < 3:
+            self.stats.skip("polygon with fewer than 3 nodes")
+            return
+        tags = self.curr_way["tags"]
+        name = self.curr_way["id"]
+        if "name" in tags:
+            name = tags["name"]
+        natural_type = tags["natural"]
+        color = (0.5, 0.5, 0.5, 1.0)
+
+        if natural_type == "water":
+            color = (0, 0, 1, 1.0)
+        self.add_area("naturals", name, tags, [(natural_type, color, 0, 1)])
+
+    def handler_landuse(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points)
+        nodes_count = nodes_count - 1
+        # a polygon must have at least 3 vertices
+        if nodes_count < 3:
+            self.stats.skip("polygon with fewer than 3 nodes")
+            return
+        tags = self.curr_way["tags"]
+        name = self.curr_way["id"]
+        if "name" in tags:
+            name = tags["name"]
+        natural_type = tags.get("landuse", None)
+        if not natural_type:
+            natural_type = tags.get("leisure", None)
+        color = (0.5, 0.5, 0.5, 1.0)
+        if natural_type in {"grass", "allotments", "forest", "meadow", "orchard", "plant_nursery",
+                            "recreation_ground", "village_green", "vineyard"}:
+            color = (0, 1, 0, 1.0)
+        self.add_area("landuse", name, tags, [(natural_type, color, 0, 1)])
+
+    def handler_amenity(self):
+        way_points = self.curr_way["points"]
+        nodes_count = len(way_points)
+        nodes_count = nodes_count - 1
+        # a polygon must have at least 3 vertices
+        if nodes_count < 3:
+            self.stats.skip("polygon with fewer than 3 nodes")
+            return
+        tags = self.curr_way["tags"]
+        name = self.curr_way["id"]
+        if "name" in tags:
+            name = tags["name"]
+        verts = []
+        for i in range(nodes_count):
+            v = self.nodes.xy(way_points[i])
+            verts.append((v[0], v[1], 0))
+        self.add_geometry("amenities", name, tags, verts, [range(nodes_count)], [],
+                          [(tags["amenity"], (0, 0, 0, 1), 0, 1)])
+
+    def create_classifier(self):
+        rules = DEFAULT_RULES
+        if self.rulesFile:
+            rules = load_rules(self.abspath(self.rulesFile))
+        handlers = {name[len("handler_"):]: getattr(self, name)
+                    for name in dir(self) if name.startswith("handler_")}
+        return WayClassifier(rules, handlers, lambda option: getattr(self, option))
+
+    def way_handler(self):
+        if not self.curr_way:
+            return
+        stats = self.stats
+        stats.counts["ways"] += 1
+        handlers = self.classifier.classify(self.curr_way["tags"])
+        if self.index is not None:
+            self.index.add_way(int(self.curr_way["id"]), self.curr_way["refs"], self.curr_way["tags"],
+                               bool(handlers))
+        if self.relations is not None:
+            self.relations.add_way(int(self.curr_way["id"]), self.curr_way["refs"])
+        if not handlers:
+            stats.skip("no importer for the tags")
+        for h in handlers:
+            start = time.perf_counter()
+            h()
+            stats.add_handler(h.__name__, time.perf_counter() - start)
+            # debug
+            self.total += 1
+            if self.total % 100 == 0:
+                print(self.total)
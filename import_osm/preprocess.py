@@ -0,0 +1,119 @@
+"""Preprocess an OSM file into an intermediate geometry file, without Blender
+
+    python -m import_osm.preprocess city.osm.pbf city.osmgeom --highways --merge
+
+The import operator loads the .osmgeom with bulk array copies only, so the parsing can run
+on other machines, e.g. one process per window or tile set.
+"""
+import argparse
+import os
+from . import meshfile
+from .pipeline import Pipeline
+from .points import POINT_CLASSES
+from .stats import ImportStats
+
+# import option per --<name> flag
+IMPORT_OPTIONS = (
+    ("buildings", "importBuildings"),
+    ("naturals", "importNaturals"),
+    ("highways", "importHighways"),
+    ("barriers", "importBarriers"),
+    ("landuse", "importLanduse"),
+)
+
+
+class Preprocessor(Pipeline):
+    """Pipeline writing its meshes to a MeshWriter instead of creating objects"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        # the tag ids of the meshes are those of the file
+        self.strings = writer.strings
+
+    def way_strings(self):
+        # the file keeps the tags of every mesh as ids
+        return self.strings
+
+    def open_tile(self, name):
+        self.writer.add_tile(name)
+
+    def add_mesh(self, tile, name, buf, merged):
+        self.writer.add(tile, name, buf, merged)
+        self.stats.counts["objects"] += 1
+
+    def add_point_cloud(self, tile, name, co, point_class):
+        self.writer.add_points(tile, name, co, point_class)
+        self.stats.counts["objects"] += 1
+
+
+def preprocess(filename, output, options):
+    """Write the meshes of filename to output with the options set on the pipeline"""
+    meta = {"source": os.path.abspath(filename), "options": options}
+    writer = meshfile.MeshWriter(output, meta)
+    pipeline = Preprocessor(writer)
+    for name, value in options.items():
+        setattr(pipeline, name, value)
+    pipeline.stats = ImportStats()
+    try:
+        pipeline.parse(filename)
+        writer.meta["origin"] = {"lat": pipeline.lat, "lon": pipeline.lon}
+        writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+    return pipeline.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn an OSM file into a geometry file for the Blender importer")
+    parser.add_argument("filename", help=".osm, .osm.bz2, .osm.gz or .osm.pbf file")
+    parser.add_argument("output", help="geometry file to write (" + meshfile.EXTENSION + ")")
+    for flag, option in IMPORT_OPTIONS:
+        parser.add_argument("--" + flag, dest=option, action="store_true", default=getattr(Pipeline, option))
+        parser.add_argument("--no-" + flag, dest=option, action="store_false")
+    parser.add_argument("--relations", dest="importRelations", action="store_true",
+                        help="import multipolygon relations")
+    parser.add_argument("--points", type=lambda text: text.split(","), default=None,
+                        metavar="CLASS,...", help="point features: " + ",".join(sorted(POINT_CLASSES)))
+    parser.add_argument("--rules", dest="rulesFile", default="", help="JSON rules file")
+    parser.add_argument("--merge", dest="mergeMeshes", action="store_true", help="one mesh per category")
+    parser.add_argument("--simplify", dest="simplifyTolerance", type=float, default=0.0, metavar="METRES",
+                        help="simplify the outlines of naturals and landuse")
+    parser.add_argument("--lod-levels", dest="lodLevels", type=int, default=1,
+                        help="meshes per simplified area, each with 4 times the tolerance of the one before")
+    parser.add_argument("--referenced-nodes-only", dest="referencedNodesOnly", action="store_true")
+    parser.add_argument("--node-storage", dest="nodeStorage", choices=("MEMORY", "SPARSE_FILE", "DENSE_FILE"),
+                        default="MEMORY")
+    parser.add_argument("--node-storage-dir", dest="nodeStorageDir", default="")
+    parser.add_argument("--parser", dest="parserEngine", choices=("EXPAT", "ETREE"), default="EXPAT")
+    parser.add_argument("--workers", dest="parallelWorkers", type=int, default=1)
+    parser.add_argument("--cache", dest="useCache", action="store_true", help="use the parsed data cache")
+    parser.add_argument("--cache-dir", dest="cacheDir", default="")
+    parser.add_argument("--cache-size", dest="cacheSize", type=int, default=4096, help="MB")
+    parser.add_argument("--tile-size", dest="tileSize", type=float, default=None,
+                        help="split into tiles of this many metres (implies --cache)")
+    parser.add_argument("--window", type=float, nargs=4, metavar=("MINLAT", "MAXLAT", "MINLON", "MAXLON"),
+                        default=None)
+    parser.add_argument("--stats", dest="statsFile", default="", help="write the import statistics to this JSON file")
+    args = parser.parse_args()
+
+    options = {name: value for name, value in vars(args).items()
+               if name not in ("filename", "output", "tileSize", "window", "points")}
+    if args.tileSize:
+        options.update(tiledImport=True, tileSize=args.tileSize)
+    if args.points:
+        unknown = set(args.points) - set(POINT_CLASSES)
+        if unknown:
+            parser.error("unknown point classes: " + ", ".join(sorted(unknown)))
+        options.update(importPoints=True, pointClasses=args.points)
+    if args.window:
+        options.update(zip(("minLat", "maxLat", "minLon", "maxLon"), args.window))
+    stats = preprocess(args.filename, args.output, options)
+    stats.print_table()
+    if args.statsFile:
+        stats.write(args.statsFile)
+    print("Wrote %s: %s" % (args.output, stats.summary()))
+
+
+if __name__ == "__main__":
+    main()
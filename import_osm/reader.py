@@ -0,0 +1,67 @@
+import xml.etree.ElementTree as etree
+from xml.parsers import expat
+
+
+class StopReading(Exception):
+    """Raised by an element handler to end reading before the end of the file"""
+
+
+class CountingFile:
+    """File wrapper reporting the position after every read, e.g. for a progress bar"""
+
+    def __init__(self, f, progress, position=0):
+        self.f = f
+        self.progress = progress
+        self.position = position
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.position += len(data)
+        self.progress(self.position)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def read_etree(xml_f, handlers):
+    """Call handlers[tag](attrib) for the start of every element using ElementTree"""
+    root = None
+    try:
+        for event, elem in etree.iterparse(xml_f, events=('start',)):
+            handler = handlers.get(elem.tag)
+            if handler is None:
+                raise Exception("Unknown tag: " + elem.tag)
+            handler(elem.attrib)
+            # cleaning
+            if root is None:
+                root = elem
+            else:
+                elem.clear()
+                root.clear()
+    except StopReading:
+        pass
+
+
+def read_expat(xml_f, handlers):
+    """Same as read_etree, but straight from the expat callbacks without building elements"""
+    parser = expat.ParserCreate()
+
+    def start(tag, attrib):
+        try:
+            handler = handlers[tag]
+        except KeyError:
+            raise Exception("Unknown tag: " + tag)
+        handler(attrib)
+
+    parser.StartElementHandler = start
+    try:
+        parser.ParseFile(xml_f)
+    except StopReading:
+        pass
+
+
+readers = {
+    "ETREE": read_etree,
+    "EXPAT": read_expat,
+}
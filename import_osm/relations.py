@@ -0,0 +1,271 @@
+from array import array
+import numpy as np
+from .nodes import IdSet
+
+# member roles, anything but inner counts as outer
+OUTER = 0
+INNER = 1
+
+
+class Multipolygons:
+    """Multipolygon relations of a file and the node refs of their member ways
+
+    The relations are read before the ways: members go to flat arrays, and a relation
+    is kept once its tags (which follow the members) are accepted. During the way pass
+    only the refs of member ways are stored, looked up by a sorted array of their ids,
+    so memory grows with the members rather than with the file.
+    """
+
+    def __init__(self, accept):
+        # accept: tags -> whether to import the relation
+        self.accept = accept
+        self.count = 0
+        self.ids = array("q")
+        self.tags = []
+        self.member_starts = array("q", [0])
+        self.member_ids = array("q")
+        self.member_roles = array("b")
+        self.curr = None
+        self.curr_tags = None
+        self.members = IdSet()
+        self.way_ids = None
+        self.way_starts = None
+        self.way_counts = None
+        self.refs = array("q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def handlers(self):
+        return {
+            "osm": self.skip,
+            "bounds": self.skip,
+            "node": self.skip,
+            "tag": self.start_tag,
+            "way": self.start_way,
+            "nd": self.skip,
+            "relation": self.start_relation,
+            "member": self.start_member,
+        }
+
+    def skip(self, attrib):
+        pass
+
+    def start_way(self, attrib):
+        self.flush()
+
+    def start_relation(self, attrib):
+        self.flush()
+        self.count += 1
+        self.curr = int(attrib.get("id"))
+        self.curr_tags = {}
+
+    def start_member(self, attrib):
+        if self.curr is not None and attrib.get("type") == "way":
+            self.member_ids.append(int(attrib.get("ref")))
+            self.member_roles.append(INNER if attrib.get("role") == "inner" else OUTER)
+
+    def start_tag(self, attrib):
+        if self.curr is not None:
+            self.curr_tags[attrib.get("k")] = attrib.get("v")
+
+    def flush(self):
+        if self.curr is None:
+            return
+        start = self.member_starts[-1]
+        if len(self.member_ids) > start and self.accept(self.curr_tags):
+            self.ids.append(self.curr)
+            self.tags.append(self.curr_tags)
+            self.member_starts.append(len(self.member_ids))
+        else:
+            del self.member_ids[start:]
+            del self.member_roles[start:]
+        self.curr = None
+        self.curr_tags = None
+
+    def finish(self):
+        """End of the relations, the member ways are known from now on"""
+        self.flush()
+        self.way_ids = np.unique(np.frombuffer(self.member_ids, dtype=np.int64))
+        self.way_starts = np.full(len(self.way_ids), -1, dtype=np.int64)
+        self.way_counts = np.zeros(len(self.way_ids), dtype=np.int64)
+        for way_id in self.way_ids.tolist():
+            self.members.add(way_id)
+
+    def add_way(self, way_id, refs):
+        """Keep the refs of the way if it is a member"""
+        if way_id not in self.members:
+            return
+        slot = int(np.searchsorted(self.way_ids, way_id))
+        self.way_starts[slot] = len(self.refs)
+        self.way_counts[slot] = len(refs)
+        self.refs.extend(refs)
+
+    def way_refs(self, way_id):
+        slot = int(np.searchsorted(self.way_ids, way_id))
+        start = self.way_starts[slot]
+        if start < 0:
+            return None
+        return self.refs[start:start + self.way_counts[slot]].tolist()
+
+    def relations(self):
+        """Yield id, tags, the refs of the outer and of the inner member ways and the missing members"""
+        for n, relation_id in enumerate(self.ids):
+            outer = []
+            inner = []
+            missing = 0
+            for i in range(self.member_starts[n], self.member_starts[n + 1]):
+                refs = self.way_refs(self.member_ids[i])
+                if refs is None:
+                    missing += 1
+                elif self.member_roles[i] == INNER:
+                    inner.append(refs)
+                else:
+                    outer.append(refs)
+            yield relation_id, self.tags[n], outer, inner, missing
+
+
+def join_rings(ways):
+    """Closed rings of node refs from the refs of ways, open ways are joined at shared ends
+
+    Ends are looked up in a dict, so joining is linear in the number of refs.
+    Returns the rings and the number of ways left in rings which do not close.
+    """
+    rings = []
+    ends = {}
+    open_ways = []
+    for n, refs in enumerate(ways):
+        if len(refs) < 2:
+            continue
+        if refs[0] == refs[-1]:
+            rings.append(refs)
+            continue
+        open_ways.append(n)
+        ends.setdefault(refs[0], []).append(n)
+        ends.setdefault(refs[-1], []).append(n)
+    used = set()
+    unclosed = 0
+    for n in open_ways:
+        if n in used:
+            continue
+        used.add(n)
+        ring = list(ways[n])
+        count = 1
+        while ring[0] != ring[-1]:
+            following = None
+            for m in ends.get(ring[-1], ()):
+                if m not in used:
+                    following = m
+                    break
+            if following is None:
+                break
+            used.add(following)
+            count += 1
+            refs = ways[following]
+            ring.extend(refs[1:] if refs[0] == ring[-1] else refs[-2::-1])
+        if ring[0] == ring[-1]:
+            rings.append(ring)
+        else:
+            unclosed += count
+    return rings, unclosed
+
+
+def following(a):
+    # the next item of every item of a ring, np.roll costs more on short rings
+    return np.concatenate((a[1:], a[:1]))
+
+
+def preceding(a):
+    return np.concatenate((a[-1:], a[:-1]))
+
+
+def ring_area(xy):
+    """Signed area of a ring of (n, 2) points without the closing one, positive if counterclockwise"""
+    x = xy[:, 0]
+    y = xy[:, 1]
+    return 0.5 * float(np.dot(x, following(y)) - np.dot(following(x), y))
+
+
+def contains(xy, x, y):
+    """Whether the point is inside the ring, by the even-odd rule"""
+    x0 = xy[:, 0]
+    y0 = xy[:, 1]
+    x1 = following(x0)
+    y1 = following(y0)
+    crossing = (y0 > y) != (y1 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(crossing & (xs > x)) & 1)
+
+
+def bridge_vertex(xy, x, y):
+    """Vertex of a counterclockwise ring a hole point left of it can be joined to, -1 if there is none
+
+    As in earcut: a ray to the left meets the nearest edge, its left end is the candidate
+    unless ring vertices inside the triangle of the point, the hit and that end hide it.
+    Of those the one with the smallest angle to the ray wins, if the bridge leaves it
+    into the ring, which also picks the right copy of a vertex bridged before.
+    """
+    x0 = xy[:, 0]
+    y0 = xy[:, 1]
+    x1 = following(x0)
+    y1 = following(y0)
+    crossing = (np.minimum(y0, y1) <= y) & (np.maximum(y0, y1) >= y) & (y0 != y1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = np.where(crossing, x0 + (y - y0) * (x1 - x0) / (y1 - y0), -np.inf)
+    xs[xs > x] = -np.inf
+    edge = int(np.argmax(xs))
+    if xs[edge] == -np.inf:
+        return -1
+    qx = xs[edge]
+    p = edge if x0[edge] < x1[edge] else (edge + 1) % len(xy)
+    px, py = xy[p]
+    d1 = (qx - x) * (y0 - y)
+    d2 = (px - qx) * (y0 - y) - (py - y) * (x0 - qx)
+    d3 = (x - px) * (y0 - py) - (y - py) * (x0 - px)
+    inside = ((d1 >= 0) & (d2 >= 0) & (d3 >= 0)) | ((d1 <= 0) & (d2 <= 0) & (d3 <= 0))
+    inside &= (x0 < x) & (x0 >= px)
+    # the bridge leaves the vertex between its edges, on the inner side
+    x2 = preceding(x0)
+    y2 = preceding(y0)
+    dx = x - x0
+    dy = y - y0
+    convex = (x0 - x2) * (y1 - y0) - (y0 - y2) * (x1 - x0) > 0
+    into = np.where(convex,
+                    ((x1 - x0) * dy - (y1 - y0) * dx >= 0) & (dx * (y2 - y0) - dy * (x2 - x0) >= 0),
+                    ~(((x2 - x0) * dy - (y2 - y0) * dx > 0) & (dx * (y1 - y0) - dy * (x1 - x0) > 0)))
+    candidates = np.flatnonzero(inside & into)
+    if not len(candidates):
+        return p
+    with np.errstate(divide="ignore"):
+        tan = np.abs(y0[candidates] - y) / (x - x0[candidates])
+    return int(candidates[np.lexsort((-x0[candidates], tan))[0]])
+
+
+def bridge_holes(points, xy, holes):
+    """One ring of an outer ring and its holes, every hole joined to it by a bridge there and back
+
+    points are the positions of an open ring, xy their (n, 2) coordinates, holes a list of
+    (points, xy) of its inner rings. Holes are bridged in the order of their leftmost points,
+    each from that point to a vertex of the ring so far left of it. Returns the positions.
+    """
+    if ring_area(xy) < 0:
+        points = points[::-1]
+        xy = xy[::-1]
+    queue = []
+    for hole_points, hole_xy in holes:
+        if ring_area(hole_xy) > 0:
+            hole_points = hole_points[::-1]
+            hole_xy = hole_xy[::-1]
+        m = int(np.argmin(hole_xy[:, 0]))
+        queue.append((hole_xy[m, 0], m, hole_points, hole_xy))
+    queue.sort(key=lambda hole: hole[0])
+    for x, m, hole_points, hole_xy in queue:
+        p = bridge_vertex(xy, x, hole_xy[m, 1])
+        if p < 0:
+            continue
+        hole_points = hole_points[m:] + hole_points[:m]
+        hole_xy = np.concatenate((hole_xy[m:], hole_xy[:m]))
+        points = points[:p + 1] + hole_points + [hole_points[0], points[p]] + points[p + 1:]
+        xy = np.concatenate((xy[:p + 1], hole_xy, hole_xy[:1], xy[p:]))
+    return points
@@ -0,0 +1,97 @@
+import json
+
+# https://wiki.openstreetmap.org/wiki/Map_Features
+# A rule sends ways having one of its keys (and, if given, one of its values) to a handler
+# when its import option is enabled. Rules are applied in priority order: "unless" skips a rule
+# when one of the named handlers was already chosen, "fallback" when any handler was.
+DEFAULT_RULES = [
+    {"name": "building", "handler": "buildings", "option": "importBuildings", "priority": 10,
+     "keys": ["building"]},
+    {"name": "building_part", "handler": "building_parts", "option": "importBuildings", "priority": 20,
+     "keys": ["building:part"]},
+    {"name": "amenity", "handler": "amenity", "option": "importBuildings", "priority": 30,
+     "keys": ["amenity"], "fallback": True},
+    {"name": "highway", "handler": "highways", "option": "importHighways", "priority": 40,
+     "keys": ["highway", "cycleway", "bicycle", "aerialway", "aeroway", "busway", "railway", "waterway"]},
+    {"name": "barrier", "handler": "barrier", "option": "importBarriers", "priority": 50,
+     "keys": ["barrier"]},
+    {"name": "natural", "handler": "naturals", "option": "importNaturals", "priority": 60,
+     "keys": ["natural"]},
+    {"name": "landuse", "handler": "landuse", "option": "importLanduse", "priority": 70,
+     "keys": ["landuse"]},
+    {"name": "leisure", "handler": "landuse", "option": "importLanduse", "priority": 71,
+     "keys": ["leisure"], "unless": ["buildings", "building_parts"]},
+    {"name": "man_made", "handler": "highways", "option": "importHighways", "priority": 200,
+     "keys": ["man_made"], "fallback": True},
+]
+
+# priority of user rules which do not give one
+DEFAULT_PRIORITY = 100
+
+
+def load_rules(filename, rules=DEFAULT_RULES):
+    """Rules from a JSON list added to the given ones, a rule replaces the one with the same name"""
+    with open(filename, "r", encoding="utf-8") as f:
+        user_rules = json.load(f)
+    if not isinstance(user_rules, list):
+        raise Exception("Rules file must contain a list: " + filename)
+    merged = {rule["name"]: rule for rule in rules}
+    for rule in user_rules:
+        if not isinstance(rule, dict) or "handler" not in rule or not rule.get("keys"):
+            raise Exception("Rule needs a handler and keys: " + json.dumps(rule))
+        merged[rule.get("name", rule["handler"] + ":" + ",".join(rule["keys"]))] = rule
+    return list(merged.values())
+
+
+class WayClassifier:
+    """Table from tag key and value to a bit per rule, the handlers are cached per set of bits"""
+
+    def __init__(self, rules, handlers, enabled):
+        # handlers: name -> callable, enabled: option name -> bool
+        for rule in rules:
+            if rule["handler"] not in handlers:
+                raise Exception("Unknown handler: " + rule["handler"])
+        rules = [rule for rule in rules if "option" not in rule or enabled(rule["option"])]
+        rules.sort(key=lambda rule: rule.get("priority", DEFAULT_PRIORITY))
+        self.rules = [(rule["handler"], handlers[rule["handler"]], frozenset(rule.get("unless", ())),
+                       rule.get("fallback", False)) for rule in rules]
+        # key -> (bits for any value, value -> bits)
+        self.table = {}
+        for i, rule in enumerate(rules):
+            bit = 1 << i
+            for key in rule["keys"]:
+                any_bits, by_value = self.table.get(key, (0, {}))
+                if "values" in rule:
+                    for value in rule["values"]:
+                        by_value[value] = by_value.get(value, any_bits) | bit
+                else:
+                    any_bits |= bit
+                    for value in by_value:
+                        by_value[value] |= bit
+                self.table[key] = (any_bits, by_value)
+        self.cache = {0: ()}
+
+    def resolve(self, bits):
+        chosen = []
+        names = set()
+        for i, (name, handler, unless, fallback) in enumerate(self.rules):
+            if not bits >> i & 1 or name in names:
+                continue
+            if fallback and chosen or unless & names:
+                continue
+            chosen.append(handler)
+            names.add(name)
+        return tuple(chosen)
+
+    def classify(self, tags):
+        """Handlers for a way, in priority order"""
+        table = self.table
+        bits = 0
+        for key, value in tags.items():
+            entry = table.get(key)
+            if entry is not None and value:
+                bits |= entry[1].get(value, entry[0]) if entry[1] else entry[0]
+        handlers = self.cache.get(bits)
+        if handlers is None:
+            handlers = self.cache[bits] = self.resolve(bits)
+        return handlers
@@ -0,0 +1,177 @@
+import numpy as np
+from .geometry import offsets
+
+# tolerance halvings tried on a ring whose simplified outline crosses itself, before it is kept whole
+RETRIES = 4
+# edge pairs tested at once by the crossing check
+PAIR_CHUNK = 1 << 20
+
+
+def ring_of_points(counts):
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def first_maximum(values, groups, starts):
+    """Index of the first largest value in every group of consecutive values, groups not empty"""
+    top = np.maximum.reduceat(values, starts)
+    at = np.flatnonzero(values == top[groups])
+    return at[np.append(True, groups[at[1:]] != groups[at[:-1]])]
+
+
+def repeated(ids, counts):
+    """Mask of the points whose id occurs more than once in their ring"""
+    if not len(ids):
+        return np.zeros(0, dtype=bool)
+    key = ring_of_points(counts) * (int(ids.max()) + 1) + ids
+    unique, inverse, occurrences = np.unique(key, return_inverse=True, return_counts=True)
+    return occurrences[inverse] > 1
+
+
+def douglas_peucker(xy, counts, tolerance, fixed=None):
+    """Points of a batch of closed rings kept by Douglas-Peucker with the tolerance in metres
+
+    xy are the (n, 2) points of all rings one after another without closing points, counts the
+    points per ring (at least 3), fixed a mask of points which must stay. The first point of a ring and the
+    one farthest from it split it into two chains. The recursion runs on all rings at once,
+    every pass splits each segment whose farthest point is beyond the tolerance.
+    Returns the mask of kept points.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = offsets(counts)[:-1]
+    ring = ring_of_points(counts)
+    keep = np.zeros(len(xy), dtype=bool) if fixed is None else fixed.copy()
+    if not len(xy):
+        return keep
+    # single precision relative to the first point of the ring is fine for outlines and is faster
+    x = (xy[:, 0] - np.repeat(xy[starts, 0], counts)).astype(np.float32)
+    y = (xy[:, 1] - np.repeat(xy[starts, 1], counts)).astype(np.float32)
+    # the first point and the one farthest from it
+    keep[starts] = True
+    keep[first_maximum(x * x + y * y, ring, starts)] = True
+
+    # segments between consecutive kept points, as positions in their ring where the count is the first again
+    anchors = np.flatnonzero(keep)
+    seg_ring = ring[anchors]
+    a = anchors - starts[seg_ring]
+    b = np.empty_like(a)
+    b[:-1] = a[1:]
+    last = np.append(seg_ring[1:] != seg_ring[:-1], True)
+    b[last] = counts[seg_ring[last]]
+    tolerance2 = tolerance * tolerance
+    while len(a):
+        lengths = b - a - 1
+        inner = lengths > 0
+        seg_ring, a, b, lengths = seg_ring[inner], a[inner], b[inner], lengths[inner]
+        if not len(a):
+            break
+        seg_starts = offsets(lengths)
+        first = starts[seg_ring] + a
+        p = np.repeat(first + 1 - seg_starts[:-1], lengths) + np.arange(seg_starts[-1])
+        second = starts[seg_ring] + b % counts[seg_ring]
+        ax = x[first]
+        ay = y[first]
+        vx = x[second] - ax
+        vy = y[second] - ay
+        length2 = vx * vx + vy * vy
+        with np.errstate(divide="ignore"):
+            inverse = np.where(length2 > 0, 1 / length2, 0).astype(np.float32)
+        # distance to the segment, not the line, as a chain may end where it started
+        wx = x[p] - np.repeat(ax, lengths)
+        wy = y[p] - np.repeat(ay, lengths)
+        vx = np.repeat(vx, lengths)
+        vy = np.repeat(vy, lengths)
+        t = np.clip((wx * vx + wy * vy) * np.repeat(inverse, lengths), 0, 1)
+        wx -= t * vx
+        wy -= t * vy
+        d = wx * wx + wy * wy
+        farthest = first_maximum(d, np.repeat(np.arange(len(a)), lengths), seg_starts[:-1])
+        split = d[farthest] > tolerance2
+        middle = p[farthest[split]]
+        keep[middle] = True
+        m = middle - starts[seg_ring[split]]
+        seg_ring = np.concatenate((seg_ring[split], seg_ring[split]))
+        a, b = np.concatenate((a[split], m)), np.concatenate((m, b[split]))
+    return keep
+
+
+def crossing(xy, counts, ids):
+    """Which rings have two edges crossing or touching other than at a point of the same id
+
+    A sweep over x for all rings at once: edges sorted by their left end, each tested only
+    against those starting before it ends, the x of each ring shifted past the ones before.
+    Bridges to holes (the same ids there and back) and rings touching themselves at a shared
+    node pass.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    result = np.zeros(len(counts), dtype=bool)
+    if not len(xy):
+        return result
+    ring = ring_of_points(counts)
+    following = np.arange(len(xy)) + 1
+    ends = offsets(counts)[1:] - 1
+    following[ends[counts > 0]] = offsets(counts)[:-1][counts > 0]
+    x0 = np.minimum(xy[:, 0], xy[following, 0])
+    x1 = np.maximum(xy[:, 0], xy[following, 0])
+    shift = ring * (2.0 * (x1.max() - x0.min()) + 1.0)
+    order = np.argsort(x0 + shift, kind="stable")
+    left = (x0 + shift)[order]
+    right = (x1 + shift)[order]
+    last = np.searchsorted(left, right, side="right")
+    candidates = last - np.arange(len(order)) - 1
+    y0 = np.minimum(xy[:, 1], xy[following, 1])
+    y1 = np.maximum(xy[:, 1], xy[following, 1])
+    first = 0
+    while first < len(order):
+        # edges whose candidate pairs fill a chunk
+        stop = int(np.searchsorted(np.cumsum(candidates[first:]), PAIR_CHUNK, side="right")) + first + 1
+        stop = min(stop, len(order))
+        n = candidates[first:stop]
+        pair_starts = offsets(n)
+        k = np.repeat(np.arange(first, stop), n)
+        a = order[k]
+        b = order[k + 1 + np.arange(pair_starts[-1]) - pair_starts[k - first]]
+        first = stop
+        near = (y0[a] <= y1[b]) & (y0[b] <= y1[a])
+        a, b = a[near], b[near]
+        a1, b1 = following[a], following[b]
+        near = ~((ids[a] == ids[b]) | (ids[a] == ids[b1]) | (ids[a1] == ids[b]) | (ids[a1] == ids[b1]))
+        a, b, a1, b1 = a[near], b[near], a1[near], b1[near]
+        p, q, r, t = xy[a], xy[a1], xy[b], xy[b1]
+        # touching counts too, collinear edges are near only where they overlap
+        hit = ((orientation(p, q, r) * orientation(p, q, t) <= 0) &
+               (orientation(r, t, p) * orientation(r, t, q) <= 0))
+        result[ring[a[hit]]] = True
+    return result
+
+
+def orientation(p, q, r):
+    return np.sign((q[:, 0] - p[:, 0]) * (r[:, 1] - p[:, 1]) - (q[:, 1] - p[:, 1]) * (r[:, 0] - p[:, 0]))
+
+
+def simplify_rings(xy, counts, ids, tolerance):
+    """Mask of the points of closed rings kept at the tolerance, the rings staying simple
+
+    ids tell the points of the same node apart, those repeated in a ring (bridges to holes)
+    are kept. A ring whose simplified outline crosses itself or has fewer than 3 points is
+    simplified again at half the tolerance, and kept whole after RETRIES of those.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    ring = ring_of_points(counts)
+    fixed = repeated(ids, counts)
+    keep = douglas_peucker(xy, counts, tolerance, fixed)
+    # rings which lost no point stay as they were
+    todo = np.flatnonzero(np.add.reduceat(keep, offsets(counts)[:-1]) < counts) if len(counts) else np.arange(0)
+    for attempt in range(RETRIES + 1):
+        points = np.isin(ring, todo)
+        sub_keep = keep[points]
+        sub_counts = np.add.reduceat(sub_keep, offsets(counts[todo])[:-1]) if len(todo) else counts[todo]
+        todo = todo[(sub_counts < 3) | crossing(xy[points][sub_keep], sub_counts, ids[points][sub_keep])]
+        if not len(todo):
+            break
+        points = np.isin(ring, todo)
+        if attempt == RETRIES:
+            keep[points] = True
+            break
+        tolerance /= 2
+        keep[points] = douglas_peucker(xy[points], counts[todo], tolerance, fixed[points])
+    return keep
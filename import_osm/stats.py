@@ -0,0 +1,90 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory():
+    """Peak resident memory of the process in bytes or None where unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class ImportStats:
+    """Wall-clock time per stage, calls and time per handler and element counts of one import
+
+    Stages may nest, e.g. the handlers run while reading, so their times overlap.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.handlers = {}
+        self.counts = {"nodes": 0, "ways": 0, "relations": 0, "objects": 0}
+        self.skipped = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_handler(self, name, seconds):
+        calls, total = self.handlers.get(name, (0, 0.0))
+        self.handlers[name] = (calls + 1, total + seconds)
+
+    def skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def report(self):
+        return {
+            "seconds": time.perf_counter() - self.started,
+            "stages": self.stages,
+            "handlers": {name: {"calls": calls, "seconds": seconds}
+                         for name, (calls, seconds) in sorted(self.handlers.items())},
+            "counts": self.counts,
+            "skipped_ways": self.skipped,
+            "peak_memory": peak_memory(),
+        }
+
+    def write(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        """One line for the operator report"""
+        report = self.report()
+        stages = sorted(self.stages.items(), key=lambda item: -item[1])[:3]
+        text = "%d objects from %d ways, %d nodes in %.1f s (%s)" % (
+            self.counts["objects"], self.counts["ways"], self.counts["nodes"], report["seconds"],
+            ", ".join("%s %.1f s" % stage for stage in stages))
+        if sum(self.skipped.values()):
+            text += ", %d ways skipped" % sum(self.skipped.values())
+        if report["peak_memory"]:
+            text += ", peak memory %d MB" % (report["peak_memory"] // (1024 * 1024))
+        return text
+
+    def print_table(self):
+        report = self.report()
+        print("Import took %.2f s" % report["seconds"])
+        for name, seconds in sorted(self.stages.items(), key=lambda item: -item[1]):
+            print("  %-20s %8.2f s" % (name, seconds))
+        for name, info in report["handlers"].items():
+            print("  %-20s %8.2f s %8d calls" % (name, info["seconds"], info["calls"]))
+        for name, count in self.counts.items():
+            print("  %-20s %8d" % (name, count))
+        for reason, count in sorted(self.skipped.items()):
+            print("  skipped: %-30s %8d" % (reason, count))
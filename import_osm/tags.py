@@ -0,0 +1,120 @@
+import re
+from array import array
+from operator import itemgetter
+
+# parsed tag values remembered, the distinct values of height and level tags are few
+PARSED_VALUES = 65536
+# a number and the unit text after it
+NUMBER = re.compile(r"\s*(\d+\.?\d*)\s*(.*?)\s*$")
+# a length: a number with a decimal point or comma and its unit, then the inches of a length in feet
+LENGTH = re.compile(r"\s*(\d+(?:[.,]\d*)?)\s*([^\d\s.,]*)\s*(?:(\d+(?:[.,]\d*)?)\s*([^\d\s.,]*)\s*)?$")
+# metres per unit of a length, no unit is metres
+UNITS = {
+    "": 1.0, "m": 1.0, "metre": 1.0, "metres": 1.0, "meter": 1.0, "meters": 1.0,
+    "ft": 0.3048, "feet": 0.3048, "foot": 0.3048, "'": 0.3048,
+    "in": 0.0254, "inch": 0.0254, "inches": 0.0254, "\"": 0.0254,
+}
+# units of feet followed by inches, 6'6" or 6 ft 6 in, and those of the inches
+FEET = ("ft", "feet", "foot", "'")
+INCHES = ("", "in", "inch", "inches", "\"")
+
+numbers = {}
+lengths = {}
+
+
+def parse_number(value):
+    """The leading number of a tag value and the text after it, like building:levels=3, None without one"""
+    parsed = numbers.get(value)
+    if parsed is None:
+        m = NUMBER.match(value)
+        if not m:
+            return None
+        if len(numbers) >= PARSED_VALUES:
+            numbers.clear()
+        parsed = numbers[value] = (float(m[1]), m[2])
+    return parsed
+
+
+def parse_length(value):
+    """Metres of a length tag like height: a number with no unit or m, ft, in, ' or \", or 6'6\"
+
+    Other values like 12 m;15 m or 20 m approx give their leading number, None without one.
+    """
+    length = lengths.get(value)
+    if length is None:
+        m = LENGTH.match(value)
+        unit = m[2].lower() if m else None
+        if unit in UNITS and not (m[3] and (unit not in FEET or m[4].lower() not in INCHES)):
+            length = float(m[1].replace(",", ".")) * UNITS[unit]
+            if m[3]:
+                length += float(m[3].replace(",", ".")) * UNITS["in"]
+        else:
+            number = parse_number(value)
+            if number is None:
+                return None
+            length = number[0]
+        if len(lengths) >= PARSED_VALUES:
+            lengths.clear()
+        lengths[value] = length
+    return length
+
+
+class StringTable:
+    """Interned strings, each stored once and referred to by its index"""
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.ids = {s: i for i, s in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+def tag_list(strings):
+    """Tags of consecutive features, a TagArrays into strings or without them a list of the dicts"""
+    return [] if strings is None else TagArrays(strings)
+
+
+class TagArrays:
+    """Tags of consecutive features as key and value ids into a StringTable
+
+    ids holds a key id and a value id per tag, starts the first of them of every
+    feature and the end. The tags of a feature cost 8 bytes each instead of a dict.
+    """
+
+    def __init__(self, strings, starts=None, ids=None):
+        self.strings = strings
+        self.starts = array("i", [0]) if starts is None else starts
+        self.ids = array("i") if ids is None else ids
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def append(self, tags):
+        # most keys and values are interned already
+        get = self.strings.ids.get
+        ids = [get(s) for item in tags.items() for s in item]
+        if None in ids:
+            intern = self.strings.intern
+            ids = [intern(s) for item in tags.items() for s in item]
+        self.ids.fromlist(ids)
+        self.starts.append(len(self.ids))
+
+    def extend(self, features):
+        for tags in features:
+            self.append(tags)
+
+    def __getitem__(self, feature):
+        """The tags of a feature as a dict"""
+        ids = self.ids[self.starts[feature]:self.starts[feature + 1]]
+        if not len(ids):
+            return {}
+        strings = iter(itemgetter(*ids)(self.strings.strings))
+        return dict(zip(strings, strings))
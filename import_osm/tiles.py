@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import numpy as np
+
+# metres per degree of latitude
+DEGREE = 2 * math.pi * 6378137 / 360
+# name, dtype of the index arrays
+ARRAYS = (
+    ("ref_index", "q"),
+    ("tile_keys", "q"),
+    ("tile_ways", "q"),
+)
+# ways whose refs are indexed at a time
+INDEX_CHUNK = 65536
+
+
+def index_path(data, tile_size):
+    return os.path.join(data.path, "tiles%g" % tile_size)
+
+
+class TileIndex:
+    """Grid of tiles over the ways of a cache entry
+
+    Every way belongs to the tile of its bounding box center, so a tile holds whole ways even
+    where they cross its edges. tile_keys/tile_ways list the ways sorted by tile, ref_index
+    has the position of every ref in the node arrays, so a window needs only the nodes of its
+    ways and costs time proportional to the window rather than to the file.
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.dlat = meta["dlat"]
+        self.dlon = meta["dlon"]
+        self.columns = meta["columns"]
+        for name, typecode in ARRAYS:
+            count = meta["counts"][name]
+            if count:
+                array = np.memmap(os.path.join(path, name + ".bin"), dtype=np.dtype(typecode), mode="r",
+                                  shape=(count,))
+            else:
+                array = np.empty(0, dtype=np.dtype(typecode))
+            setattr(self, name, array)
+
+    def key(self, row, column):
+        return row * self.columns + column
+
+    def row_column(self, key):
+        return divmod(key, self.columns)
+
+    def bounds(self, key):
+        """min lat, max lat, min lon, max lon of a tile"""
+        row, column = self.row_column(key)
+        return (row * self.dlat - 90.0, (row + 1) * self.dlat - 90.0,
+                column * self.dlon - 180.0, (column + 1) * self.dlon - 180.0)
+
+    def tiles(self, bbox):
+        """Keys of the non-empty tiles touching the window, ascending"""
+        min_lat, max_lat, min_lon, max_lon = bbox
+        rows = range(int((min_lat + 90.0) // self.dlat), int((max_lat + 90.0) // self.dlat) + 1)
+        columns = range(int((min_lon + 180.0) // self.dlon), int((max_lon + 180.0) // self.dlon) + 1)
+        if len(rows) * len(columns) > len(self.tile_keys):
+            # window larger than the data, look at the tiles which have ways instead
+            keys = np.unique(self.tile_keys)
+            rows_of, columns_of = np.divmod(keys, self.columns)
+            inside = ((rows_of >= rows.start) & (rows_of < rows.stop)
+                      & (columns_of >= columns.start) & (columns_of < columns.stop))
+            return keys[inside].tolist()
+        keys = np.array([self.key(row, column) for row in rows for column in columns], dtype=np.int64)
+        found = np.searchsorted(self.tile_keys, keys, side="right") > np.searchsorted(self.tile_keys, keys)
+        return keys[found].tolist()
+
+    def ways(self, key):
+        """Way positions of a tile in file order"""
+        return self.tile_ways[np.searchsorted(self.tile_keys, key):np.searchsorted(self.tile_keys, key, side="right")]
+
+    def nodes(self, data, ways):
+        """Ids, lats and lons of the nodes referenced by the ways"""
+        starts = data.ref_starts[ways]
+        counts = data.ref_starts[ways + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        refs = np.arange(counts.sum(), dtype=np.int64) - np.repeat(offsets - starts, counts)
+        positions = np.unique(self.ref_index[refs])
+        positions = positions[positions >= 0]
+        return data.node_ids[positions], data.node_lats[positions], data.node_lons[positions]
+
+
+def index_refs(sorted_ids, order, refs):
+    """Node positions of the refs, -1 for refs without a node"""
+    ref_index = np.full(len(refs), -1, dtype=np.int64)
+    if len(sorted_ids):
+        found = np.minimum(np.searchsorted(sorted_ids, refs), len(sorted_ids) - 1)
+        hit = sorted_ids[found] == refs
+        ref_index[hit] = order[found[hit]]
+    return ref_index
+
+
+def build_index(data, tile_size):
+    """Index the ways of the cache entry in tiles of tile_size metres and store it in the entry"""
+    ids = np.asarray(data.node_ids)
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    # of duplicated ids the last one wins, like in the node stores
+    last = np.ones(len(sorted_ids), dtype=bool)
+    last[:-1] = sorted_ids[1:] != sorted_ids[:-1]
+    order = order[last]
+    sorted_ids = sorted_ids[last]
+    path = index_path(data, tile_size)
+    tmp_path = path + ".tmp%d" % os.getpid()
+    os.makedirs(tmp_path, exist_ok=True)
+    # ref_index goes to its file a chunk of ways at a time, the refs are not all in memory at once
+    starts = np.asarray(data.ref_starts)
+    center_lat = np.full(len(data.way_ids), np.nan)
+    center_lon = np.full(len(data.way_ids), np.nan)
+    with open(os.path.join(tmp_path, "ref_index.bin"), "wb") as f:
+        for w0 in range(0, len(data.way_ids), INDEX_CHUNK):
+            w1 = min(w0 + INDEX_CHUNK, len(data.way_ids))
+            ref_index = index_refs(sorted_ids, order, data.refs[starts[w0]:starts[w1]])
+            ref_index.tofile(f)
+            # bounding box of every way from the refs which have a node
+            found = ref_index >= 0
+            lats = np.full(len(ref_index), np.nan)
+            lons = np.full(len(ref_index), np.nan)
+            lats[found] = data.node_lats[ref_index[found]]
+            lons[found] = data.node_lons[ref_index[found]]
+            chunk_starts = starts[w0:w1 + 1] - starts[w0]
+            has_refs = chunk_starts[1:] > chunk_starts[:-1]
+            ways = w0 + np.nonzero(has_refs)[0]
+            if len(ways):
+                segments = chunk_starts[:-1][has_refs]
+                center_lat[ways] = (np.fmin.reduceat(lats, segments) + np.fmax.reduceat(lats, segments)) * 0.5
+                center_lon[ways] = (np.fmin.reduceat(lons, segments) + np.fmax.reduceat(lons, segments)) * 0.5
+
+    # the grid is aligned to lat/lon 0 and square in metres at the middle of the data
+    if data.bounds:
+        middle = (float(data.bounds["minlat"]) + float(data.bounds["maxlat"])) * 0.5
+    elif len(ids):
+        middle = float(np.mean(data.node_lats))
+    else:
+        middle = 0.0
+    dlat = tile_size / DEGREE
+    dlon = dlat / max(math.cos(math.radians(middle)), 0.01)
+    columns = int(math.ceil(360.0 / dlon)) + 1
+
+    placed = ~np.isnan(center_lat)
+    way_positions = np.nonzero(placed)[0]
+    rows = np.floor((center_lat[placed] + 90.0) / dlat).astype(np.int64)
+    tile_columns = np.floor((center_lon[placed] + 180.0) / dlon).astype(np.int64)
+    keys = rows * columns + tile_columns
+    order = np.argsort(keys, kind="stable")
+    arrays = {
+        "tile_keys": keys[order],
+        "tile_ways": way_positions[order],
+    }
+    for name, typecode in ARRAYS[1:]:
+        arrays[name].astype(np.dtype(typecode)).tofile(os.path.join(tmp_path, name + ".bin"))
+    meta = {
+        "tile_size": tile_size,
+        "dlat": dlat,
+        "dlon": dlon,
+        "columns": columns,
+        "counts": {"ref_index": len(data.refs), "tile_keys": len(keys), "tile_ways": len(keys)},
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.rename(tmp_path, path)
+    return TileIndex(path, meta)
+
+
+def open_index(data, tile_size):
+    """Tile index of the cache entry or None"""
+    path = index_path(data, tile_size)
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return TileIndex(path, meta)
@@ -0,0 +1,352 @@
+import gzip
+import json
+import os
+from array import array
+import numpy as np
+from . import cache
+from .nodes import first
+from .reader import CountingFile
+
+# bump when the layout of an index changes, the region must be imported again then
+INDEX_VERSION = 1
+CHANGE_EXTENSIONS = (".osc", ".osc.gz")
+DELTA_FILENAME = "delta.json"
+# name, typecode of the lookups of an index, next to the arrays of a cache entry
+LOOKUPS = (
+    ("sorted_way_ids", "q"),
+    ("way_positions", "q"),
+    ("sorted_refs", "q"),
+    ("ref_ways", "q"),
+    ("object_ways", "q"),
+    ("object_names", "S64"),  # Blender names have at most 63 bytes
+    ("object_features", "i"),
+    ("object_starts", "i"),
+    ("object_counts", "i"),
+)
+# the index is rewritten when the delta has more entries than this and than a share of the index
+COMPACT_MIN = 10000
+COMPACT_SHARE = 0.2
+
+
+def is_change_file(filename):
+    return filename.lower().endswith(CHANGE_EXTENSIONS)
+
+
+def open_change_file(filename, progress):
+    f = CountingFile(open(filename, "rb"), progress)
+    if filename.lower().endswith(".gz"):
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    return f
+
+
+class ChangeReader:
+    """Element handlers collecting the last state of the nodes and ways of an osmChange file
+
+    Deleted elements are None, nodes (lat, lon), ways (refs, tags). Relations are only
+    counted, the importer builds nothing from them.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.ways = {}
+        self.relations = 0
+        self.deleting = False
+        self.refs = None
+        self.tags = None
+
+    def handlers(self):
+        return {
+            "osmChange": self.skip,
+            "bounds": self.skip,
+            "create": self.start_change,
+            "modify": self.start_change,
+            "delete": self.start_delete,
+            "node": self.start_node,
+            "way": self.start_way,
+            "tag": self.start_tag,
+            "nd": self.start_nd,
+            "relation": self.start_relation,
+            "member": self.skip,
+        }
+
+    def skip(self, attrib):
+        pass
+
+    def start_change(self, attrib):
+        self.deleting = False
+
+    def start_delete(self, attrib):
+        self.deleting = True
+
+    def start_node(self, attrib):
+        self.refs = self.tags = None
+        node_id = int(attrib.get("id"))
+        self.nodes[node_id] = None if self.deleting else (float(attrib.get("lat")), float(attrib.get("lon")))
+
+    def start_way(self, attrib):
+        # the refs and tags which follow go straight into the entry
+        self.refs = []
+        self.tags = {}
+        self.ways[int(attrib.get("id"))] = None if self.deleting else (self.refs, self.tags)
+
+    def start_tag(self, attrib):
+        if self.tags is not None:
+            self.tags[attrib.get("k")] = attrib.get("v")
+
+    def start_nd(self, attrib):
+        self.refs.append(int(attrib.get("ref")))
+
+    def start_relation(self, attrib):
+        self.refs = self.tags = None
+        self.relations += 1
+
+
+class IndexWriter(cache.CacheWriter):
+    """Update index of an import, to apply change files to its objects later
+
+    A cache entry of the imported ways with the nodes of all ways read, plus the objects
+    made from every way and sorted lookups of ways by id, ways by node and objects by way.
+    """
+
+    def __init__(self, path, filename, options):
+        path = os.path.abspath(path)
+        if os.path.exists(path) and "index_version" not in (cache.read_meta(path) or {}):
+            # finishing replaces the directory
+            raise Exception("Not an update index: " + path)
+        super().__init__(os.path.dirname(path), os.path.basename(path), filename, options)
+        self.meta["index_version"] = INDEX_VERSION
+        self.node_refs = array("q")
+        self.objects = []
+
+    def add_way(self, way_id, refs, tags, imported):
+        # the nodes of the other ways are kept too, a change may give them to an imported way
+        self.node_refs.extend(refs)
+        if not imported:
+            return
+        self.append("way_ids", way_id)
+        self.append("ref_starts", self.counts["refs"] + len(self.buffers["refs"]))
+        self.append("tag_starts", self.counts["tag_keys"] + len(self.buffers["tag_keys"]))
+        for ref in refs:
+            self.append("refs", ref)
+        for k, v in tags.items():
+            self.append("tag_keys", self.intern(k))
+            self.append("tag_values", self.intern(v))
+
+    def add_nodes_from(self, nodes):
+        """Store the locations of the nodes of the added ways, nodes is the node store of the import"""
+        ids = np.unique(np.frombuffer(self.node_refs, dtype=np.int64))
+        lats, lons = nodes.lookup(ids)
+        # refs out of the window have no node
+        found = ~np.isnan(lats)
+        self.add_nodes(ids[found].tobytes(), lats[found].tobytes(), lons[found].tobytes(), {})
+        self.node_refs = array("q")
+
+    def add_object(self, way_id, name, feature, start, count):
+        """Object made from the way, for a merged mesh the feature and its vertex range"""
+        self.objects.append((way_id, name, feature, start, count))
+
+    def read_array(self, name, typecode):
+        self.flush(name)
+        self.files[name].flush()
+        return np.fromfile(os.path.join(self.tmp_path, name + ".bin"), dtype=np.dtype(typecode))
+
+    def finish(self, origin):
+        self.meta["origin"] = origin
+        way_ids = self.read_array("way_ids", "q")
+        refs = self.read_array("refs", "q")
+        ref_starts = np.append(self.read_array("ref_starts", "q"), len(refs))
+        way_order = np.argsort(way_ids, kind="stable")
+        ref_ways = np.repeat(np.arange(len(way_ids), dtype=np.int64), np.diff(ref_starts))
+        ref_order = np.argsort(refs, kind="stable")
+        objects = sorted(self.objects, key=first)
+        lookups = {
+            "sorted_way_ids": way_ids[way_order],
+            "way_positions": way_order,
+            "sorted_refs": refs[ref_order],
+            "ref_ways": ref_ways[ref_order],
+            "object_ways": [o[0] for o in objects],
+            "object_names": [o[1].encode("utf-8") for o in objects],
+            "object_features": [o[2] for o in objects],
+            "object_starts": [o[3] for o in objects],
+            "object_counts": [o[4] for o in objects],
+        }
+        self.meta["lookups"] = {}
+        for name, typecode in LOOKUPS:
+            data = np.asarray(lookups[name], dtype=np.dtype(typecode))
+            data.tofile(os.path.join(self.tmp_path, name + ".bin"))
+            self.meta["lookups"][name] = len(data)
+        super().finish()
+
+
+class UpdateIndex:
+    """Update index with the changes applied since it was written
+
+    The arrays of the index are memory-mapped and the later states of nodes, ways and objects
+    kept in a delta file overriding them, so an update costs about as much as its change file.
+    Once the delta outgrows a share of the index, the index is written again with it.
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.options = meta["options"]
+        self.data = cache.CachedData(path, meta)
+        for name, typecode in LOOKUPS:
+            count = meta["lookups"][name]
+            if count:
+                data = np.memmap(os.path.join(path, name + ".bin"), dtype=np.dtype(typecode), mode="r",
+                                 shape=(count,))
+            else:
+                data = np.empty(0, dtype=np.dtype(typecode))
+            setattr(self, name, data)
+        delta = {"nodes": [], "ways": [], "objects": []}
+        if os.path.exists(os.path.join(path, DELTA_FILENAME)):
+            with open(os.path.join(path, DELTA_FILENAME), "r", encoding="utf-8") as f:
+                delta = json.load(f)
+        self.nodes = {node_id: node for node_id, node in delta["nodes"]}
+        self.ways = {}
+        self.delta_refs = {}
+        for way_id, way in delta["ways"]:
+            self.set_way(way_id, way)
+        self.objects = {way_id: objects for way_id, objects in delta["objects"]}
+        self.changed_nodes = {}
+
+    def set_way(self, way_id, way):
+        self.ways[way_id] = way
+        if way is not None:
+            for ref in way[0]:
+                self.delta_refs.setdefault(ref, set()).add(way_id)
+
+    def node(self, node_id):
+        """lat, lon of the node or None"""
+        if node_id in self.nodes:
+            return self.nodes[node_id]
+        ids = self.data.node_ids
+        i = np.searchsorted(ids, node_id)
+        if i < len(ids) and ids[i] == node_id:
+            return float(self.data.node_lats[i]), float(self.data.node_lons[i])
+        return None
+
+    def way(self, way_id):
+        """refs, tags of an imported way or None"""
+        if way_id in self.ways:
+            return self.ways[way_id]
+        i = np.searchsorted(self.sorted_way_ids, way_id)
+        if i < len(self.sorted_way_ids) and self.sorted_way_ids[i] == way_id:
+            for found_id, refs, tags in self.data.select(self.way_positions[i:i + 1]):
+                return refs, tags
+        return None
+
+    def ways_of_node(self, node_id):
+        """Ids of the imported ways using the node"""
+        lo, hi = np.searchsorted(self.sorted_refs, [node_id, node_id + 1])
+        found = {way_id for way_id in self.data.way_ids[self.ref_ways[lo:hi]].tolist() if way_id not in self.ways}
+        for way_id in self.delta_refs.get(node_id, ()):
+            way = self.ways[way_id]
+            if way is not None and node_id in way[0]:
+                found.add(way_id)
+        return found
+
+    def objects_of(self, way_id):
+        """name, feature, first vertex, vertex count of the objects made from the way"""
+        if way_id in self.objects:
+            return self.objects[way_id]
+        lo, hi = np.searchsorted(self.object_ways, [way_id, way_id + 1])
+        return [[name.decode("utf-8"), feature, start, count] for name, feature, start, count in zip(
+            self.object_names[lo:hi].tolist(), self.object_features[lo:hi].tolist(),
+            self.object_starts[lo:hi].tolist(), self.object_counts[lo:hi].tolist())]
+
+    def affected_ways(self, changes):
+        """New state of every way to build again for a ChangeReader: the changed ways and those using changed nodes"""
+        self.changed_nodes = changes.nodes
+        ways = dict(changes.ways)
+        for node_id in changes.nodes:
+            for way_id in self.ways_of_node(node_id):
+                if way_id not in ways:
+                    ways[way_id] = self.way(way_id)
+        return ways
+
+    def forget_objects(self, way_id):
+        self.objects[way_id] = []
+
+    def add_way(self, way_id, refs, tags, imported):
+        self.set_way(way_id, [list(refs), tags] if imported else None)
+
+    def add_nodes_from(self, nodes):
+        """Store the changed nodes, those not in the node store of the update are gone or out of the window"""
+        ids = np.fromiter(self.changed_nodes, dtype=np.int64, count=len(self.changed_nodes))
+        lats, lons = nodes.lookup(ids)
+        found = ~np.isnan(lats)
+        for node_id, lat, lon, node_found in zip(ids.tolist(), lats.tolist(), lons.tolist(), found.tolist()):
+            self.nodes[node_id] = (lat, lon) if node_found else None
+
+    def add_object(self, way_id, name, feature, start, count):
+        self.objects.setdefault(way_id, []).append([name, feature, start, count])
+
+    def close(self):
+        self.data = None
+        for name, typecode in LOOKUPS:
+            setattr(self, name, None)
+
+    def delta_size(self):
+        return len(self.nodes) + len(self.ways) + len(self.objects)
+
+    def finish(self, origin):
+        size = len(self.data.node_ids) + len(self.data.way_ids) + len(self.object_ways)
+        if self.delta_size() > max(COMPACT_MIN, COMPACT_SHARE * size):
+            self.compact(origin)
+            return
+        delta = {
+            "nodes": [[node_id, node] for node_id, node in self.nodes.items()],
+            "ways": [[way_id, way] for way_id, way in self.ways.items()],
+            "objects": [[way_id, objects] for way_id, objects in self.objects.items()],
+        }
+        filename = os.path.join(self.path, DELTA_FILENAME)
+        with open(filename + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(delta, f)
+        os.replace(filename + ".tmp", filename)
+
+    def abort(self):
+        print("Update index not written, the scene may no longer match it:", self.path)
+
+    def compact(self, origin):
+        # the index written again with the delta applied
+        writer = IndexWriter(self.path, self.meta["source"], self.options)
+        try:
+            for way_id, refs, tags in self.data.ways():
+                if way_id not in self.ways:
+                    writer.add_way(way_id, refs, tags, True)
+            for way_id, way in sorted(self.ways.items()):
+                if way is not None:
+                    writer.add_way(way_id, way[0], way[1], True)
+            ids = self.data.node_ids
+            keep = ~np.isin(ids, np.fromiter(self.nodes, dtype=np.int64, count=len(self.nodes)))
+            nodes = sorted((node_id, node) for node_id, node in self.nodes.items() if node is not None)
+            new_ids = np.array([node_id for node_id, node in nodes], dtype=np.int64)
+            new_coords = np.array([node for node_id, node in nodes], dtype=np.float64).reshape(-1, 2)
+            ids = np.concatenate([ids[keep], new_ids])
+            order = np.argsort(ids, kind="stable")
+            lats = np.concatenate([self.data.node_lats[keep], new_coords[:, 0]])[order]
+            lons = np.concatenate([self.data.node_lons[keep], new_coords[:, 1]])[order]
+            writer.add_nodes(ids[order].tobytes(), lats.tobytes(), lons.tobytes(), {})
+            for i, way_id in enumerate(self.object_ways.tolist()):
+                if way_id not in self.objects:
+                    writer.add_object(way_id, self.object_names[i].decode("utf-8"), int(self.object_features[i]),
+                                      int(self.object_starts[i]), int(self.object_counts[i]))
+            for way_id, objects in self.objects.items():
+                for name, feature, start, count in objects:
+                    writer.add_object(way_id, name, feature, start, count)
+            # nothing may map the old files while they are replaced
+            self.close()
+            writer.finish(origin)
+        except BaseException:
+            writer.abort()
+            raise
+
+
+def open_index(path):
+    """UpdateIndex of the directory or None"""
+    meta = cache.read_meta(path)
+    if meta is None or meta.get("index_version") != INDEX_VERSION or "lookups" not in meta:
+        return None
+    return UpdateIndex(path, meta)
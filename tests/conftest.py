@@ -0,0 +1,45 @@
+import os
+import sys
+import pytest
+
+# the tests import the addon package from the checkout, no installation needed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from import_osm.pipeline import Pipeline  # noqa: E402
+
+
+class MeshRecorder(Pipeline):
+    """Pipeline keeping the meshes and point clouds it outputs instead of making objects"""
+
+    def __init__(self, **options):
+        for name, value in options.items():
+            setattr(self, name, value)
+        self.meshes = []
+        self.clouds = []
+        self.removed = []
+
+    def open_tile(self, name):
+        pass
+
+    def add_mesh(self, tile, name, buf, merged):
+        self.meshes.append((tile, name, buf, merged))
+        self.index_objects(name, buf, merged)
+        self.stats.counts["objects"] += 1
+
+    def add_point_cloud(self, tile, name, co, point_class):
+        self.clouds.append((tile, name, co, point_class))
+        self.stats.counts["objects"] += 1
+
+    def remove_features(self, name, features):
+        self.removed.append((name, features))
+
+
+@pytest.fixture
+def run_import():
+    """Import a file with the options given, the pipeline with the recorded meshes"""
+    def run(filename, **options):
+        pipeline = MeshRecorder(**options)
+        pipeline.parse(filename)
+        pipeline.finish_index()
+        return pipeline
+    return run
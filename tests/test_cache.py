@@ -0,0 +1,101 @@
+import os
+import time
+import numpy as np
+import pytest
+from import_osm import cache
+from import_osm.stats import ImportStats
+from conftest import MeshRecorder
+
+
+def write_ways(path, count=300, seed=5):
+    # small squares scattered over about 5 x 5 km, the nodes shared by no two ways
+    rng = np.random.RandomState(seed)
+    corners = rng.uniform(0, 0.045, (count, 2))
+    lines = ['<osm version="0.6">', '<bounds minlat="0" minlon="0" maxlat="0.05" maxlon="0.05"/>']
+    for n, (lat, lon) in enumerate(corners):
+        for k, (dlat, dlon) in enumerate([(0, 0), (0, 0.0002), (0.0002, 0.0002), (0.0002, 0)]):
+            lines.append('<node id="%d" lat="%.7f" lon="%.7f"/>' % (n * 4 + k + 1, lat + dlat, lon + dlon))
+    for n in range(count):
+        lines.append('<way id="%d">' % (n + 1))
+        lines.extend('<nd ref="%d"/>' % (n * 4 + k + 1) for k in (0, 1, 2, 3, 0))
+        lines.extend(['<tag k="building" v="yes"/>', "</way>"])
+    lines.append("</osm>")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def open_cache(filename, directory, node_tags=()):
+    pipeline = MeshRecorder(cacheDir=str(directory))
+    pipeline.stats = ImportStats()
+    pipeline.node_tags = set(node_tags)
+    return pipeline.open_cache(str(filename))
+
+
+def test_cache_key(tmp_path):
+    filename = tmp_path / "ways.osm"
+    write_ways(filename, 10)
+    key = cache.cache_key(str(filename), {"node_tags": []})
+    assert cache.cache_key(str(filename), {"node_tags": []}) == key
+    assert cache.cache_key(str(filename), {"node_tags": ["natural"]}) != key
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    touched = cache.cache_key(str(filename), {"node_tags": []})
+    assert touched != key
+    with open(filename, "a", encoding="utf-8") as f:
+        f.write("\n")
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert cache.cache_key(str(filename), {"node_tags": []}) not in (key, touched)
+
+
+def test_cache_hit_and_miss(tmp_path):
+    filename = tmp_path / "ways.osm"
+    write_ways(filename, 10)
+    data = open_cache(filename, tmp_path / "cache")
+    assert len(data) == 10 and len(data.node_ids) == 40
+    assert os.listdir(tmp_path / "cache") == [os.path.basename(data.path)]
+    assert open_cache(filename, tmp_path / "cache").path == data.path
+    # other node tags make a new entry, the old one of the same file stays
+    other = open_cache(filename, tmp_path / "cache", {"natural"})
+    assert other.path != data.path
+    assert sorted(os.listdir(tmp_path / "cache")) == sorted(os.path.basename(d.path) for d in (data, other))
+    # a changed file replaces its entry of the same options
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    changed = open_cache(filename, tmp_path / "cache")
+    assert sorted(os.listdir(tmp_path / "cache")) == sorted(os.path.basename(d.path) for d in (changed, other))
+
+
+def make_entry(directory, name, size, used, source=None):
+    path = directory / name
+    path.mkdir(parents=True)
+    (path / "data.bin").write_bytes(b"\0" * size)
+    meta = path / "meta.json"
+    meta.write_text('{"version": %d, "source": "%s", "options": {}}' % (cache.CACHE_VERSION, source or name))
+    os.utime(meta, (used, used))
+    return path
+
+
+def test_evict_least_recently_used(tmp_path):
+    now = time.time()
+    for n, name in enumerate("abcde"):
+        make_entry(tmp_path, name, 1000, now - 100 * (5 - n))
+    cache.evict(str(tmp_path), 3500, keep="a")
+    # the oldest go until the rest fits, the entry in use stays however old
+    assert sorted(os.listdir(tmp_path)) == ["a", "d", "e"]
+    cache.evict(str(tmp_path), 100000)
+    assert sorted(os.listdir(tmp_path)) == ["a", "d", "e"]
+
+
+def test_evict_unfinished_and_stale(tmp_path):
+    now = time.time()
+    make_entry(tmp_path, "current", 10, now)
+    make_entry(tmp_path, "older", 10, now - 10, source="current")
+    unfinished = tmp_path / "unfinished.tmp1"
+    unfinished.mkdir()
+    (unfinished / "refs.bin").write_bytes(b"\0" * 10)
+    os.utime(unfinished, (now - 2 * 24 * 3600,) * 2)
+    # written by an import running right now
+    (tmp_path / "running.tmp2").mkdir()
+    old_version = make_entry(tmp_path, "old_version", 10, now)
+    (old_version / "meta.json").write_text('{"version": 0}')
+    cache.evict(str(tmp_path), 100000, keep="current")
+    assert sorted(os.listdir(tmp_path)) == ["current", "running.tmp2"]
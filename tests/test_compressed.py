@@ -0,0 +1,115 @@
+import bz2
+import gzip
+import random
+import pytest
+from import_osm import compressed
+
+
+def osm_text(ways, seed=1):
+    # XML-like text that compresses about as well as an OSM file
+    rng = random.Random(seed)
+    lines = ['<way id="%d"><nd ref="%d"/><tag k="height" v="%d"/></way>' % (n, rng.randrange(10 ** 9), rng.randrange(100))
+             for n in range(ways)]
+    return "\n".join(lines).encode()
+
+
+def read_all(f, size=65536):
+    pieces = []
+    try:
+        piece = f.read(size)
+        while piece:
+            pieces.append(piece)
+            piece = f.read(size)
+    finally:
+        f.close()
+    return b"".join(pieces)
+
+
+@pytest.fixture
+def small_tasks(monkeypatch):
+    # tasks of two blocks of about 12 kB compressed, so that small files give several of them
+    monkeypatch.setattr(compressed, "TASK_SIZE", 16 * 1024)
+
+
+@pytest.mark.parametrize("shift", range(8))
+def test_find_magics_at_any_bit_offset(shift):
+    rng = random.Random(shift)
+    bits = (rng.getrandbits(40) << (48 + 37 + shift)) | (compressed.BLOCK_MAGIC << (37 + shift)) | rng.getrandbits(37 + shift)
+    data = bits.to_bytes((40 + 48 + 37 + shift + 7) // 8, "big")
+    offset = len(data) * 8 - (40 + 48 + 37 + shift) + 40
+    assert (offset, compressed.BLOCK_MAGIC) in compressed.find_magics(data)
+
+
+@pytest.mark.parametrize("streams", [1, 3])
+def test_parallel_bz2_round_trip(tmp_path, small_tasks, streams):
+    parts = [osm_text(8000, seed) for seed in range(streams)]
+    filename = str(tmp_path / "test.osm.bz2")
+    with open(filename, "wb") as f:
+        for part in parts:
+            f.write(bz2.compress(part, 1))
+    tasks = list(compressed.bz2_tasks(filename))
+    assert len(tasks) > streams
+    assert len({task[1] for task in tasks}) == streams
+    positions = []
+    f = compressed.open_file(filename, 2, progress=positions.append)
+    assert isinstance(f, compressed.ParallelBz2File)
+    assert read_all(f) == b"".join(parts)
+    assert positions == sorted(positions)
+
+
+def test_false_magic_falls_back_to_the_whole_stream(tmp_path, small_tasks, monkeypatch):
+    data = osm_text(8000)
+    filename = str(tmp_path / "test.osm.bz2")
+    with open(filename, "wb") as f:
+        f.write(bz2.compress(data, 1))
+    tasks = list(compressed.bz2_tasks(filename))
+    assert len(tasks) > 2
+
+    def cut_tasks(filename):
+        # the second task cut in two in the middle of a block, like at a false magic number
+        for n, (name, stream, level, start, end, blocks) in enumerate(tasks):
+            if n != 1:
+                yield name, stream, level, start, end, blocks
+                continue
+            cut = start + (end - start) // 3 + 5
+            yield name, stream, level, start, cut, [bit for bit in blocks if bit < cut]
+            yield name, stream, level, cut, end, [cut] + [bit for bit in blocks if bit > cut]
+
+    streams = []
+
+    def decompress_stream(filename, stream, skip=0):
+        streams.append((stream, skip))
+        return decompress_whole(filename, stream, skip)
+
+    decompress_whole = compressed.decompress_stream
+    monkeypatch.setattr(compressed, "bz2_tasks", cut_tasks)
+    monkeypatch.setattr(compressed, "decompress_stream", decompress_stream)
+    with pytest.raises((OSError, ValueError, EOFError)):
+        compressed.decompress_blocks(next(t for n, t in enumerate(cut_tasks(filename)) if n == 1))
+    assert read_all(compressed.open_file(filename, 2)) == data
+    # the first task was passed on, the rest of the stream after it came from the fallback
+    assert streams == [(0, len(compressed.decompress_blocks(tasks[0])))]
+
+
+def test_decompress_stream_skips(tmp_path):
+    data = osm_text(3000)
+    filename = str(tmp_path / "test.osm.bz2")
+    with open(filename, "wb") as f:
+        f.write(b"junk" + bz2.compress(data, 1))
+    pieces = list(compressed.decompress_stream(filename, 4, 1000))
+    assert b"".join(pieces) == data[1000:]
+    assert max(len(piece) for piece in pieces) <= compressed.READ_BLOCK
+
+
+@pytest.mark.parametrize("suffix, workers", [(".osm.bz2", 1), (".osm.gz", 1), (".osm.gz", 2)])
+def test_threaded_read(tmp_path, suffix, workers):
+    data = osm_text(5000)
+    filename = str(tmp_path / ("test" + suffix))
+    with open(filename, "wb") as f:
+        f.write(bz2.compress(data) if suffix.endswith("bz2") else gzip.compress(data))
+    assert compressed.is_compressed(filename)
+    f = compressed.open_file(filename, workers)
+    assert isinstance(f, compressed.ThreadedFile)
+    # reads of any size, the rest at once at the end
+    assert f.read(10) + f.read(100000) + f.read() == data
+    f.close()
@@ -0,0 +1,31 @@
+import math
+import numpy as np
+from import_osm import geo
+
+RADIUS = 6378137
+# lat, lon, origin lat, origin lon and the x, y of the scalar projection the importer used before numpy
+REFERENCE = [
+    (55.0, 37.0, 55.0, 37.0, 0.0, 0.0),
+    (55.05, 37.05, 55.0, 37.0, 3188.5316779496848, 5567.114888713723),
+    (54.9, 36.8, 55.0, 37.0, -12801.849565697275, -11113.668767302117),
+    (-33.9, 151.2, -33.85, 151.25, -4619.827468002916, -5567.098831271687),
+]
+
+
+def test_project_reference_values():
+    for lat, lon, origin_lat, origin_lon, x, y in REFERENCE:
+        xs, ys = geo.project(np.array([lat]), np.array([lon]), origin_lon, math.radians(origin_lat), RADIUS)
+        np.testing.assert_allclose([xs[0], ys[0]], [x, y], rtol=1e-9, atol=1e-6)
+
+
+def test_project_arrays_match_single_points():
+    rng = np.random.RandomState(1)
+    lats = 55.0 + rng.uniform(-0.5, 0.5, 1000)
+    lons = 37.0 + rng.uniform(-0.5, 0.5, 1000)
+    xs, ys = geo.project(lats, lons, 37.0, math.radians(55.0), RADIUS)
+    for i in range(0, 1000, 97):
+        x, y = geo.project(lats[i:i + 1], lons[i:i + 1], 37.0, math.radians(55.0), RADIUS)
+        np.testing.assert_allclose([xs[i], ys[i]], [x[0], y[0]])
+    # about 111 km per degree of latitude, 64 km per degree of longitude at 55 degrees
+    np.testing.assert_allclose(ys.max() - ys.min(), 111000, rtol=0.02)
+    np.testing.assert_allclose(xs.max() - xs.min(), 64000, rtol=0.03)
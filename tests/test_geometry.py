@@ -0,0 +1,105 @@
+import numpy as np
+from import_osm import geometry
+
+# closed ways as the handlers get them, the last point repeats the first
+SQUARE = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)]
+# concave L shape, counterclockwise
+L_SHAPE = [(0.0, 0.0), (6.0, 0.0), (6.0, 2.0), (2.0, 2.0), (2.0, 5.0), (0.0, 5.0), (0.0, 0.0)]
+# the same footprint clockwise
+L_SHAPE_CW = L_SHAPE[::-1]
+FENCE = [(0.0, 0.0), (3.0, 1.0), (5.0, 0.0), (7.0, 4.0)]
+
+
+def extrude_face(points, bottom, top):
+    """The mesh of the per-way bmesh path: a face over all points but the closing one,
+    extrude_face_region, the extruded vertices moved up by the height"""
+    ring = points[:-1]
+    n = len(ring)
+    co = [(x, y, bottom) for x, y in ring] + [(x, y, top) for x, y in ring]
+    faces = [list(range(n, 2 * n))]
+    faces += [[j, (j + 1) % n, (j + 1) % n + n, j + n] for j in range(n)]
+    return co, faces
+
+
+def extrude_chain(points, bottom, top):
+    """The mesh of the per-way bmesh path for barriers: an edge between every two points,
+    extrude_face_region on the edges"""
+    n = len(points)
+    co = [(x, y, bottom) for x, y in points] + [(x, y, top) for x, y in points]
+    faces = [[j, j + 1, j + 1 + n, j + n] for j in range(n - 1)]
+    return co, faces
+
+
+def part_faces(geom, k):
+    co, loops, loop_starts, loop_totals = geom.part(k)
+    return co, [loops[s:s + t].tolist() for s, t in zip(loop_starts, loop_totals)]
+
+
+def normal(co, face):
+    # Newell's method, the direction follows the winding of the face
+    p = co[face]
+    q = np.roll(p, -1, axis=0)
+    n = np.array([
+        np.sum((p[:, 1] - q[:, 1]) * (p[:, 2] + q[:, 2])),
+        np.sum((p[:, 2] - q[:, 2]) * (p[:, 0] + q[:, 0])),
+        np.sum((p[:, 0] - q[:, 0]) * (p[:, 1] + q[:, 1])),
+    ])
+    return n / np.linalg.norm(n)
+
+
+def test_prisms_match_per_way_extrusion():
+    ways = [SQUARE, L_SHAPE, L_SHAPE_CW]
+    bottoms, tops = [0.0, 2.0, 0.0], [3.0, 12.5, 6.0]
+    # the handlers leave out the closing point
+    geom = geometry.prisms([w[:-1] for w in ways], bottoms, tops)
+    assert len(geom) == 3
+    for k, way in enumerate(ways):
+        co, faces = part_faces(geom, k)
+        expected_co, expected_faces = extrude_face(way, bottoms[k], tops[k])
+        n = len(way) - 1
+        assert len(co) == 2 * n
+        assert len(faces) == n + 1
+        np.testing.assert_array_equal(co, expected_co)
+        assert faces == expected_faces
+
+
+def test_prism_winding():
+    geom = geometry.prisms([SQUARE[:-1], L_SHAPE[:-1], L_SHAPE_CW[:-1]], [0, 0, 0], [3, 3, 3])
+    for k, (way, up) in enumerate([(SQUARE, 1), (L_SHAPE, 1), (L_SHAPE_CW, -1)]):
+        co, faces = part_faces(geom, k)
+        # the roof keeps the winding of the footprint
+        np.testing.assert_allclose(normal(co, faces[0]), [0, 0, up], atol=1e-12)
+        # the walls face right of the footprint edges, out of a counterclockwise one also at the
+        # concave corner, into a clockwise one like its roof faces down
+        for (x0, y0), (x1, y1), face in zip(way, way[1:], faces[1:]):
+            right = np.array([y1 - y0, x0 - x1, 0]) / np.hypot(x1 - x0, y1 - y0)
+            np.testing.assert_allclose(normal(co, face), right, atol=1e-12)
+
+
+def test_walls_match_per_way_extrusion():
+    # a barrier keeps the closing point, the last wall ends on a vertex of its own
+    lines = [FENCE, SQUARE, L_SHAPE]
+    bottoms, tops = [0.0, 0.0, 1.0], [0.5, 2.0, 1.5]
+    geom = geometry.walls(lines, bottoms, tops)
+    assert len(geom) == 3
+    for k, line in enumerate(lines):
+        co, faces = part_faces(geom, k)
+        expected_co, expected_faces = extrude_chain(line, bottoms[k], tops[k])
+        assert len(co) == 2 * len(line)
+        assert len(faces) == len(line) - 1
+        np.testing.assert_array_equal(co, expected_co)
+        assert faces == expected_faces
+        for (x0, y0), (x1, y1), face in zip(line, line[1:], faces):
+            right = np.array([y1 - y0, x0 - x1, 0]) / np.hypot(x1 - x0, y1 - y0)
+            np.testing.assert_allclose(normal(co, face), right, atol=1e-12)
+
+
+def test_batch_offsets():
+    geom = geometry.prisms([SQUARE[:-1], L_SHAPE[:-1]], [0, 0], [1, 1])
+    assert geom.vertex_offsets.tolist() == [0, 8, 20]
+    assert geom.face_offsets.tolist() == [0, 5, 12]
+    assert geom.loop_offsets.tolist() == [0, 20, 50]
+    geom = geometry.walls([FENCE, SQUARE], [0, 0], [1, 1])
+    assert geom.vertex_offsets.tolist() == [0, 8, 18]
+    assert geom.face_offsets.tolist() == [0, 3, 7]
+    assert geom.loop_offsets.tolist() == [0, 12, 28]
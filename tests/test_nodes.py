@@ -0,0 +1,125 @@
+import re
+import numpy as np
+import pytest
+from import_osm.nodes import DenseFileNodeStore, IdSet, NodeStore, SparseFileNodeStore
+
+
+@pytest.mark.parametrize("store_class", [NodeStore, DenseFileNodeStore, SparseFileNodeStore])
+def test_lookup_matches_get(store_class):
+    rng = np.random.RandomState(3)
+    ids = rng.choice(200000, 5000, replace=False)
+    lats = rng.uniform(-90, 90, len(ids)).round(7)
+    lons = rng.uniform(-180, 180, len(ids)).round(7)
+    store = store_class()
+    # unsorted, with a node given twice, the last one wins
+    for node_id, lat, lon in zip(ids.tolist(), lats.tolist(), lons.tolist()):
+        store.add(node_id, lat, lon)
+    store.add(int(ids[0]), 1.5, 2.5)
+    wanted = np.concatenate([ids[::3], rng.randint(0, 200000, 1000), [-1, 0, 10 ** 12]])
+    found_lats, found_lons = store.lookup(wanted)
+    for node_id, lat, lon in zip(wanted.tolist(), found_lats.tolist(), found_lons.tolist()):
+        node = store.get(node_id)
+        if node is None:
+            assert np.isnan(lat) and np.isnan(lon)
+        else:
+            assert (lat, lon) == node[:2]
+    assert store.lookup([ids[0]])[0][0] == 1.5
+    store.close()
+
+
+def test_lookup_empty_store():
+    lats, lons = NodeStore().lookup(np.array([1, 2], dtype=np.int64))
+    assert np.isnan(lats).all() and np.isnan(lons).all()
+
+
+def test_dense_file_rejects_negative_ids():
+    store = DenseFileNodeStore()
+    store.add(5, 1.0, 2.0)
+    with pytest.raises(Exception, match="Negative node id -5"):
+        store.add(-5, 1.0, 2.0)
+    assert len(store) == 1 and -5 not in store and store.get(5)[:2] == (1.0, 2.0)
+    store.close()
+
+
+@pytest.mark.parametrize("store_class", [NodeStore, SparseFileNodeStore])
+def test_negative_ids(store_class):
+    store = store_class()
+    for node_id in (-3, 7, -1):
+        store.add(node_id, node_id * 0.5, 1.0)
+    assert store.get(-3)[:2] == (-1.5, 1.0)
+    assert store.lookup([-1, -2, 7])[0].tolist()[::2] == [-0.5, 3.5]
+    store.close()
+
+
+def test_id_set_pages():
+    ids = IdSet()
+    # both sides of page boundaries, negative, large and repeated ids
+    added = [0, 7, 8, 65535, 65536, 65537, 131071, 131072, -1, -65536, -65537, 2 ** 40, 2 ** 40 + 65535, 65536]
+    for node_id in added:
+        ids.add(node_id)
+    assert len(ids) == len(set(added))
+    assert all(node_id in ids for node_id in added)
+    missing = [1, 6, 9, 65534, 65538, 131070, 131073, -2, -65535, 2 ** 40 + 1, 2 ** 40 + 65536, 2 ** 41]
+    assert not any(node_id in ids for node_id in missing)
+
+
+def test_id_set_sparse():
+    rng = np.random.RandomState(8)
+    added = set(rng.randint(0, 2 ** 42, 3000).tolist()) | set(range(10 ** 9, 10 ** 9 + 70000, 3))
+    ids = IdSet()
+    for node_id in added:
+        ids.add(node_id)
+    assert len(ids) == len(added)
+    assert all(node_id in ids for node_id in added)
+    others = set(rng.randint(0, 2 ** 42, 3000).tolist()) | set(range(10 ** 9 + 1, 10 ** 9 + 70000, 3))
+    assert not any(node_id in ids for node_id in others - added)
+    # one page per 65536 ids in use, not per id
+    assert len(ids.pages) <= 3000 + 70000 // 65536 + 2
+
+
+REFERENCED = """<osm version="0.6">
+<node id="1" lat="0.0" lon="0.0"/>
+<node id="2" lat="0.0" lon="0.0003"/>
+<node id="65536" lat="0.0003" lon="0.0003"/>
+<node id="65537" lat="0.0003" lon="0.0"/>
+<node id="5" lat="0.001" lon="0.0"/>
+<node id="6" lat="0.001" lon="0.001"/>
+<node id="7" lat="0.002" lon="0.0"/>
+<node id="8" lat="0.002" lon="0.001"/>
+<node id="9" lat="0.003" lon="0.0"><tag k="amenity" v="bench"/></node>
+<node id="10" lat="0.004" lon="0.0"/>
+<node id="1099511627776" lat="0.0" lon="0.002"/>
+<node id="1099511627777" lat="0.0" lon="0.0025"/>
+<node id="1099511627778" lat="0.0005" lon="0.0025"/>
+<way id="1"><nd ref="1"/><nd ref="2"/><nd ref="65536"/><nd ref="65537"/><nd ref="1"/><tag k="building" v="yes"/></way>
+<way id="2"><nd ref="5"/><nd ref="6"/><tag k="highway" v="residential"/></way>
+<way id="3"><nd ref="7"/><nd ref="8"/></way>
+<way id="4"><nd ref="8"/><nd ref="10"/><tag k="note" v="unclassified"/></way>
+<way id="5"><nd ref="1099511627776"/><nd ref="1099511627777"/><nd ref="1099511627778"/><nd ref="1099511627776"/>
+<tag k="natural" v="water"/></way>
+<relation id="1"><member type="way" ref="3" role=""/><tag k="type" v="route"/></relation>
+</osm>"""
+
+
+@pytest.mark.parametrize("options", [{}, {"importHighways": True}, {"useCache": True}])
+def test_referenced_nodes_only(tmp_path, run_import, options):
+    filename = tmp_path / "referenced.osm"
+    filename.write_text(REFERENCED, encoding="utf-8")
+    if options.get("useCache"):
+        options = dict(options, cacheDir=str(tmp_path / "cache"))
+    expected = {1, 2, 65536, 65537, 1099511627776, 1099511627777, 1099511627778}
+    if options.get("importHighways"):
+        expected |= {5, 6}
+    full = run_import(str(filename), **options)
+    referenced = run_import(str(filename), referencedNodesOnly=True, **options)
+    # only the nodes of the ways some handler imports are stored, the output is the same
+    assert full.stats.counts["nodes"] == REFERENCED.count("<node ")
+    assert referenced.stats.counts["nodes"] == len(expected)
+    if not options.get("useCache"):
+        node_ids = [int(node_id) for node_id in re.findall(r'<node id="(\d+)"', REFERENCED)]
+        assert {node_id for node_id in node_ids if node_id in referenced.node_filter} == expected
+        assert len(referenced.node_filter) == len(expected)
+    meshes = sorted((name, buf.feature_ids[0], np.round(buf.co, 3).tolist()) for tile, name, buf, merged in full.meshes)
+    assert meshes == sorted((name, buf.feature_ids[0], np.round(buf.co, 3).tolist())
+                            for tile, name, buf, merged in referenced.meshes)
+    assert len(meshes) == (3 if options.get("importHighways") else 2)
@@ -0,0 +1,122 @@
+import os
+from array import array
+import pytest
+from import_osm import pbf
+from import_osm.reader import readers
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# the same file converted to PBF with dense nodes and with plain nodes, four elements per block
+PBF_FILES = ("small.osm.pbf", "small-nodes.osm.pbf")
+NODE_TAGS = {"natural", "name", "highway", "amenity", "note"}
+
+
+class Recorder:
+    """Nodes, ways, relations and bounds given to the element handlers of a reader"""
+
+    def __init__(self):
+        self.nodes = {}
+        self.points = {}
+        self.ways = []
+        self.relations = []
+        self.bounds = None
+        self.current = None
+        self.handlers = {
+            "osm": lambda attrib: None,
+            "bounds": self.start_bounds,
+            "node": self.start_node,
+            "way": self.start_way,
+            "relation": self.start_relation,
+            "nd": self.start_nd,
+            "member": self.start_member,
+            "tag": self.start_tag,
+        }
+
+    def start_bounds(self, attrib):
+        self.bounds = {k: float(attrib[k]) for k in ("minlat", "minlon", "maxlat", "maxlon")}
+
+    def start_node(self, attrib):
+        self.current = {}
+        self.nodes[int(attrib["id"])] = (float(attrib["lat"]), float(attrib["lon"]), self.current)
+
+    def start_way(self, attrib):
+        self.current = {}
+        self.ways.append((int(attrib["id"]), [], self.current))
+
+    def start_relation(self, attrib):
+        self.current = {}
+        self.relations.append((int(attrib["id"]), [], self.current))
+
+    def start_nd(self, attrib):
+        self.ways[-1][1].append(int(attrib["ref"]))
+
+    def start_member(self, attrib):
+        self.relations[-1][1].append((attrib["type"], int(attrib["ref"]), attrib["role"]))
+
+    def start_tag(self, attrib):
+        self.current[attrib["k"]] = attrib["v"]
+
+    def add_nodes(self, ids, lats, lons, tagged):
+        for node_id, lat, lon in zip(array("q", ids), array("d", lats), array("d", lons)):
+            self.nodes[node_id] = (lat, lon, tagged[node_id][2] if node_id in tagged else {})
+        self.points.update(tagged)
+
+
+def read_xml(engine):
+    recorder = Recorder()
+    with open(os.path.join(DATA, "small.osm"), "rb") as xml_f:
+        readers[engine](xml_f, recorder.handlers)
+    return recorder
+
+
+def read_pbf(name, workers=1):
+    recorder = Recorder()
+    pbf.read_pbf(os.path.join(DATA, name), recorder.handlers, recorder.add_nodes, workers,
+                 node_tags=NODE_TAGS)
+    return recorder
+
+
+@pytest.mark.parametrize("engine", ["EXPAT", "ETREE"])
+@pytest.mark.parametrize("name", PBF_FILES)
+def test_pbf_matches_xml(engine, name):
+    xml = read_xml(engine)
+    decoded = read_pbf(name)
+    # the coordinates are the same floats, not just close ones
+    assert decoded.nodes == xml.nodes
+    assert decoded.ways == xml.ways
+    assert decoded.relations == xml.relations
+    assert decoded.bounds == xml.bounds
+
+
+def test_pbf_node_filters():
+    # nodes with one of the node tags are points whether the node filter passes them or not
+    recorder = Recorder()
+    pbf.read_pbf(os.path.join(DATA, "small.osm.pbf"), recorder.handlers, recorder.add_nodes,
+                 bbox=(-33.859, -33.85, 151.2, 151.22), node_filter={101, 102, 4294967298},
+                 node_tags={"natural", "highway"})
+    assert sorted(recorder.nodes) == [101, 102]
+    assert sorted(recorder.points) == [105, 120]
+    assert recorder.points[105][2] == {"natural": "tree"}
+
+
+def test_pbf_parallel_matches_serial():
+    serial = read_pbf("small.osm.pbf")
+    parallel = read_pbf("small.osm.pbf", workers=2)
+    assert (parallel.nodes, parallel.ways, parallel.relations) == (serial.nodes, serial.ways, serial.relations)
+
+
+def node_store(pipeline):
+    nodes = pipeline.nodes
+    return sorted(zip(nodes.ids, nodes.lats, nodes.lons))
+
+
+@pytest.mark.parametrize("name, workers", [("small.osm", 2), ("small.osm.pbf", 1), ("small.osm.pbf", 2)])
+def test_referenced_nodes_match_serial(run_import, name, workers):
+    # tagged nodes no way refers to are points only, in the node store of no reader
+    options = {"referencedNodesOnly": True, "importPoints": True, "importHighways": True}
+    serial = run_import(os.path.join(DATA, "small.osm"), **options)
+    other = run_import(os.path.join(DATA, name), parallelWorkers=workers, **options)
+    assert node_store(other) == node_store(serial)
+    assert 105 not in serial.nodes.ids
+    assert [(cloud[1], cloud[2].tolist()) for cloud in other.clouds] == \
+        [(cloud[1], cloud[2].tolist()) for cloud in serial.clouds]
+    assert serial.clouds
@@ -0,0 +1,111 @@
+import random
+import numpy as np
+import pytest
+from import_osm import relations
+
+
+def test_join_rings_reversed_and_out_of_order():
+    ways = [[1, 2, 3], [5, 6, 1], [5, 4, 3], [10, 11, 12, 10]]
+    rings, unclosed = relations.join_rings(ways)
+    assert unclosed == 0
+    assert rings[0] == [10, 11, 12, 10]
+    ring = rings[1]
+    assert ring[0] == ring[-1] and len(ring) == 7 and sorted(ring[:-1]) == [1, 2, 3, 4, 5, 6]
+    # consecutive refs of the ring are consecutive in one of the ways
+    pairs = {frozenset(pair) for refs in ways[:3] for pair in zip(refs, refs[1:])}
+    assert all(frozenset(pair) in pairs for pair in zip(ring, ring[1:]))
+
+
+def test_join_rings_skips_unclosed():
+    rings, unclosed = relations.join_rings([[1, 2, 3], [3, 4], [7, 8, 9, 7], [20]])
+    assert rings == [[7, 8, 9, 7]]
+    assert unclosed == 2
+
+
+def square(x, y, size):
+    return np.array([(x, y), (x + size, y), (x + size, y + size), (x, y + size)], dtype=np.float64)
+
+
+def shoelace(xy):
+    return 0.5 * float(np.dot(xy[:, 0], np.roll(xy[:, 1], -1)) - np.dot(np.roll(xy[:, 0], -1), xy[:, 1]))
+
+
+def crossings(xy):
+    # edges crossing each other in their interiors, edges meeting at a vertex don't count
+    def orient(a, b, c):
+        return np.sign((b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0]))
+    edges = [(tuple(xy[i]), tuple(xy[(i + 1) % len(xy)])) for i in range(len(xy))]
+    count = 0
+    for i, (a, b) in enumerate(edges):
+        for c, d in edges[i + 1:]:
+            if {a, b} & {c, d}:
+                continue
+            if orient(a, b, c) * orient(a, b, d) < 0 and orient(c, d, a) * orient(c, d, b) < 0:
+                count += 1
+    return count
+
+
+def star(n, rng):
+    # a non-convex outer ring around (5, 5) reaching beyond the 10 x 10 grid of holes
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    radius = np.where(np.arange(n) % 2, 9.0, 11.0 + rng.random() * 3)
+    return np.column_stack((5 + radius * np.cos(angles), 5 + radius * np.sin(angles)))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_bridged_polygon_is_simple(seed):
+    rng = random.Random(seed)
+    outer = star(2 * rng.randrange(4, 12), rng) if seed % 2 else square(-1, -1, 12)
+    if rng.random() < 0.5:
+        outer = outer[::-1]
+    holes = []
+    for cell in rng.sample(range(100), rng.randrange(1, 12)):
+        x, y = cell % 10 + 0.2 * rng.random(), cell // 10 + 0.2 * rng.random()
+        hole = square(x, y, 0.5) if rng.random() < 0.5 else np.array([(x, y), (x + 0.6, y + 0.1), (x + 0.3, y + 0.7)])
+        holes.append(hole[::-1] if rng.random() < 0.5 else hole)
+    # positions into one array of all the points, the outer ring first
+    xy = np.concatenate([outer] + holes)
+    starts = np.cumsum([0, len(outer)] + [len(hole) for hole in holes])
+    points = relations.bridge_holes(list(range(len(outer))), outer,
+                                    [(list(range(starts[k + 1], starts[k + 2])), hole) for k, hole in enumerate(holes)])
+    ring = xy[points]
+    # every vertex is there, the holes once and a bridge end twice per hole
+    assert sorted(set(points)) == list(range(len(xy)))
+    assert len(points) == len(xy) + 2 * len(holes)
+    assert abs(shoelace(ring)) == pytest.approx(abs(shoelace(outer)) - sum(abs(shoelace(hole)) for hole in holes))
+    assert shoelace(ring) > 0
+    assert crossings(ring) == 0
+
+
+def write_relation(path):
+    # a large and a small outer ring inside it, a hole inside the small one and one outside all
+    # the large one has 5 vertices, to tell the rings apart by their vertex counts
+    rings = [np.insert(square(0, 0, 0.01), 1, (0.005, 0), axis=0), square(0.002, 0.002, 0.004),
+             square(0.003, 0.003, 0.001), square(0.02, 0.02, 0.001)]
+    lines = ['<osm version="0.6">', '<bounds minlat="0" minlon="0" maxlat="0.03" maxlon="0.03"/>']
+    node_id = 0
+    for n, ring in enumerate(rings):
+        refs = []
+        for lon, lat in ring:
+            node_id += 1
+            refs.append(node_id)
+            lines.append('<node id="%d" lat="%.7f" lon="%.7f"/>' % (node_id, lat, lon))
+        rings[n] = refs + refs[:1]
+    for n, refs in enumerate(rings):
+        lines.append('<way id="%d">' % (n + 1))
+        lines.extend('<nd ref="%d"/>' % ref for ref in refs)
+        lines.append("</way>")
+    lines.append('<relation id="1">')
+    for n, role in enumerate(("outer", "outer", "inner", "inner")):
+        lines.append('<member type="way" ref="%d" role="%s"/>' % (n + 1, role))
+    lines.extend(['<tag k="type" v="multipolygon"/>', '<tag k="landuse" v="forest"/>', "</relation>", "</osm>"])
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def test_hole_goes_to_the_smallest_outer_ring(tmp_path, run_import):
+    filename = tmp_path / "relation.osm"
+    write_relation(filename)
+    pipeline = run_import(str(filename), importRelations=True)
+    # the large ring alone, the small one with the hole and its bridge
+    assert sorted(mesh.vertex_count() for tile, name, mesh, merged in pipeline.meshes) == [5, 10]
+    assert pipeline.stats.skipped["multipolygon inner ring outside the outer rings"] == 1
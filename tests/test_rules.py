@@ -0,0 +1,111 @@
+import itertools
+import json
+import pytest
+from import_osm.rules import DEFAULT_RULES, WayClassifier, load_rules
+
+HANDLERS = ("buildings", "building_parts", "amenity", "highways", "barrier", "naturals", "landuse")
+OPTIONS = ("importBuildings", "importHighways", "importBarriers", "importNaturals", "importLanduse")
+HIGHWAY_KEYS = ("highway", "cycleway", "bicycle", "aerialway", "aeroway", "busway", "railway", "waterway")
+KEYS = ("building", "building:part", "amenity", "highway", "railway", "barrier", "natural", "landuse",
+        "leisure", "man_made", "name")
+
+
+def classifier(rules=DEFAULT_RULES, disabled=()):
+    # the handlers are their names
+    return WayClassifier(rules, {name: name for name in HANDLERS}, lambda option: option not in disabled)
+
+
+def way_handlers(tags, enabled):
+    """The handler chain the rules replaced"""
+    handlers = []
+    if tags.get("building") and enabled["importBuildings"]:
+        handlers.append("buildings")
+    if tags.get("building:part") and enabled["importBuildings"]:
+        handlers.append("building_parts")
+    if not handlers and tags.get("amenity") and enabled["importBuildings"]:
+        handlers.append("amenity")
+    if any(tags.get(key) for key in HIGHWAY_KEYS) and enabled["importHighways"]:
+        handlers.append("highways")
+    if tags.get("barrier") and enabled["importBarriers"]:
+        handlers.append("barrier")
+    if tags.get("natural") and enabled["importNaturals"]:
+        handlers.append("naturals")
+    if tags.get("landuse") and enabled["importLanduse"]:
+        handlers.append("landuse")
+    elif (tags.get("leisure") and enabled["importLanduse"]
+          and "buildings" not in handlers and "building_parts" not in handlers):
+        handlers.append("landuse")
+    if not handlers and tags.get("man_made") and enabled["importHighways"]:
+        handlers.append("highways")
+    return tuple(handlers)
+
+
+@pytest.mark.parametrize("tags, handlers", [
+    ({"building": "yes", "amenity": "school"}, ("buildings",)),
+    ({"amenity": "parking"}, ("amenity",)),
+    ({"amenity": "parking", "barrier": "fence"}, ("amenity", "barrier")),
+    ({"man_made": "pier"}, ("highways",)),
+    ({"man_made": "pier", "natural": "water"}, ("naturals",)),
+    ({"leisure": "park"}, ("landuse",)),
+    ({"leisure": "sports_centre", "building": "yes"}, ("buildings",)),
+    ({"leisure": "pitch", "building:part": "yes"}, ("building_parts",)),
+    ({"leisure": "park", "landuse": "grass"}, ("landuse",)),
+    ({"building": "yes", "building:part": "yes", "highway": "footway", "barrier": "wall", "natural": "rock",
+      "landuse": "residential"}, ("buildings", "building_parts", "highways", "barrier", "naturals", "landuse")),
+    ({"railway": "rail", "waterway": "canal"}, ("highways",)),
+    ({"building": ""}, ()),
+    ({"name": "Main Street"}, ()),
+])
+def test_default_rules(tags, handlers):
+    assert classifier().classify(tags) == handlers
+
+
+def test_disabled_options():
+    assert classifier(disabled={"importBuildings"}).classify({"building": "yes", "leisure": "park"}) == ("landuse",)
+    assert classifier(disabled={"importHighways"}).classify({"man_made": "pier", "highway": "path"}) == ()
+
+
+def test_rules_match_the_handler_chain():
+    # every combination of the options and of up to 3 keys, in the same order
+    for disabled in itertools.chain.from_iterable(itertools.combinations(OPTIONS, n) for n in range(len(OPTIONS) + 1)):
+        rules = classifier(disabled=set(disabled))
+        enabled = {option: option not in disabled for option in OPTIONS}
+        for n in range(1, 4):
+            for keys in itertools.combinations(KEYS, n):
+                tags = {key: "yes" for key in keys}
+                assert rules.classify(tags) == way_handlers(tags, enabled), (disabled, tags)
+
+
+def test_user_rules(tmp_path):
+    filename = tmp_path / "rules.json"
+    filename.write_text(json.dumps([
+        # replaces the built-in man_made fallback, only piers and as barriers
+        {"name": "man_made", "handler": "barrier", "option": "importBarriers", "keys": ["man_made"],
+         "values": ["pier"]},
+        {"handler": "highways", "keys": ["power"], "values": ["line"], "priority": 45},
+    ]), encoding="utf-8")
+    rules = load_rules(str(filename))
+    assert len(rules) == len(DEFAULT_RULES) + 1
+    assert [rule for rule in rules if rule.get("name") == "man_made"][0]["handler"] == "barrier"
+    ways = classifier(rules)
+    assert ways.classify({"man_made": "pier"}) == ("barrier",)
+    assert ways.classify({"man_made": "tower"}) == ()
+    assert ways.classify({"man_made": "pier", "building": "yes"}) == ("buildings", "barrier")
+    assert ways.classify({"power": "line", "barrier": "fence"}) == ("highways", "barrier")
+    assert ways.classify({"power": "tower"}) == ()
+
+
+@pytest.mark.parametrize("content, message", [
+    ({"name": "x"}, "must contain a list"),
+    ([{"handler": "highways"}], "needs a handler and keys"),
+])
+def test_bad_rules_files(tmp_path, content, message):
+    filename = tmp_path / "rules.json"
+    filename.write_text(json.dumps(content), encoding="utf-8")
+    with pytest.raises(Exception, match=message):
+        load_rules(str(filename))
+
+
+def test_unknown_handler():
+    with pytest.raises(Exception, match="Unknown handler: roads"):
+        classifier([{"name": "roads", "handler": "roads", "keys": ["highway"]}])
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from import_osm import simplify
+
+# simple, but the outline simplified at 2.5 m cuts through the notch of the top edge
+NOTCHED = np.array([(0, 0), (3, 5), (4.8, 1), (5.2, 1), (7, 5), (10, 0), (10, 10), (6, 10), (5, 2), (4, 10), (0, 10)],
+                   dtype=np.float64)
+
+
+def noisy_rings(count, seed):
+    # rings around separate centres, radii jittered so that no three points are collinear
+    rng = np.random.RandomState(seed)
+    counts = rng.randint(3, 60, count)
+    rings = []
+    for k, n in enumerate(counts):
+        angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        radius = 50 * (1 + 0.2 * rng.uniform(-1, 1, n))
+        rings.append(np.column_stack((k * 200 + radius * np.cos(angles), radius * np.sin(angles))))
+    return np.concatenate(rings), counts
+
+
+def test_zero_tolerance_keeps_everything():
+    xy, counts = noisy_rings(20, 1)
+    assert simplify.simplify_rings(xy, counts, np.arange(len(xy)), 0.0).all()
+
+
+@pytest.mark.parametrize("tolerance", [1.0, 10.0, 1000.0])
+def test_rings_keep_three_points_and_their_start(tolerance):
+    xy, counts = noisy_rings(50, 2)
+    keep = simplify.simplify_rings(xy, counts, np.arange(len(xy)), tolerance)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    kept = np.add.reduceat(keep, starts)
+    assert (kept >= 3).all()
+    # the ring closes at its first point, which is always kept
+    assert keep[starts].all()
+    assert not simplify.crossing(xy[keep], kept, np.arange(len(xy))[keep]).any()
+    if tolerance >= 10:
+        assert kept.sum() < len(xy)
+
+
+def test_repeated_points_are_kept():
+    # a square of 40 points with a bridge to a triangular hole, there and back through the same nodes
+    side = np.linspace(0, 100, 10, endpoint=False)
+    outer = np.concatenate([np.column_stack((side, np.zeros(10))), np.column_stack((np.full(10, 100), side)),
+                            np.column_stack((100 - side, np.full(10, 100))), np.column_stack((np.zeros(10), 100 - side))])
+    outer_ids = np.arange(40)
+    hole = np.array([(40, 40), (40, 60), (60, 50)], dtype=np.float64)
+    hole_ids = np.array([100, 101, 102])
+    # bridged from outer point 35 (0, 50) to the hole point (40, 40)
+    xy = np.concatenate([outer[:36], hole, hole[:1], outer[35:]])
+    ids = np.concatenate([outer_ids[:36], hole_ids, hole_ids[:1], outer_ids[35:]])
+    keep = simplify.simplify_rings(xy, [len(xy)], ids, 30.0)
+    bridge = np.isin(ids, [35, 100])
+    assert keep[bridge].all() and bridge.sum() == 4
+    assert keep.sum() < len(xy)
+
+
+def test_crossing_outline_is_simplified_again(monkeypatch):
+    ids = np.arange(len(NOTCHED))
+    first = simplify.douglas_peucker(NOTCHED, [len(NOTCHED)], 2.5)
+    assert simplify.crossing(NOTCHED[first], [first.sum()], ids[first]).all()
+    tolerances = []
+    douglas_peucker = simplify.douglas_peucker
+
+    def recorded(xy, counts, tolerance, fixed=None):
+        tolerances.append(tolerance)
+        return douglas_peucker(xy, counts, tolerance, fixed)
+
+    monkeypatch.setattr(simplify, "douglas_peucker", recorded)
+    keep = simplify.simplify_rings(NOTCHED, [len(NOTCHED)], ids, 2.5)
+    assert tolerances == [2.5, 1.25]
+    assert (keep == douglas_peucker(NOTCHED, [len(NOTCHED)], 1.25)).all()
+    assert keep.sum() < len(NOTCHED)
+    assert not simplify.crossing(NOTCHED[keep], [keep.sum()], ids[keep]).any()
+
+
+def write_wood(path, n=400, seed=3):
+    # one wiggly natural=wood ring of about 1 km
+    rng = np.random.RandomState(seed)
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    radius = 0.005 * (1 + 0.05 * rng.uniform(-1, 1, n))
+    lines = ['<osm version="0.6">', '<bounds minlat="-0.01" minlon="-0.01" maxlat="0.01" maxlon="0.01"/>']
+    for k, (lat, lon) in enumerate(zip(radius * np.sin(angles), radius * np.cos(angles))):
+        lines.append('<node id="%d" lat="%.7f" lon="%.7f"/>' % (k + 1, lat, lon))
+    lines.append('<way id="1">')
+    lines.extend('<nd ref="%d"/>' % (k % n + 1) for k in range(n + 1))
+    lines.extend(['<tag k="natural" v="wood"/>', "</way>", "</osm>"])
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def test_lod_levels_get_coarser(tmp_path, run_import):
+    filename = tmp_path / "wood.osm"
+    write_wood(filename)
+    pipeline = run_import(str(filename), simplifyTolerance=2.0, lodLevels=4)
+    meshes = {name: np.asarray(mesh.co).reshape(-1, 3) for tile, name, mesh, merged in pipeline.meshes}
+    assert sorted(meshes) == ["1", "1 LOD1", "1 LOD2", "1 LOD3"]
+    levels = [{tuple(v) for v in meshes[name].tolist()} for name in ("1", "1 LOD1", "1 LOD2", "1 LOD3")]
+    assert len(levels[0]) < 400
+    for finer, coarser in zip(levels, levels[1:]):
+        assert coarser < finer
+    assert len(levels[-1]) >= 3
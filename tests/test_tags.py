@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from import_osm.tags import StringTable, TagArrays, parse_length, tag_list
+
+
+@pytest.mark.parametrize("value, metres", [
+    ("12", 12.0),
+    ("12.5 m", 12.5),
+    ("3,5", 3.5),
+    ("10 M", 10.0),
+    ("6'", 6 * 0.3048),
+    ("6 ft", 6 * 0.3048),
+    ("6'6\"", 6 * 0.3048 + 6 * 0.0254),
+    ("6ft 6in", 6 * 0.3048 + 6 * 0.0254),
+    ("6 ft 6", 6 * 0.3048 + 6 * 0.0254),
+    ("5 in", 5 * 0.0254),
+])
+def test_parse_length(value, metres):
+    assert parse_length(value) == pytest.approx(metres)
+
+
+@pytest.mark.parametrize("value, metres", [
+    ("12 m;15 m", 12.0),
+    ("20 m approx", 20.0),
+    ("10 storeys", 10.0),
+    ("12 km", 12.0),
+    ("12m 5", 12.0),
+])
+def test_parse_length_falls_back_to_leading_number(value, metres):
+    assert parse_length(value) == metres
+
+
+@pytest.mark.parametrize("value", ["", "abc", "unknown", "-3"])
+def test_parse_length_without_number(value):
+    assert parse_length(value) is None
+
+
+def write_osm(path, ways):
+    # a 10 m square per way, its four nodes first
+    lines = ['<osm version="0.6">', '<bounds minlat="0" minlon="0" maxlat="0.01" maxlon="0.01"/>']
+    for n, tags in enumerate(ways):
+        lat = 0.001 * n
+        for k, (dlat, dlon) in enumerate([(0, 0), (0, 0.0001), (0.0001, 0.0001), (0.0001, 0)]):
+            lines.append('<node id="%d" lat="%.7f" lon="%.7f"/>' % (n * 4 + k + 1, lat + dlat, dlon))
+    for n, tags in enumerate(ways):
+        lines.append('<way id="%d">' % (n + 1))
+        lines.extend('<nd ref="%d"/>' % (n * 4 + k + 1) for k in (0, 1, 2, 3, 0))
+        lines.extend('<tag k="%s" v="%s"/>' % item for item in tags.items())
+        lines.append("</way>")
+    lines.append("</osm>")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def test_import_with_bad_heights(tmp_path, run_import):
+    filename = tmp_path / "heights.osm"
+    write_osm(filename, [
+        {"building": "yes", "height": "unknown"},
+        {"building": "yes", "height": "unknown", "building:levels": "2"},
+        {"building": "yes", "height": "12 m;15 m"},
+        {"building:part": "yes", "height": "abc", "min_height": "?"},
+        {"barrier": "wall", "height": "tall"},
+    ])
+    pipeline = run_import(str(filename))
+    tops = {}
+    for tile, name, mesh, merged in pipeline.meshes:
+        tops[mesh.feature_ids[0]] = float(np.asarray(mesh.co).reshape(-1, 3)[:, 2].max())
+    # without a number the height counts as missing, the defaults and building:levels apply
+    assert tops == {"1": 3.0, "2": 6.0, "3": 12.0, "4": 0.0, "5": 0.5}
+
+
+def test_tag_list():
+    tags = [{"building": "yes", "height": "12"}, {}, {"name": "A"}]
+    strings = StringTable(["name"])
+    arrays = tag_list(strings)
+    assert isinstance(arrays, TagArrays)
+    arrays.extend(tags)
+    assert [arrays[i] for i in range(len(arrays))] == tags
+    assert strings.strings[0] == "name"
+    dicts = tag_list(None)
+    dicts.extend(tags)
+    assert dicts == tags
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from import_osm import tiles
+from test_cache import open_cache, write_ways
+
+
+def expected_ways(data, index, bbox):
+    # every way in the tile of its bounding box center, the tiles touching the window
+    positions = {int(node_id): n for n, node_id in enumerate(data.node_ids)}
+    rows = range(int((bbox[0] + 90.0) // index.dlat), int((bbox[1] + 90.0) // index.dlat) + 1)
+    columns = range(int((bbox[2] + 180.0) // index.dlon), int((bbox[3] + 180.0) // index.dlon) + 1)
+    ways = []
+    for n, (way_id, refs, tags) in enumerate(data.ways()):
+        nodes = [positions[ref] for ref in refs]
+        lat = (data.node_lats[nodes].min() + data.node_lats[nodes].max()) * 0.5
+        lon = (data.node_lons[nodes].min() + data.node_lons[nodes].max()) * 0.5
+        if int((lat + 90.0) // index.dlat) in rows and int((lon + 180.0) // index.dlon) in columns:
+            ways.append(n)
+    return ways
+
+
+@pytest.mark.parametrize("chunk", [7, tiles.INDEX_CHUNK])
+@pytest.mark.parametrize("bbox", [(0.01, 0.02, 0.02, 0.03), (0.0, 0.002, 0.0, 0.002), (-1.0, 1.0, -1.0, 1.0)])
+def test_tile_window(tmp_path, monkeypatch, chunk, bbox):
+    monkeypatch.setattr(tiles, "INDEX_CHUNK", chunk)
+    filename = tmp_path / "ways.osm"
+    write_ways(filename)
+    data = open_cache(filename, tmp_path / "cache")
+    index = tiles.build_index(data, 500.0)
+    assert tiles.open_index(data, 500.0).tile_keys.tolist() == index.tile_keys.tolist()
+    keys = index.tiles(bbox)
+    ways = np.concatenate([index.ways(key) for key in keys]) if keys else np.zeros(0, dtype=np.int64)
+    assert len(keys) <= len(ways) <= len(data)
+    assert sorted(ways.tolist()) == expected_ways(data, index, bbox)
+    ids, lats, lons = index.nodes(data, ways)
+    refs = {ref for n in ways.tolist() for ref in data.refs[data.ref_starts[n]:data.ref_starts[n + 1]].tolist()}
+    assert sorted(ids.tolist()) == sorted(refs)
+
+
+def test_tiled_import(tmp_path, run_import):
+    filename = tmp_path / "ways.osm"
+    write_ways(filename)
+    window = {"minLat": 0.01, "maxLat": 0.02, "minLon": 0.02, "maxLon": 0.03}
+    pipeline = run_import(str(filename), tiledImport=True, tileSize=500.0, cacheDir=str(tmp_path / "cache"), **window)
+    data = open_cache(filename, tmp_path / "cache")
+    index = tiles.open_index(data, 500.0)
+    expected = expected_ways(data, index, (0.01, 0.02, 0.02, 0.03))
+    assert 0 < len(expected) < len(data)
+    assert sorted(int(mesh.feature_ids[0]) for tile, name, mesh, merged in pipeline.meshes) == \
+        sorted(int(data.way_ids[n]) for n in expected)
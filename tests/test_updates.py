@@ -0,0 +1,242 @@
+import gzip
+import json
+import os
+import numpy as np
+import pytest
+from import_osm import updates
+from import_osm.reader import readers
+from conftest import MeshRecorder
+
+CHANGE = """<osmChange version="0.6">
+<create>
+ <node id="10" lat="1.5" lon="2.5"/>
+ <way id="3"><nd ref="10"/><nd ref="11"/><tag k="highway" v="path"/></way>
+</create>
+<modify>
+ <node id="1" lat="1.25" lon="2.25"><tag k="natural" v="tree"/></node>
+ <way id="1"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="1"/><tag k="building" v="yes"/></way>
+ <relation id="7"><member type="way" ref="1" role="outer"/><tag k="type" v="multipolygon"/></relation>
+</modify>
+<delete>
+ <node id="2"/>
+ <way id="2"/>
+</delete>
+</osmChange>"""
+
+
+@pytest.mark.parametrize("name", ["change.osc", "change.osc.gz"])
+def test_change_reader(tmp_path, name):
+    path = tmp_path / name
+    data = CHANGE.encode("utf-8")
+    path.write_bytes(gzip.compress(data) if name.endswith(".gz") else data)
+    assert updates.is_change_file(str(path))
+    changes = updates.ChangeReader()
+    f = updates.open_change_file(str(path), lambda position: None)
+    try:
+        readers["EXPAT"](f, changes.handlers())
+    finally:
+        f.close()
+    assert changes.nodes == {10: (1.5, 2.5), 1: (1.25, 2.25), 2: None}
+    assert changes.ways == {3: ([10, 11], {"highway": "path"}), 1: ([1, 2, 3, 1], {"building": "yes"}), 2: None}
+    assert changes.relations == 1
+
+
+def square(lat, lon, size=0.0003):
+    return [(lat, lon), (lat, lon + size), (lat + size, lon + size), (lat + size, lon)]
+
+
+def base_data():
+    # a grid of buildings and two roads, the nodes of the second road shared with the first
+    nodes = {}
+    ways = {}
+    for n in range(24):
+        ids = []
+        for lat, lon in square(0.001 * (n // 6), 0.001 * (n % 6)):
+            ids.append(len(nodes) + 1)
+            nodes[ids[-1]] = (lat, lon)
+        ways[n + 1] = (ids + ids[:1], {"building": "yes", "building:levels": str(1 + n % 4)})
+    road = []
+    for n in range(8):
+        road.append(len(nodes) + 1)
+        nodes[road[-1]] = (0.0005 + 0.001 * (n % 4), 0.0005 + 0.0007 * n)
+    ways[1001] = (road, {"highway": "residential"})
+    ways[1002] = (road[2:6], {"highway": "service"})
+    return nodes, ways
+
+
+def changes(nodes, ways):
+    """Change sets in order, the new, modified or None for deleted nodes and ways"""
+    first_nodes = {
+        # a corner of a building and a road node moved
+        1: (-0.0001, -0.0001),
+        ways[1001][0][3]: (0.0042, 0.0023),
+    }
+    first_ways = {
+        2: (ways[2][0], {"building": "yes", "building:levels": "9"}),
+        3: None,
+        1002: (ways[1002][0][:3], {"highway": "service"}),
+    }
+    new = len(nodes) + 1
+    for n, (lat, lon) in enumerate(square(0.0045, 0.0015)):
+        first_nodes[new + n] = (lat, lon)
+    first_ways[2001] = ([new, new + 1, new + 2, new + 3, new], {"building": "house"})
+    second_nodes = {1: (0.0001, 0.0), new: (0.0046, 0.0016)}
+    second_ways = {
+        2001: ([new, new + 1, new + 2, new + 3, new], {"building": "garage"}),
+        4: None,
+        5: (ways[5][0], {"building": "yes", "height": "12"}),
+    }
+    return [(first_nodes, first_ways), (second_nodes, second_ways)]
+
+
+def write_osm(path, nodes, ways):
+    lines = ['<osm version="0.6">']
+    for node_id, (lat, lon) in sorted(nodes.items()):
+        lines.append('<node id="%d" lat="%.7f" lon="%.7f"/>' % (node_id, lat, lon))
+    for way_id, (refs, tags) in sorted(ways.items()):
+        lines.append('<way id="%d">' % way_id)
+        lines.extend('<nd ref="%d"/>' % ref for ref in refs)
+        lines.extend('<tag k="%s" v="%s"/>' % item for item in tags.items())
+        lines.append("</way>")
+    lines.append("</osm>")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def write_change(path, nodes, ways):
+    lines = ['<osmChange version="0.6">', "<modify>"]
+    for node_id, node in sorted(nodes.items()):
+        if node is not None:
+            lines.append('<node id="%d" lat="%.7f" lon="%.7f"/>' % (node_id, node[0], node[1]))
+    for way_id, way in sorted(ways.items()):
+        if way is not None:
+            lines.append('<way id="%d">' % way_id)
+            lines.extend('<nd ref="%d"/>' % ref for ref in way[0])
+            lines.extend('<tag k="%s" v="%s"/>' % item for item in way[1].items())
+            lines.append("</way>")
+    lines.extend(["</modify>", "<delete>"])
+    lines.extend('<way id="%d"/>' % way_id for way_id, way in sorted(ways.items()) if way is None)
+    lines.extend('<node id="%d"/>' % node_id for node_id, node in sorted(nodes.items()) if node is None)
+    lines.extend(["</delete>", "</osmChange>"])
+    data = "\n".join(lines).encode("utf-8")
+    path.write_bytes(gzip.compress(data) if str(path).endswith(".gz") else data)
+
+
+class SceneRecorder(MeshRecorder):
+    """MeshRecorder keeping the objects of a scene shared by the imports and updates, by unique name"""
+
+    def add_mesh(self, tile, name, buf, merged):
+        unique = name
+        while unique in self.scene:
+            unique = "%s.%03d" % (name, len(self.scene))
+        co = np.asarray(buf.co, dtype=np.float64).reshape(-1, 3)
+        self.scene[unique] = {
+            "co": co,
+            "ids": list(buf.feature_ids),
+            "starts": list(buf.feature_starts) + [len(co)],
+        }
+        self.index_objects(unique, buf, merged)
+        self.stats.counts["objects"] += 1
+
+    def remove_features(self, name, features):
+        obj = self.scene[name]
+        if features[0][0] < 0:
+            del self.scene[name]
+            return
+        for feature, start, count in features:
+            # the index knows the vertex range of the feature in the object
+            assert (start, count) == (obj["starts"][feature], obj["starts"][feature + 1] - obj["starts"][feature])
+            obj["ids"][feature] = ""
+
+
+def features(scene):
+    """The OSM id and vertices of every feature left in the scene"""
+    found = []
+    for obj in scene.values():
+        for feature, feature_id in enumerate(obj["ids"]):
+            if feature_id:
+                co = obj["co"][obj["starts"][feature]:obj["starts"][feature + 1]]
+                found.append((feature_id, np.round(co, 3).tolist()))
+    return sorted(found)
+
+
+def import_scene(filename, **options):
+    pipeline = SceneRecorder(scene=options.pop("scene", {}), **options)
+    pipeline.parse(str(filename))
+    pipeline.finish_index()
+    return pipeline.scene
+
+
+@pytest.mark.parametrize("merged", [False, True])
+@pytest.mark.parametrize("compact", [False, True])
+def test_updates_match_import(tmp_path, monkeypatch, merged, compact):
+    if compact:
+        monkeypatch.setattr(updates, "COMPACT_MIN", 0)
+        monkeypatch.setattr(updates, "COMPACT_SHARE", 0.0)
+    nodes, ways = base_data()
+    write_osm(tmp_path / "base.osm", nodes, ways)
+    index = str(tmp_path / "index")
+    options = {"importHighways": True, "mergeMeshes": merged}
+    scene = import_scene(tmp_path / "base.osm", updateIndex=index, **options)
+    for n, (changed_nodes, changed_ways) in enumerate(changes(nodes, ways)):
+        filename = tmp_path / ("change%d.osc" % n + (".gz" if n else ""))
+        write_change(filename, changed_nodes, changed_ways)
+        # the options come from the index
+        import_scene(filename, scene=scene, updateIndex=index)
+        nodes.update(changed_nodes)
+        ways.update(changed_ways)
+        write_osm(tmp_path / "changed.osm", {k: v for k, v in nodes.items() if v is not None},
+                  {k: v for k, v in ways.items() if v is not None})
+        assert features(scene) == features(import_scene(tmp_path / "changed.osm", **options))
+        assert os.path.exists(os.path.join(index, updates.DELTA_FILENAME)) != compact
+
+
+def test_update_index_delta(tmp_path):
+    nodes, ways = base_data()
+    write_osm(tmp_path / "base.osm", nodes, ways)
+    index = str(tmp_path / "index")
+    scene = import_scene(tmp_path / "base.osm", updateIndex=index)
+    delta = os.path.join(index, updates.DELTA_FILENAME)
+    assert not os.path.exists(delta)
+    first, second = changes(nodes, ways)
+    write_change(tmp_path / "first.osc", *first)
+    import_scene(tmp_path / "first.osc", scene=scene, updateIndex=index)
+    with open(delta, "r", encoding="utf-8") as f:
+        first_ways = {way_id for way_id, way in json.load(f)["ways"]}
+    assert {2, 3, 1002, 2001} <= first_ways
+    write_change(tmp_path / "second.osc", *second)
+    import_scene(tmp_path / "second.osc", scene=scene, updateIndex=index)
+    with open(delta, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # the delta grows by the second change, the first stays in it
+    assert first_ways | {4, 5} <= {way_id for way_id, way in data["ways"]}
+    assert dict(map(tuple, data["nodes"]))[1] == [0.0001, 0.0]
+    state = updates.open_index(index)
+    assert state.way(3) is None and state.way(4) is None
+    assert state.way(2001)[1] == {"building": "garage"}
+    assert state.way(6) == (ways[6][0], ways[6][1])
+    assert state.delta_size() == len(data["nodes"]) + len(data["ways"]) + len(data["objects"])
+    state.close()
+
+
+def test_update_index_compaction(tmp_path, monkeypatch):
+    nodes, ways = base_data()
+    write_osm(tmp_path / "base.osm", nodes, ways)
+    index = str(tmp_path / "index")
+    scene = import_scene(tmp_path / "base.osm", updateIndex=index)
+    first, second = changes(nodes, ways)
+    write_change(tmp_path / "first.osc", *first)
+    import_scene(tmp_path / "first.osc", scene=scene, updateIndex=index)
+    assert os.path.exists(os.path.join(index, updates.DELTA_FILENAME))
+    # over the threshold the index is written again without a delta
+    monkeypatch.setattr(updates, "COMPACT_MIN", 5)
+    monkeypatch.setattr(updates, "COMPACT_SHARE", 0.0)
+    write_change(tmp_path / "second.osc", *second)
+    import_scene(tmp_path / "second.osc", scene=scene, updateIndex=index)
+    assert not os.path.exists(os.path.join(index, updates.DELTA_FILENAME))
+    state = updates.open_index(index)
+    assert state.delta_size() == 0
+    assert 3 not in state.sorted_way_ids.tolist() and 4 not in state.sorted_way_ids.tolist()
+    assert state.way(2001)[1] == {"building": "garage"}
+    assert state.node(1) == (0.0001, 0.0)
+    assert state.ways_of_node(1) == {1}
+    state.close()